@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# benchmarks/fleet.py
+
+"""
+Synthetic-fleet benchmark for NGINXDomainManager.
+
+For every fleet size, generates a registry, a sites-available/sites-enabled
+tree and a Let's Encrypt live/ directory in a temporary root. Stub `nginx`,
+`certbot` and `systemctl` executables, with configurable latency, are put
+first on PATH. The harness then times the tool's fleet-wide operations
+against that tree. Nothing outside the temporary root is touched.
+
+Results are printed (and optionally written) as JSON. With --compare, each
+(size, operation) pair is checked against a previous results file, and the
+exit status is 1 if any of them got slower than the tolerance allows.
+
+Usage:
+    python benchmarks/fleet.py [--sizes 100,1000,5000] [--ops list,extract,renew,reset,fix,delete]
+                               [--nginx-latency 0.02] [--certbot-latency 0.2] [--systemctl-latency 0.01]
+                               [--json results.json] [--compare baseline.json] [--tolerance 0.25]
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_ROOT, 'src')
+sys.path.insert(0, SRC_DIR)
+
+OPERATIONS = ('list', 'extract', 'renew', 'reset', 'fix', 'delete')
+DEFAULT_SIZES = (100, 1000, 5000)
+
+STUB_PREAMBLE = '''#!/bin/sh
+echo "{name}" >> "$DM_STUB_CALLS"
+[ "${latency_var}" = "0" ] || sleep "${latency_var}"
+'''
+
+STUBS = {
+    'nginx': '',
+    'systemctl': '',
+    'certbot': '''domain=""
+action=issue
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -d|--cert-name) domain="$2"; shift ;;
+        delete) action=delete ;;
+        certificates|renew) action=none ;;
+    esac
+    shift
+done
+[ -n "$domain" ] || exit 0
+case "$action" in
+    issue) mkdir -p "$DM_STUB_LE_LIVE/$domain" && : > "$DM_STUB_LE_LIVE/$domain/fullchain.pem" \\
+               && : > "$DM_STUB_LE_LIVE/$domain/privkey.pem" ;;
+    delete) rm -rf "$DM_STUB_LE_LIVE/$domain" ;;
+esac
+''',
+}
+
+
+def write_stubs(bin_dir):
+    """Write the stub executables; each records its call and sleeps for DM_STUB_<NAME>_LATENCY seconds."""
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, body in STUBS.items():
+        path = os.path.join(bin_dir, name)
+        latency_var = f"{{DM_STUB_{name.upper()}_LATENCY:-0}}"
+        with open(path, 'w') as f:
+            f.write(STUB_PREAMBLE.format(name=name, latency_var=latency_var) + body)
+        os.chmod(path, 0o755)
+
+
+def build_config(root):
+    """Return a configuration whose every path points into `root`."""
+    from domain_manager.config import SafeLoader
+    import yaml
+
+    with open(os.path.join(SRC_DIR, 'domain_manager', 'config.yaml'), 'r') as f:
+        config = yaml.load(f, Loader=SafeLoader)
+    config.update({
+        'nginx_conf_dir': os.path.join(root, 'nginx'),
+        'sites_available': os.path.join(root, 'nginx', 'sites-available'),
+        'sites_enabled': os.path.join(root, 'nginx', 'sites-enabled'),
+        'backup_dir': os.path.join(root, 'nginx', 'backups'),
+        'state_dir': os.path.join(root, 'state'),
+        'offline': True,
+        'subdomains': {},
+    })
+    config['access_log'] = dict(config.get('access_log') or {}, dir=os.path.join(root, 'log'))
+    return config
+
+
+def generate_fleet(config, live_dir, size, cert_ratio, seed=0):
+    """Fill the registry, the vhost tree and the certificate store with `size` subdomains."""
+    from domain_manager.config import save_config
+    from domain_manager.utils.nginx_config import render_vhost
+
+    rng = random.Random(seed)
+    for directory in (config['sites_available'], config['sites_enabled'], config['backup_dir'], live_dir):
+        os.makedirs(directory, exist_ok=True)
+    registry = config['subdomains']
+    for index in range(size):
+        subdomain = f"app{index}.zone{index % 97}.example.com"
+        details = {
+            'target_ip': f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+            'target_port': str(1024 + rng.randrange(60000)),
+            'custom_options': ['client_max_body_size 10m;'] if index % 10 == 0 else [],
+        }
+        registry[subdomain] = details
+        available = os.path.join(config['sites_available'], f"{subdomain}.conf")
+        with open(available, 'w') as f:
+            f.write(render_vhost(config, subdomain, details))
+        os.symlink(available, os.path.join(config['sites_enabled'], f"{subdomain}.conf"))
+        if rng.random() < cert_ratio:
+            os.makedirs(os.path.join(live_dir, subdomain))
+            for name in ('fullchain.pem', 'privkey.pem'):
+                open(os.path.join(live_dir, subdomain, name), 'w').close()
+    save_config(config)
+
+
+def count_calls(calls_file):
+    try:
+        with open(calls_file, 'r') as f:
+            return sum(1 for _ in f)
+    except OSError:
+        return 0
+
+
+def run_operations(config, operations, deletes, calls_file):
+    """Time each operation; returns a list of result dicts (without the fleet size)."""
+    from domain_manager.bulk import ABSENT, apply_batch
+    from domain_manager.utils.domain import extract_ip_port, list_subdomains, renew_certificates
+    from domain_manager.utils.fix_nginx import fix_nginx_configuration
+    from domain_manager.utils.reset_configs import reset_all_configurations
+
+    logger = logging.getLogger('NGINXDomainManager')
+    subdomains = list_subdomains(config)
+    to_delete = subdomains[:deletes]
+    plan = {
+        'list': (lambda: list_subdomains(config), len(subdomains)),
+        'extract': (lambda: [extract_ip_port(config, sub) for sub in subdomains], len(subdomains)),
+        'fix': (lambda: fix_nginx_configuration(config, logger), len(subdomains)),
+        'renew': (lambda: renew_certificates(config, logger), len(subdomains)),
+        'reset': (lambda: reset_all_configurations(config, logger), len(subdomains)),
+        'delete': (lambda: apply_batch(config, [(sub, {'state': ABSENT}) for sub in to_delete]), len(to_delete)),
+    }
+    results = []
+    for operation in operations:
+        function, items = plan[operation]
+        calls_before = count_calls(calls_file)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+        results.append({
+            'op': operation,
+            'items': items,
+            'wall_s': round(elapsed, 4),
+            'per_item_ms': round(elapsed * 1000 / items, 4) if items else None,
+            'subprocesses': count_calls(calls_file) - calls_before,
+        })
+        print(f"  {operation:<8} {elapsed:9.3f}s  ({results[-1]['subprocesses']} subprocess calls)", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return (size, op, baseline_s, current_s) for every pair that got slower than the tolerance allows."""
+    previous = {(entry['size'], entry['op']): entry['wall_s'] for entry in baseline.get('results', [])}
+    regressions = []
+    for entry in results:
+        before = previous.get((entry['size'], entry['op']))
+        # Ignore noise on operations that take a few milliseconds
+        if before and entry['wall_s'] > before * (1 + tolerance) and entry['wall_s'] - before > 0.01:
+            regressions.append({'size': entry['size'], 'op': entry['op'], 'baseline_s': before,
+                                'current_s': entry['wall_s']})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Comma-separated fleet sizes (default: 100,1000,5000; up to 50000 is practical)')
+    parser.add_argument('--ops', default=','.join(OPERATIONS),
+                        help=f"Comma-separated operations to time (default: {','.join(OPERATIONS)})")
+    parser.add_argument('--cert-ratio', type=float, default=0.9,
+                        help='Fraction of subdomains that already have a certificate (default: 0.9)')
+    parser.add_argument('--deletes', type=int, default=10, help='Subdomains removed by the delete operation')
+    parser.add_argument('--nginx-latency', type=float, default=0.0, help='Seconds each stub nginx call takes')
+    parser.add_argument('--certbot-latency', type=float, default=0.0, help='Seconds each stub certbot call takes')
+    parser.add_argument('--systemctl-latency', type=float, default=0.0,
+                        help='Seconds each stub systemctl call takes')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary roots for inspection')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--compare', help='Previous results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown against --compare before failing (default: 0.25)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    operations = [op for op in args.ops.split(',') if op]
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"Unknown operations: {', '.join(sorted(unknown))}")
+
+    from domain_manager.config import CONFIG_PATH_ENV
+    from domain_manager.logger import setup_logging, shutdown_logging
+    from domain_manager.utils import domain
+
+    # Log like a real run (background file writer, formatted console output),
+    # but keep the console output off the terminal.
+    log_dir = tempfile.mkdtemp(prefix='dm-fleet-log-')
+    setup_logging(os.path.join(log_dir, 'nginx_domain_manager.log'))
+    devnull = open(os.devnull, 'w')
+    for handler in logging.getLogger().handlers:
+        if type(handler) is logging.StreamHandler:
+            handler.setStream(devnull)
+
+    results = []
+    for size in sizes:
+        root = tempfile.mkdtemp(prefix=f'dm-fleet-{size}-')
+        live_dir = os.path.join(root, 'letsencrypt', 'live')
+        calls_file = os.path.join(root, 'stub_calls')
+        write_stubs(os.path.join(root, 'bin'))
+        os.environ.update({
+            'PATH': os.path.join(root, 'bin') + os.pathsep + os.environ['PATH'],
+            'DM_STUB_CALLS': calls_file,
+            'DM_STUB_LE_LIVE': live_dir,
+            'DM_STUB_NGINX_LATENCY': str(args.nginx_latency),
+            'DM_STUB_CERTBOT_LATENCY': str(args.certbot_latency),
+            'DM_STUB_SYSTEMCTL_LATENCY': str(args.systemctl_latency),
+            CONFIG_PATH_ENV: os.path.join(root, 'config.yaml'),
+        })
+        domain.LETSENCRYPT_LIVE_DIR = live_dir
+        config = build_config(root)
+
+        print(f"Fleet of {size} subdomains in {root}", file=sys.stderr)
+        start = time.perf_counter()
+        generate_fleet(config, live_dir, size, args.cert_ratio)
+        elapsed = time.perf_counter() - start
+        results.append({'size': size, 'op': 'generate', 'items': size, 'wall_s': round(elapsed, 4),
+                        'per_item_ms': round(elapsed * 1000 / size, 4) if size else None, 'subprocesses': 0})
+        for entry in run_operations(config, operations, args.deletes, calls_file):
+            results.append({'size': size, **entry})
+
+        os.environ['PATH'] = os.environ['PATH'].split(os.pathsep, 1)[1]
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    shutdown_logging()
+    shutil.rmtree(log_dir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'fleet',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency_s': {'nginx': args.nginx_latency, 'certbot': args.certbot_latency,
+                      'systemctl': args.systemctl_latency},
+        'cert_ratio': args.cert_ratio,
+        'results': results,
+    }
+    status = 0
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            report['regressions'] = compare(results, json.load(f), args.tolerance)
+        status = 1 if report['regressions'] else 0
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
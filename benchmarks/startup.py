@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# benchmarks/startup.py
+
+"""
+Cold-start benchmark for NGINXDomainManager.
+
+Runs `main.py --help` (argument parsing plus every import done before the
+menu or a subcommand starts) in fresh interpreters and compares the median
+wall time against a budget. Exits with status 1 when the budget is exceeded,
+so it can gate CI.
+
+Usage:
+    python benchmarks/startup.py [--runs 20] [--budget-ms 300] [--json results.json] [--imports]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_ROOT, 'src')
+MAIN = os.path.join(SRC_DIR, 'domain_manager', 'main.py')
+DEFAULT_BUDGET_MS = 300
+
+
+def run_once(command, env):
+    start = time.perf_counter()
+    subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def slowest_imports(env, limit=10):
+    """Return the modules with the highest cumulative import time, via -X importtime."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', MAIN, '--help'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        # Only top-level imports (one leading space) and the package's own modules
+        if name.startswith('  ') and not module.startswith('domain_manager'):
+            continue
+        imports.append({'module': module, 'cumulative_ms': int(cumulative_us) / 1000})
+    imports.sort(key=lambda item: item['cumulative_ms'], reverse=True)
+    return imports[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help='Number of measured runs (default: 20)')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f'Median cold-start budget in ms (default: {DEFAULT_BUDGET_MS})')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--imports', action='store_true', help='Also report the slowest top-level imports')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=SRC_DIR, PYTHONDONTWRITEBYTECODE='1')
+    command = [sys.executable, MAIN, '--help']
+    baseline_command = [sys.executable, '-c', 'pass']
+
+    # Warm the OS page cache and .pyc files once so runs are comparable.
+    run_once(command, dict(env, PYTHONDONTWRITEBYTECODE=''))
+
+    samples = [run_once(command, env) for _ in range(args.runs)]
+    baseline = [run_once(baseline_command, env) for _ in range(args.runs)]
+
+    results = {
+        'benchmark': 'startup',
+        'python': platform.python_version(),
+        'runs': args.runs,
+        'budget_ms': args.budget_ms,
+        'median_ms': round(statistics.median(samples), 2),
+        'min_ms': round(min(samples), 2),
+        'max_ms': round(max(samples), 2),
+        'interpreter_median_ms': round(statistics.median(baseline), 2),
+    }
+    results['overhead_ms'] = round(results['median_ms'] - results['interpreter_median_ms'], 2)
+    if args.imports:
+        results['slowest_imports'] = slowest_imports(env)
+    results['within_budget'] = results['median_ms'] <= args.budget_ms
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0 if results['within_budget'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,402 @@
+# domain_manager/bulk.py
+
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from colorama import Fore
+
+from domain_manager.config import refresh_registry, update_registry
+from domain_manager.instances import nginx_conf_dir, sibling_configs
+from domain_manager.utils.acme import clear_reload_pending, reload_pending, write_acme_snippet
+from domain_manager.utils.listeners import (
+    owner_path, plan_listener_owner, reassign_listener_owner, save_listener_owner
+)
+from domain_manager.utils.rate_limits import limit_zones_path, write_limit_zones
+from domain_manager.utils.domain import (
+    certificate_exists, delete_ssl_certificate, obtain_certificate, reload_nginx_service, remove_vhost,
+    test_nginx_config, vhost_exists, vhost_paths, vhost_up_to_date, write_vhosts
+)
+from domain_manager.utils.locks import certbot_lock, nginx_lock, subdomain_locks
+from domain_manager.utils.upstreams import with_primary
+from domain_manager.utils.validation import BatchValidator
+
+logger = logging.getLogger('NGINXDomainManager')
+
+ABSENT = 'absent'
+REGISTRY_FIELDS = ('target_ip', 'target_port', 'custom_options')
+
+# Exit codes for non-interactive runs
+EXIT_OK = 0
+EXIT_PARTIAL = 1
+EXIT_INVALID = 2
+EXIT_NGINX_INVALID = 3
+
+
+def load_batch_file(path):
+    """
+    Load a batch of desired subdomain states from a YAML or JSON file.
+
+    Two layouts are accepted:
+
+        subdomains:                      subdomains:
+          app.example.com:                 - subdomain: app.example.com
+            target_ip: 10.0.0.5              target_ip: 10.0.0.5
+            target_port: 8080                target_port: 8080
+          old.example.com:                 - subdomain: old.example.com
+            state: absent                    state: absent
+
+    Args:
+        path (str): Path to the batch file ('-' is not supported).
+
+    Returns:
+        list: (subdomain, details) pairs in file order.
+
+    Raises:
+        ValueError: If the file does not have one of the layouts above.
+    """
+    import yaml
+
+    with open(path, 'r') as f:
+        data = json.load(f) if path.endswith('.json') else yaml.safe_load(f)
+    if isinstance(data, dict) and 'subdomains' in data:
+        data = data['subdomains']
+    if isinstance(data, dict):
+        return [(subdomain, details if details is not None else {}) for subdomain, details in data.items()]
+    if isinstance(data, list):
+        entries = []
+        for item in data:
+            if not isinstance(item, dict) or 'subdomain' not in item:
+                raise ValueError("Each list entry needs a 'subdomain' key")
+            details = dict(item)
+            entries.append((details.pop('subdomain'), details))
+        return entries
+    raise ValueError("Expected a 'subdomains' mapping or list")
+
+
+def normalize_details(details):
+    """Return a registry entry with the types the rest of the tool expects."""
+    normalized = {key: value for key, value in details.items() if key != 'state'}
+    normalized['target_ip'] = str(details.get('target_ip'))
+    normalized['target_port'] = str(details.get('target_port'))
+    normalized['custom_options'] = list(details.get('custom_options') or [])
+    # Load-balanced entries: backends as strings, target_ip/target_port mirror the primary one
+    return with_primary(normalized)
+
+
+def validate_batch(entries, config=None, registry=None):
+    """
+    Validate every entry of a batch before anything is changed.
+
+    Args:
+        entries (list): (subdomain, details) pairs.
+        config (dict, optional): Configuration, for the `validation` settings.
+        registry (dict, optional): Current registry, to report backends
+            shared with subdomains outside the batch.
+
+    Returns:
+        dict: Validation report (see utils.validation.BatchValidator.report).
+    """
+    validator = BatchValidator(config, registry)
+    for subdomain, details in entries:
+        if isinstance(details, dict) and details.get('state') == ABSENT:
+            validator.check(subdomain)
+        else:
+            validator.check(subdomain, details)
+    return validator.report()
+
+
+def _empty_summary():
+    return {
+        'ok': True,
+        'status': 'applied',
+        'created': [],
+        'updated': [],
+        'deleted': [],
+        'unchanged': [],
+        'certificates': {'issued': [], 'existing': [], 'failed': {}},
+        'errors': {},
+        'warnings': {},
+        'reload': 'skipped',
+        'duration_s': 0.0,
+    }
+
+
+def _backup_file(config, path):
+    """Copy a file into the backup directory before it is removed."""
+    backup_dir = config.get('backup_dir') or os.path.join(nginx_conf_dir(config), 'backups')
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    shutil.copy2(path, os.path.join(backup_dir, f"{os.path.basename(path)}.{timestamp}.bak"))
+
+
+def _snapshot(paths):
+    """Remember file contents (or absence) so a failed batch can be rolled back."""
+    snapshot = {}
+    for path in paths:
+        if os.path.islink(path):
+            snapshot[path] = ('link', os.readlink(path))
+        elif os.path.isfile(path):
+            with open(path, 'r') as f:
+                snapshot[path] = ('file', f.read())
+        else:
+            snapshot[path] = (None, None)
+    return snapshot
+
+
+def _restore(snapshot):
+    for path, (kind, value) in snapshot.items():
+        if os.path.lexists(path):
+            os.remove(path)
+        if kind == 'file':
+            with open(path, 'w') as f:
+                f.write(value)
+        elif kind == 'link':
+            os.symlink(value, path)
+
+
+def _reload(config, summary, tested=False):
+    """Test (unless the caller just did, under the same exclusive lock) and reload Nginx."""
+    ok, detail = (True, '') if tested else test_nginx_config(quiet=True, config=config)
+    if ok:
+        ok, detail = reload_nginx_service(quiet=True, config=config)
+    summary['reload'] = 'ok' if ok else 'failed'
+    if ok:
+        clear_reload_pending(config)
+    else:
+        summary['errors'].setdefault('nginx', []).append(detail)
+    return ok
+
+
+def _obtain_certificate(config, subdomain):
+    """Obtain a certificate unless another instance obtained it while this one waited for Certbot."""
+    with certbot_lock(config, quiet=True):
+        if certificate_exists(subdomain):
+            return True
+        return obtain_certificate(subdomain, install=False, quiet=True, config=config)
+
+
+def apply_batch(config, entries, certificates=True, cert_workers=1, dry_run=False):
+    """
+    Converge the registry and Nginx configuration to a batch of desired states.
+
+    The whole batch is validated first; nothing is touched if any entry is
+    invalid. All vhost files are then written and tested with a single
+    `nginx -t`. If the test fails, every file is restored and nothing is
+    saved. Otherwise the registry is saved once and Nginx is reloaded once.
+    Missing certificates are then obtained by a pool of `cert_workers`
+    threads. Vhosts that received a certificate are switched to HTTPS with
+    one more test and reload. Subdomains that already have a certificate
+    never trigger a Certbot run.
+
+    Other runs may apply batches at the same time: the subdomains of this
+    batch stay locked until it is done, the registry is re-read once the
+    locks are held, and `nginx -t` plus reload run under the exclusive
+    Nginx lock (see utils/locks.py). Files shared by all vhosts (limit
+    zones, the listener owner) are regenerated under that lock too, from
+    the registry as re-read then plus this batch, so concurrent batches
+    never overwrite each other's zones.
+
+    Args:
+        config (dict): Configuration dictionary; its registry is updated in place.
+        entries (list): (subdomain, details) pairs; details with
+            `state: absent` delete the subdomain.
+        certificates (bool): Obtain missing certificates.
+        cert_workers (int): Number of concurrent Certbot runs. Certbot
+            serializes on its own lock directory, so values above 1 only help
+            with separate Certbot config directories or another ACME client.
+        dry_run (bool): Validate and plan without changing anything.
+
+    Returns:
+        dict: Machine-readable summary (see _empty_summary for the keys).
+    """
+    start = time.perf_counter()
+    summary = _empty_summary()
+
+    report = validate_batch(entries, config, config.get('subdomains'))
+    summary['warnings'] = report['warnings']
+    if report['errors']:
+        summary.update(ok=False, status='invalid', errors=report['errors'])
+        summary['duration_s'] = round(time.perf_counter() - start, 3)
+        return summary
+
+    with subdomain_locks(config, [subdomain for subdomain, _ in entries], quiet=True):
+        # Another run may have changed these subdomains while we waited for the locks
+        refresh_registry(config)
+        return _apply_locked(config, entries, summary, start, certificates, cert_workers, dry_run)
+
+
+def _apply_locked(config, entries, summary, start, certificates, cert_workers, dry_run):
+    registry = config.setdefault('subdomains', {})
+
+    # Plan
+    upserts = {}
+    deletes = []
+    for subdomain, details in entries:
+        if details.get('state') == ABSENT:
+            if subdomain in registry or vhost_exists(config, subdomain):
+                deletes.append(subdomain)
+            else:
+                summary['unchanged'].append(subdomain)
+            continue
+        current = registry.get(subdomain)
+        # Fields the entry leaves out keep their registry values; the vhost is rendered from what is saved
+        normalized = normalize_details({**(current or {}), **details})
+        if current is None:
+            summary['created'].append(subdomain)
+        elif {k: current.get(k) for k in normalized} != normalized:
+            summary['updated'].append(subdomain)
+        elif not vhost_exists(config, subdomain):
+            summary['updated'].append(subdomain)
+        elif config.get('instance') and not vhost_up_to_date(config, subdomain, normalized):
+            # Another instance already saved this change to the shared registry
+            summary['updated'].append(subdomain)
+        else:
+            summary['unchanged'].append(subdomain)
+            continue
+        upserts[subdomain] = normalized
+    summary['deleted'] = list(deletes)
+
+    if dry_run:
+        summary['status'] = 'planned'
+        summary['duration_s'] = round(time.perf_counter() - start, 3)
+        return summary
+
+    # Write every vhost, remembering the previous state for rollback
+    touched = [path for subdomain in list(upserts) + deletes for path in vhost_paths(config, subdomain)]
+    snapshot = _snapshot(touched)
+    try:
+        with nginx_lock(config, shared=True, quiet=True):
+            write_vhosts(config, upserts)
+            for subdomain in deletes:
+                available_path = vhost_paths(config, subdomain)[0]
+                if os.path.isfile(available_path):
+                    _backup_file(config, available_path)
+                remove_vhost(config, subdomain)
+    except OSError as e:
+        _restore(snapshot)
+        summary.update(ok=False, status='write_failed')
+        summary['errors']['write'] = [str(e)]
+        summary['duration_s'] = round(time.perf_counter() - start, 3)
+        return summary
+
+    if upserts or deletes:
+        with nginx_lock(config, quiet=True):
+            # Files shared by every vhost are derived from the registry as other batches left it
+            refresh_registry(config)
+            remaining = {subdomain: details for subdomain, details in {**registry, **upserts}.items()
+                         if subdomain not in deletes}
+            # reuseport/default_server move to another vhost when their owner goes (see utils/listeners.py)
+            owner_before, owner = plan_listener_owner(config, remaining)
+            moved = {subdomain: remaining[subdomain] for subdomain in (owner_before, owner)
+                     if owner != owner_before and subdomain in remaining}
+            snapshot.update(_snapshot([path for subdomain in moved for path in vhost_paths(config, subdomain)
+                                       if path not in snapshot] + [limit_zones_path(config), owner_path(config)]))
+            try:
+                write_acme_snippet(config, logger)
+                write_limit_zones(config, logger, remaining)
+                if owner != owner_before:
+                    save_listener_owner(config, owner)
+                    write_vhosts(config, moved)
+            except OSError as e:
+                _restore(snapshot)
+                summary.update(ok=False, status='write_failed')
+                summary['errors']['write'] = [str(e)]
+                summary['duration_s'] = round(time.perf_counter() - start, 3)
+                return summary
+
+            ok, detail = test_nginx_config(quiet=True, config=config)
+            if not ok:
+                _restore(snapshot)
+                summary.update(ok=False, status='nginx_test_failed')
+                summary['errors']['nginx'] = [detail]
+                summary['duration_s'] = round(time.perf_counter() - start, 3)
+                return summary
+
+            # The configuration is valid: commit the registry once
+            changes = dict(upserts)
+            changes.update((subdomain, None) for subdomain in deletes)
+            update_registry(config, changes)
+            _reload(config, summary, tested=True)
+
+    for subdomain in deletes:
+        # Certificates are shared: the last instance to drop the vhost deletes it
+        if any(vhost_exists(sibling, subdomain) for sibling in sibling_configs(config)):
+            continue
+        if not delete_ssl_certificate(subdomain, quiet=True):
+            summary['errors'].setdefault(subdomain, []).append("Failed to delete SSL certificate")
+
+    # Certificates for everything that should be served over HTTPS
+    if certificates:
+        wanted = [sub for sub, details in entries if details.get('state') != ABSENT]
+        missing = []
+        for subdomain in wanted:
+            if certificate_exists(subdomain):
+                summary['certificates']['existing'].append(subdomain)
+            else:
+                missing.append(subdomain)
+        if missing:
+            with ThreadPoolExecutor(max_workers=max(1, cert_workers)) as pool:
+                results = list(pool.map(lambda sub: _obtain_certificate(config, sub), missing))
+            for subdomain, success in zip(missing, results):
+                if success:
+                    summary['certificates']['issued'].append(subdomain)
+                else:
+                    summary['certificates']['failed'][subdomain] = "Certbot failed; see the log for details"
+            with nginx_lock(config, shared=True, quiet=True):
+                issued = {subdomain: registry[subdomain] for subdomain in summary['certificates']['issued']}
+                switched = any(write_vhosts(config, issued, ssl=True).values())
+            with nginx_lock(config, quiet=True):
+                # The first certificate gives the shared listen parameters an owner
+                switched = reassign_listener_owner(config, logger) or switched
+                # In webroot mode Certbot's deploy hook only queued a reload; this is the one reload for the batch
+                if switched or reload_pending(config):
+                    _reload(config, summary)
+
+    if summary['certificates']['failed'] or summary['reload'] == 'failed' or summary['errors']:
+        summary.update(ok=False, status='partial')
+    summary['duration_s'] = round(time.perf_counter() - start, 3)
+    logger.info(
+        f"Applied batch: {len(summary['created'])} created, {len(summary['updated'])} updated, "
+        f"{len(summary['deleted'])} deleted, {len(summary['unchanged'])} unchanged, "
+        f"{len(summary['certificates']['issued'])} certificates issued, "
+        f"{len(summary['certificates']['failed'])} failed in {summary['duration_s']}s."
+    )
+    return summary
+
+
+def exit_code(summary):
+    """Map a batch summary to a process exit code."""
+    if summary['status'] == 'invalid':
+        return EXIT_INVALID
+    if summary['status'] in ('nginx_test_failed', 'write_failed'):
+        return EXIT_NGINX_INVALID
+    return EXIT_OK if summary['ok'] else EXIT_PARTIAL
+
+
+def print_summary(summary):
+    """Print a batch summary for interactive use."""
+    for subdomain in summary['created']:
+        print(Fore.GREEN + f"Created {subdomain}.")
+    for subdomain in summary['updated']:
+        print(Fore.GREEN + f"Updated {subdomain}.")
+    for subdomain in summary['deleted']:
+        print(Fore.GREEN + f"Deleted {subdomain}.")
+    for subdomain in summary['certificates']['issued']:
+        print(Fore.GREEN + f"SSL certificate obtained for {subdomain}.")
+    for subdomain, error in summary['certificates']['failed'].items():
+        print(Fore.RED + f"Failed to obtain SSL certificate for {subdomain}: {error}")
+    for subject, messages in summary['errors'].items():
+        for message in messages:
+            print(Fore.RED + f"{subject}: {message}")
+    for subject, messages in summary.get('warnings', {}).items():
+        for message in messages:
+            print(Fore.YELLOW + f"{subject}: {message}")
+    if summary['reload'] == 'ok':
+        print(Fore.GREEN + "Nginx reloaded successfully.")
+    elif summary['reload'] == 'failed':
+        print(Fore.RED + "Nginx reload failed.")
@@ -0,0 +1,679 @@
+# domain_manager/cli.py
+
+"""
+Command line interface.
+
+Running NGINXDomainManager without a subcommand starts the interactive menu;
+subcommands run non-interactively.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from colorama import Fore
+
+from domain_manager.log_viewer import parse_time_bound
+
+# Command implementations import their subsystems on first use so that
+# parsing arguments (and --help) stays fast.
+
+# `per_instance` value of commands that serve exactly one Nginx instance
+ONE_INSTANCE = 'one'
+
+
+def _time_bound(value):
+    """argparse type for --since/--until values."""
+    try:
+        return parse_time_bound(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def cmd_history(args, config, logger):
+    """Print the log history of one subdomain using the log offset index."""
+    from domain_manager.log_index import subdomain_history
+    from domain_manager.log_viewer import format_record
+
+    found = 0
+    for record in subdomain_history(config['log_file'], args.subdomain, since=args.since, until=args.until):
+        print(format_record(record))
+        found += 1
+    if not found:
+        print(Fore.YELLOW + f"No log history found for {args.subdomain}.")
+    return 0
+
+
+def cmd_logs(args, config, logger):
+    """Print recent log records, optionally following new ones."""
+    from domain_manager.log_viewer import follow_log, format_record, iter_filtered_records
+
+    if args.follow:
+        try:
+            for record in follow_log(config['log_file'], level=args.level, subdomain=args.subdomain):
+                print(format_record(record))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    records = []
+    for record in iter_filtered_records(config['log_file'], level=args.level, subdomain=args.subdomain,
+                                        since=args.since, until=args.until):
+        records.append(record)
+        if len(records) >= args.limit:
+            break
+    for record in reversed(records):
+        print(format_record(record))
+    return 0
+
+
+def cmd_stats(args, config, logger):
+    """Report request rate, latency percentiles and status mix from a vhost access log."""
+    from domain_manager.utils.access_stats import print_stats, subdomain_stats
+
+    since = args.since.timestamp() if args.since else None
+    until = args.until.timestamp() if args.until else None
+    stats = subdomain_stats(config, args.subdomain, since=since, until=until, top=args.top)
+    if stats is None:
+        print(Fore.RED + f"No access log found for {args.subdomain}. Is access_log enabled for it?")
+        return 1
+    print_stats(args.subdomain, stats)
+    return 0
+
+
+def cmd_health(args, config, logger):
+    """Probe every distinct backend concurrently; exit nonzero if any is down."""
+    from domain_manager.utils.health import check_health, print_health
+
+    backends, results = check_health(config, logger, subdomains=args.subdomains or None, http=args.http or None,
+                                     timeout=args.timeout, concurrency=args.concurrency)
+    if not results:
+        print(Fore.YELLOW + "No backends configured.")
+        return 0
+    print_health(backends, results)
+    return 0 if all(result['healthy'] for result in results.values()) else 1
+
+
+def cmd_reload(args, config, logger):
+    """Test and reload Nginx; with --if-pending only when a certificate deploy queued a reload."""
+    from domain_manager.utils.acme import clear_reload_pending, reload_pending
+    from domain_manager.utils.domain import reload_nginx_service, test_nginx_config
+    from domain_manager.utils.locks import nginx_lock
+
+    if args.if_pending and not reload_pending(config):
+        return 0
+    with nginx_lock(config):
+        ok = test_nginx_config(quiet=True, config=config)[0] and reload_nginx_service(quiet=True, config=config)[0]
+        if ok:
+            clear_reload_pending(config)
+    return 0 if ok else 1
+
+
+def cmd_resume(args, config, logger):
+    """Continue interrupted or paused certificate and provisioning runs."""
+    from domain_manager.jobs import COMPLETE, FAILED, print_run_summary, resume_runs, unfinished_runs
+
+    runs = unfinished_runs(config)
+    if args.run is not None:
+        runs = [run for run in runs if run['id'] == args.run]
+    if not runs:
+        print(Fore.GREEN + "No unfinished job runs.")
+        return 0
+    if args.list:
+        for run in runs:
+            started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['created']))
+            counts = ', '.join(f"{count} {state}" for state, count in sorted(run['jobs'].items()))
+            print(f"{run['id']:>5}  {run['kind']:<8} {run['status']:<7} started {started}  ({counts})"
+                  + (f"  {run['note']}" if run['note'] else ''))
+        return 0
+    summaries = resume_runs(config, args.run)
+    for summary in summaries:
+        print_run_summary(summary)
+    failed = any(state == FAILED for summary in summaries for state, _ in summary['jobs'].values())
+    return 0 if all(summary['status'] == COMPLETE for summary in summaries) and not failed else 1
+
+
+def cmd_metrics(args, config, logger):
+    """Write Prometheus metrics for node_exporter's textfile collector."""
+    from domain_manager.metrics import collect_metrics, export_metrics, flush_metrics
+
+    if args.output == '-':
+        flush_metrics()
+        sys.stdout.write(collect_metrics(config))
+        return 0
+    try:
+        export_metrics(config, args.output)
+    except OSError as e:
+        print(Fore.RED + f"Failed to write metrics: {e}")
+        logger.error(f"Failed to write metrics: {e}")
+        return 1
+    return 0
+
+
+def _report(args, summary):
+    """Print a batch summary as JSON (for scripts) or as text, and return the exit code."""
+    from domain_manager.bulk import exit_code, print_summary
+
+    if getattr(args, 'json', False):
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    if getattr(args, 'summary', None):
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return exit_code(summary)
+
+
+def cmd_apply(args, config, logger):
+    """Converge the registry to a batch file in one transaction."""
+    from domain_manager.bulk import EXIT_INVALID, apply_batch, load_batch_file
+
+    try:
+        entries = load_batch_file(args.file)
+    except (OSError, ValueError) as e:
+        print(Fore.RED + f"Failed to load {args.file}: {e}")
+        return EXIT_INVALID
+    summary = apply_batch(config, entries, certificates=not args.no_certs, cert_workers=args.cert_workers,
+                          dry_run=args.dry_run)
+    return _report(args, summary)
+
+
+def _apply_limit_args(args, details):
+    """Apply --rate-limit, --burst and --conn-limit to a registry entry."""
+    # 'off' is stored as false: batch entries are merged over the registry, so a removed key would be kept
+    if args.rate_limit == 'off':
+        details['rate_limit'] = False
+    elif args.rate_limit == 'on':
+        details['rate_limit'] = True
+    elif args.rate_limit is not None:
+        current = details.get('rate_limit')
+        details['rate_limit'] = dict(current if isinstance(current, dict) else {}, rate=args.rate_limit)
+    if args.burst is not None:
+        current = details.get('rate_limit')
+        details['rate_limit'] = dict(current if isinstance(current, dict) else {}, burst=args.burst)
+    if args.conn_limit == 'off':
+        details['conn_limit'] = False
+    elif args.conn_limit is not None:
+        details['conn_limit'] = True if args.conn_limit == 'on' else (
+            int(args.conn_limit) if args.conn_limit.isdigit() else args.conn_limit)
+
+
+def _apply_backend_args(args, details):
+    """
+    Apply --backend, --drain, --undrain, --remove-backend, --balance and --hash-key to a registry entry.
+
+    Raises:
+        ValueError: If a backend is malformed or not part of the entry.
+    """
+    from domain_manager.utils.upstreams import add_backend, remove_backend, set_drain
+
+    if args.balance:
+        details['balance'] = args.balance
+    if args.hash_key:
+        details['hash_key'] = args.hash_key
+    for spec in args.backend or []:
+        details = add_backend(details, spec)
+    for address in getattr(args, 'drain', None) or []:
+        details = set_drain(details, address)
+    for address in getattr(args, 'undrain', None) or []:
+        details = set_drain(details, address, drain=False)
+    for address in getattr(args, 'remove_backend', None) or []:
+        details = remove_backend(details, address)
+    return details
+
+
+def _add_backend_arguments(parser, edit=False):
+    from domain_manager.utils.upstreams import BALANCE_METHODS
+
+    replaces = "; replaces a member with the same address" if edit else ""
+    parser.add_argument('--backend', action='append', metavar='SPEC',
+                        help="Load-balance over this backend (repeatable): 'IP:PORT [weight=N] [max_fails=N] "
+                             f"[fail_timeout=T] [backup]'{replaces}")
+    parser.add_argument('--balance', choices=BALANCE_METHODS, help='Balancing method (default: round_robin)')
+    parser.add_argument('--hash-key', help='Key for --balance hash (default: $request_uri)')
+    if edit:
+        parser.add_argument('--drain', action='append', metavar='IP:PORT',
+                            help='Stop sending new requests to a backend (repeatable)')
+        parser.add_argument('--undrain', action='append', metavar='IP:PORT',
+                            help='Put a drained backend back into rotation (repeatable)')
+        parser.add_argument('--remove-backend', action='append', metavar='IP:PORT',
+                            help='Remove a backend (repeatable)')
+
+
+def _add_limit_arguments(parser):
+    parser.add_argument('--rate-limit', metavar='RATE',
+                        help="Limit requests per client: a rate such as 10r/s, 'on' for the defaults, or 'off'")
+    parser.add_argument('--burst', type=int, help='Requests per client allowed above the rate limit')
+    parser.add_argument('--conn-limit', metavar='N',
+                        help="Limit concurrent connections per client: a number, 'on' for the default, or 'off'")
+
+
+def cmd_add(args, config, logger):
+    """Add a single subdomain."""
+    from domain_manager.bulk import EXIT_INVALID, apply_batch
+
+    if args.subdomain in config.get('subdomains', {}):
+        print(Fore.RED + f"Subdomain {args.subdomain} already exists. Use 'edit' to change it.")
+        return EXIT_INVALID
+    if bool(args.ip) != bool(args.port) or not (args.ip or args.backend):
+        print(Fore.RED + "Give --ip and --port, or one or more --backend.")
+        return EXIT_INVALID
+    details = {'target_ip': args.ip, 'target_port': args.port, 'custom_options': args.option or []}
+    _apply_limit_args(args, details)
+    try:
+        details = _apply_backend_args(args, details)
+    except ValueError as e:
+        print(Fore.RED + str(e))
+        return EXIT_INVALID
+    summary = apply_batch(config, [(args.subdomain, details)], certificates=not args.no_cert)
+    return _report(args, summary)
+
+
+def cmd_edit(args, config, logger):
+    """Change the backends, custom options or limits of an existing subdomain."""
+    from domain_manager.bulk import EXIT_INVALID, apply_batch
+
+    current = config.get('subdomains', {}).get(args.subdomain)
+    if current is None:
+        print(Fore.RED + f"Subdomain {args.subdomain} does not exist.")
+        return EXIT_INVALID
+    details = dict(current)
+    if (args.ip or args.port) and details.get('backends'):
+        print(Fore.RED + f"{args.subdomain} is load-balanced. Use --backend, --drain or --remove-backend.")
+        return EXIT_INVALID
+    if args.ip:
+        details['target_ip'] = args.ip
+    if args.port:
+        details['target_port'] = args.port
+    if args.clear_options:
+        details['custom_options'] = []
+    if args.option:
+        details['custom_options'] = list(details.get('custom_options') or []) + args.option
+    _apply_limit_args(args, details)
+    try:
+        details = _apply_backend_args(args, details)
+    except ValueError as e:
+        print(Fore.RED + str(e))
+        return EXIT_INVALID
+    summary = apply_batch(config, [(args.subdomain, details)], certificates=not args.no_cert)
+    return _report(args, summary)
+
+
+def cmd_delete(args, config, logger):
+    """Delete one or more subdomains, their configuration and certificates."""
+    from domain_manager.bulk import ABSENT, apply_batch
+
+    summary = apply_batch(config, [(subdomain, {'state': ABSENT}) for subdomain in args.subdomains])
+    return _report(args, summary)
+
+
+def cmd_export(args, config, logger):
+    """Stream the registry to CSV or JSON lines."""
+    from domain_manager.registry_io import export_registry
+
+    count = export_registry(config, args.output, fmt=args.format, cert_state=not args.no_cert_state)
+    if args.output != '-':
+        print(Fore.GREEN + f"Exported {count} subdomains to {args.output}.")
+    return 0
+
+
+def cmd_import(args, config, logger):
+    """Upsert registry entries from CSV or JSON lines, validating every row."""
+    from domain_manager.bulk import apply_batch, exit_code
+    from domain_manager.config import update_registry
+    from domain_manager.registry_io import import_registry
+
+    result = import_registry(config, args.file, fmt=args.format, strict=args.strict, commit=not args.apply)
+
+    for error in result['errors']:
+        subject = error['subdomain'] or '-'
+        print(Fore.RED + f"Line {error['line']} ({subject}): {'; '.join(error['errors'])}", file=sys.stderr)
+    if args.errors:
+        with open(args.errors, 'w') as f:
+            for error in result['errors']:
+                f.write(json.dumps(error) + '\n')
+
+    code = 1 if result['errors'] else 0
+    if args.apply and result['entries']:
+        summary = apply_batch(config, result['entries'], certificates=args.certs)
+        code = max(code, exit_code(summary))
+    elif result['entries']:
+        update_registry(config, dict(result['entries']))
+
+    message = (f"Imported {result['rows']} rows: {result['created']} created, {result['updated']} updated, "
+               f"{result['unchanged']} unchanged, {len(result['errors'])} invalid, "
+               f"{result['warnings']} warnings (shared backends).")
+    print((Fore.GREEN if not result['errors'] else Fore.YELLOW) + message)
+    logger.info(message)
+    if result['entries'] and not args.apply:
+        print(Fore.YELLOW + "Registry updated. Run 'apply' or reset the configurations to write the vhost files.")
+    return code
+
+
+def cmd_fleet(args, config, logger):
+    """Render the registry once and roll it out to every fleet node."""
+    from domain_manager.bulk import EXIT_INVALID, EXIT_NGINX_INVALID, EXIT_OK, EXIT_PARTIAL
+    from domain_manager.fleet import (
+        fan_out, issue_missing_certificates, print_fleet_summary, renew_issued_certificates
+    )
+
+    if args.renew and not args.dry_run:
+        ok, output = renew_issued_certificates()
+        if not ok:
+            print(Fore.RED + f"certbot renew failed: {output}")
+    if args.issue and not args.dry_run:
+        for subdomain, ok in issue_missing_certificates(config).items():
+            if not ok:
+                print(Fore.RED + f"Failed to obtain SSL certificate for {subdomain}.")
+    summary = fan_out(config, nodes=args.node or None, concurrency=args.concurrency, wave_size=args.wave_size,
+                      dry_run=args.dry_run, certificates=not args.no_certs)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_fleet_summary(summary)
+    return {'invalid': EXIT_INVALID, 'test_failed': EXIT_NGINX_INVALID,
+            'reload_failed': EXIT_PARTIAL}.get(summary['status'], EXIT_OK)
+
+
+def cmd_daemon(args, config, logger):
+    """Serve the Unix-socket API until interrupted."""
+    from domain_manager.daemon import run_daemon
+
+    run_daemon(config, socket_path=args.socket, batch_window=args.batch_window, max_batch=args.max_batch,
+               certificates=False if args.no_certs else None)
+    return 0
+
+
+def _ctl_requests(args):
+    """Build the request stream for `ctl`: a single operation, or JSON lines from a file."""
+    if args.op != 'batch':
+        request = {'op': args.op}
+        if args.subdomain:
+            request['subdomain'] = args.subdomain
+        if args.ip:
+            request['target_ip'] = args.ip
+        if args.port:
+            request['target_port'] = args.port
+        if args.option:
+            request['custom_options'] = args.option
+        yield request
+        return
+    f = sys.stdin if args.subdomain in (None, '-') else open(args.subdomain, 'r')
+    try:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def cmd_ctl(args, config, logger):
+    """Send requests to a running daemon and print the responses as JSON lines."""
+    from domain_manager.client import DEFAULT_SOCKET, Client, DaemonUnavailable
+
+    # Read the socket path directly so the client never imports the daemon's dependencies
+    socket_path = args.socket or (config.get('daemon') or {}).get('socket', DEFAULT_SOCKET)
+    start = time.perf_counter()
+    count = failed = 0
+    try:
+        with Client(socket_path) as client:
+            for response in client.call_many(_ctl_requests(args)):
+                count += 1
+                failed += not response.get('ok')
+                print(json.dumps(response, indent=None if args.op == 'batch' else 2))
+    except DaemonUnavailable as e:
+        print(Fore.RED + str(e), file=sys.stderr)
+        return 2
+    except ValueError as e:
+        print(Fore.RED + f"Invalid request file: {e}", file=sys.stderr)
+        return 2
+    if args.op == 'batch':
+        elapsed = time.perf_counter() - start
+        print(f"{count} requests, {failed} failed in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f}/s).",
+              file=sys.stderr)
+    return 1 if failed else 0
+
+
+def build_parser():
+    """Build the argument parser for all subcommands."""
+    parser = argparse.ArgumentParser(
+        prog='NGINXDomainManager',
+        description='Manage NGINX subdomains and SSL certificates. Run without arguments for the interactive menu.',
+    )
+    parser.add_argument('--offline', action='store_true',
+                        help='Never contact GitHub (skips update checks and changelog downloads)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Profile each operation with cProfile and write a report per operation')
+    parser.add_argument('--profile-dir', metavar='DIR',
+                        help='Directory for --profile reports (default: <state_dir>/profiles)')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='Also report the top memory allocations (tracemalloc); implies --profile')
+    parser.add_argument('--instance', action='append', metavar='NAME',
+                        help="Nginx instance to manage (repeatable; 'all' or none for every configured instance)")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+
+    history = subparsers.add_parser('history', help='Show the log history of a subdomain')
+    history.add_argument('subdomain', help='Subdomain to look up (e.g. app.example.com)')
+    history.add_argument('--since', type=_time_bound, help='Oldest entry to show (e.g. 30d, 2024-10-01)')
+    history.add_argument('--until', type=_time_bound, help='Newest entry to show (e.g. 1d, 2024-10-31 23:59)')
+    history.set_defaults(func=cmd_history)
+
+    logs = subparsers.add_parser('logs', help='Show recent log entries')
+    logs.add_argument('--level', help='Minimum level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
+    logs.add_argument('--subdomain', help='Only show entries for this subdomain')
+    logs.add_argument('--since', type=_time_bound, help='Oldest entry to show (e.g. 2h, 2024-10-01)')
+    logs.add_argument('--until', type=_time_bound, help='Newest entry to show')
+    logs.add_argument('-n', '--limit', type=int, default=100, help='Number of entries to show (default: 100)')
+    logs.add_argument('-f', '--follow', action='store_true', help='Keep printing new entries as they are written')
+    logs.set_defaults(func=cmd_logs)
+
+    stats = subparsers.add_parser('stats', help='Show request rate and latency statistics for a subdomain')
+    stats.add_argument('subdomain', help='Subdomain to analyse')
+    stats.add_argument('--since', type=_time_bound, help='Start of the window (e.g. 1h, 2024-10-01)')
+    stats.add_argument('--until', type=_time_bound, help='End of the window')
+    stats.add_argument('--top', type=int, default=5, help='Number of slowest upstreams to show (default: 5)')
+    stats.set_defaults(func=cmd_stats)
+
+    health = subparsers.add_parser('health', help='Check that configured backends are reachable')
+    health.add_argument('subdomains', nargs='*', help='Only check these subdomains (default: all)')
+    health.add_argument('--http', action='store_true', help='Send an HTTP HEAD request instead of a TCP connect')
+    health.add_argument('--timeout', type=float, help='Per-backend timeout in seconds')
+    health.add_argument('--concurrency', type=int, help='Maximum number of probes in flight')
+    health.set_defaults(func=cmd_health)
+
+    reload = subparsers.add_parser('reload', help='Test the Nginx configuration and reload it')
+    reload.add_argument('--if-pending', action='store_true',
+                        help='Only reload if a certificate deploy hook queued a reload (webroot mode)')
+    reload.set_defaults(func=cmd_reload, per_instance=True)
+
+    resume = subparsers.add_parser('resume', help='Continue interrupted renew, reset or fix runs')
+    resume.add_argument('run', nargs='?', type=int, help='Only this run (see --list)')
+    resume.add_argument('--list', action='store_true', help='List unfinished runs instead of continuing them')
+    resume.set_defaults(func=cmd_resume, per_instance=True)
+
+    metrics = subparsers.add_parser('metrics', help='Write Prometheus metrics for the node_exporter textfile collector')
+    metrics.add_argument('-o', '--output', help="Output file, or '-' for stdout (default: metrics.textfile)")
+    metrics.set_defaults(func=cmd_metrics)
+
+    apply = subparsers.add_parser('apply', help='Apply a batch file of subdomains in one transaction')
+    apply.add_argument('-f', '--file', required=True, help='YAML or JSON file with the desired subdomains')
+    apply.add_argument('--no-certs', action='store_true', help='Do not obtain missing certificates')
+    apply.add_argument('--cert-workers', type=int, default=1, help='Concurrent certificate requests (default: 1)')
+    apply.add_argument('--dry-run', action='store_true', help='Validate and show the plan without changing anything')
+    apply.add_argument('--text', dest='json', action='store_false', help='Print a human readable summary instead of JSON')
+    apply.add_argument('--summary', help='Also write the JSON summary to this file')
+    apply.set_defaults(func=cmd_apply, per_instance=True, json=True)
+
+    add = subparsers.add_parser('add', help='Add a subdomain')
+    add.add_argument('subdomain', help='Subdomain to add (e.g. app.example.com)')
+    add.add_argument('--ip', help='Internal IP address of the target server')
+    add.add_argument('--port', help='Port the target service is running on')
+    add.add_argument('--option', action='append', help='Custom Nginx directive (repeatable)')
+    _add_backend_arguments(add)
+    _add_limit_arguments(add)
+    add.add_argument('--no-cert', action='store_true', help='Do not obtain a certificate')
+    add.add_argument('--json', action='store_true', help='Print the result as JSON')
+    add.set_defaults(func=cmd_add, per_instance=True)
+
+    edit = subparsers.add_parser('edit', help='Edit a subdomain')
+    edit.add_argument('subdomain', help='Subdomain to edit')
+    edit.add_argument('--ip', help='New internal IP address')
+    edit.add_argument('--port', help='New port')
+    edit.add_argument('--option', action='append', help='Append a custom Nginx directive (repeatable)')
+    edit.add_argument('--clear-options', action='store_true', help='Remove all custom directives first')
+    _add_backend_arguments(edit, edit=True)
+    _add_limit_arguments(edit)
+    edit.add_argument('--no-cert', action='store_true', help='Do not obtain a missing certificate')
+    edit.add_argument('--json', action='store_true', help='Print the result as JSON')
+    edit.set_defaults(func=cmd_edit, per_instance=True)
+
+    delete = subparsers.add_parser('delete', help='Delete subdomains')
+    delete.add_argument('subdomains', nargs='+', help='Subdomains to delete')
+    delete.add_argument('--json', action='store_true', help='Print the result as JSON')
+    delete.set_defaults(func=cmd_delete, per_instance=True)
+
+    export = subparsers.add_parser('export', help='Export the subdomain registry as CSV or JSON lines')
+    export.add_argument('-o', '--output', default='-', help="Output file (default: '-' for stdout)")
+    export.add_argument('--format', choices=('csv', 'jsonl'), help='Output format (default: from extension, else csv)')
+    export.add_argument('--no-cert-state', action='store_true', help='Skip the per-subdomain certificate check')
+    export.set_defaults(func=cmd_export)
+
+    import_ = subparsers.add_parser('import', help='Import subdomains from CSV or JSON lines (upsert)')
+    import_.add_argument('file', help="Input file ('-' for stdin)")
+    import_.add_argument('--format', choices=('csv', 'jsonl'), help='Input format (default: from extension, else csv)')
+    import_.add_argument('--strict', action='store_true', help='Import nothing if any row is invalid')
+    import_.add_argument('--errors', help='Write invalid rows as JSON lines to this file')
+    import_.add_argument('--apply', action='store_true', help='Also write vhosts and reload Nginx for changed rows')
+    import_.add_argument('--certs', action='store_true', help='With --apply, also obtain missing certificates')
+    # Importing only changes the shared registry; applying it writes each instance's vhosts
+    import_.set_defaults(func=cmd_import, per_instance=lambda args: args.apply)
+
+    fleet = subparsers.add_parser('fleet', help='Push the vhosts to every fleet node, test, then reload in waves')
+    fleet.add_argument('--node', action='append', help='Only roll out to this node (repeatable)')
+    fleet.add_argument('--concurrency', type=int, help='Nodes pushed and tested at once')
+    fleet.add_argument('--wave-size', type=int, help='Nodes reloaded per wave')
+    fleet.add_argument('--issue', action='store_true',
+                       help='First obtain certificates on this host for subdomains that have none')
+    fleet.add_argument('--renew', action='store_true', help='First run certbot renew on this host')
+    fleet.add_argument('--no-certs', action='store_true', help='Do not sync certificates to the nodes')
+    fleet.add_argument('--dry-run', action='store_true', help='Only report what would change on each node')
+    fleet.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    fleet.set_defaults(func=cmd_fleet)
+
+    daemon = subparsers.add_parser('daemon', help='Run as a daemon serving a local Unix-socket API')
+    daemon.add_argument('--socket', help='Socket path (default: daemon.socket from config.yaml)')
+    daemon.add_argument('--batch-window', type=float, help='Seconds to collect mutations into one reload')
+    daemon.add_argument('--max-batch', type=int, help='Maximum mutations applied per reload')
+    daemon.add_argument('--no-certs', action='store_true', help='Do not obtain certificates for new subdomains')
+    daemon.set_defaults(func=cmd_daemon, per_instance=ONE_INSTANCE)
+
+    ctl = subparsers.add_parser('ctl', help='Send a request to a running daemon')
+    ctl.add_argument('op', choices=('ping', 'status', 'list', 'create', 'edit', 'delete', 'batch'),
+                     help="Operation; 'batch' pipelines JSON-lines requests from a file or stdin")
+    ctl.add_argument('subdomain', nargs='?', help="Subdomain, or the request file for 'batch' ('-' for stdin)")
+    ctl.add_argument('--ip', help='Target IP address (create/edit)')
+    ctl.add_argument('--port', help='Target port (create/edit)')
+    ctl.add_argument('--option', action='append', help='Custom Nginx directive (create/edit, repeatable)')
+    ctl.add_argument('--socket', help='Socket path (default: daemon.socket from config.yaml)')
+    ctl.set_defaults(func=cmd_ctl)
+
+    return parser
+
+
+def parse_args(argv):
+    """
+    Parse command line arguments.
+
+    Args:
+        argv (list): Command line arguments, without the program name.
+
+    Returns:
+        argparse.Namespace: Parsed arguments; `command` is None when no
+        subcommand was given and the interactive menu should run.
+    """
+    return build_parser().parse_args(argv)
+
+
+def apply_global_options(args, config):
+    """Apply options that affect every mode (menu and subcommands) to the configuration."""
+    if args.offline:
+        config['offline'] = True
+    if args.profile or args.profile_memory:
+        from domain_manager.profiling import enable_profiling
+        from domain_manager.utils.locks import DEFAULT_STATE_DIR
+
+        enable_profiling(args.profile_dir or os.path.join(config.get('state_dir', DEFAULT_STATE_DIR), 'profiles'),
+                         memory=args.profile_memory)
+
+
+def menu_config(args, config):
+    """
+    Return the configuration the interactive menu manages.
+
+    With named instances (see instances.py) the menu manages a single
+    one: the one given with --instance, or the only one configured.
+
+    Raises:
+        ValueError: If no single instance is selected.
+    """
+    from domain_manager.instances import instance_config, resolve_instances
+
+    names = resolve_instances(config, args.instance)
+    if not names:
+        return config
+    if len(names) > 1:
+        raise ValueError(f"The menu manages one Nginx instance at a time; choose one with --instance "
+                         f"({', '.join(names)})")
+    return instance_config(config, names[0])
+
+
+def run_command(args, config, logger):
+    """
+    Run the selected subcommand.
+
+    Commands that change Nginx run once per targeted instance, concurrently
+    when there are several (see instances.py). The others, which read or
+    change only the shared registry, logs and certificates, run once.
+
+    Args:
+        args (argparse.Namespace): Arguments from parse_args.
+        config (dict): Configuration dictionary.
+        logger (logging.Logger): Logger instance.
+
+    Returns:
+        int: Process exit code.
+    """
+    from domain_manager.instances import instance_config, resolve_instances, run_on_instances
+    from domain_manager.metrics import record_operation
+    from domain_manager.profiling import profile_operation
+
+    try:
+        names = resolve_instances(config, args.instance)
+    except ValueError as e:
+        print(Fore.RED + str(e), file=sys.stderr)
+        return 2
+    per_instance = getattr(args, 'per_instance', False)
+    if callable(per_instance):
+        per_instance = per_instance(args)
+    if not per_instance:
+        names = []
+    elif per_instance == ONE_INSTANCE and len(names) > 1:
+        print(Fore.RED + f"'{args.command}' serves one Nginx instance; choose one with --instance "
+                         f"({', '.join(names)})", file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    status = 1
+    try:
+        with profile_operation(args.command):
+            if not names:
+                status = args.func(args, config, logger)
+            elif len(names) == 1:
+                status = args.func(args, instance_config(config, names[0]), logger)
+            else:
+                status = run_on_instances(config, names, lambda view: args.func(args, view, logger))
+        return status
+    finally:
+        record_operation(args.command, time.perf_counter() - start, not status)
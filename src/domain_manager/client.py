@@ -0,0 +1,97 @@
+# domain_manager/client.py
+
+"""
+Thin client for the daemon's Unix-socket API (see daemon.py).
+
+Requests are pipelined: `call_many` writes every request before reading
+the responses, so thousands of operations share one connection and the
+daemon can batch the mutations among them.
+"""
+
+import json
+import socket
+
+DEFAULT_SOCKET = '/run/nginx_domain_manager.sock'
+
+
+class DaemonUnavailable(Exception):
+    """The daemon is not running or its socket cannot be reached."""
+
+
+class Client:
+    """A connection to the daemon."""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=None):
+        self.socket_path = socket_path
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(socket_path)
+        except OSError as e:
+            raise DaemonUnavailable(f"Cannot connect to the daemon at {socket_path}: {e}")
+        self.reader = self.sock.makefile('rb')
+        self.next_id = 0
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _encode(self, request):
+        self.next_id += 1
+        request = {'id': self.next_id, **request}
+        return json.dumps(request, separators=(',', ':')).encode() + b'\n'
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line:
+            raise DaemonUnavailable("The daemon closed the connection.")
+        return json.loads(line)
+
+    def call(self, op, **fields):
+        """
+        Send one request and wait for its response.
+
+        Returns:
+            dict: {'ok': bool, 'result': ...} or {'ok': False, 'error': str}.
+        """
+        self.sock.sendall(self._encode({'op': op, **fields}))
+        return self._read()
+
+    def call_many(self, requests, window=1000):
+        """
+        Pipeline many requests over this connection.
+
+        At most `window` requests are in flight at once, which bounds the
+        socket buffers on both sides.
+
+        Args:
+            requests (iterable): Request dicts, each with an 'op' key.
+            window (int): Maximum number of unanswered requests.
+
+        Yields:
+            dict: Responses, in request order.
+        """
+        in_flight = 0
+        buffered = []
+        for request in requests:
+            buffered.append(self._encode(request))
+            in_flight += 1
+            if len(buffered) >= 64:
+                self.sock.sendall(b''.join(buffered))
+                buffered = []
+            while in_flight >= window:
+                if buffered:
+                    self.sock.sendall(b''.join(buffered))
+                    buffered = []
+                yield self._read()
+                in_flight -= 1
+        if buffered:
+            self.sock.sendall(b''.join(buffered))
+        for _ in range(in_flight):
+            yield self._read()
@@ -3,26 +3,146 @@
 import yaml
 import os
 
+from colorama import Fore
+
+try:
+    # LibYAML bindings are much faster for large registries
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+
+# (inode, mtime, size) of config.yaml as last read or written by this process,
+# per registry copy: the main configuration (None) and each instance's view
+_registry_stamps = {}
+# Settings (everything but the registry) as they are on disk, so registry
+# updates never persist runtime-only keys such as `offline` from --offline
+_disk_settings = None
+
+
+# Overrides the location of config.yaml (used by the benchmarks and for test trees)
+CONFIG_PATH_ENV = 'NGINX_DOMAIN_MANAGER_CONFIG'
+
+
+def get_config_path():
+    """Return the path of config.yaml."""
+    return os.environ.get(CONFIG_PATH_ENV) or os.path.join(os.path.dirname(__file__), 'config.yaml')
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _write_config(config, config_path, view=None):
+    global _disk_settings
+    tmp_path = f"{config_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        yaml.dump(config, f, Dumper=SafeDumper, default_flow_style=False, sort_keys=False)
+    os.replace(tmp_path, config_path)
+    _registry_stamps[view] = _file_stamp(config_path)
+    _disk_settings = {key: value for key, value in config.items() if key != 'subdomains'}
+
+
+def _read_config(config_path, view=None):
+    global _disk_settings
+    stamp = _file_stamp(config_path)
+    with open(config_path, 'r') as f:
+        config = yaml.load(f, Loader=SafeLoader) or {}
+    _registry_stamps[view] = stamp
+    _disk_settings = {key: value for key, value in config.items() if key != 'subdomains'}
+    config.setdefault('subdomains', {})
+    return config
+
+
+def save_config(config):
+    """
+    Write the configuration (including the subdomain registry) to config.yaml.
+
+    The file is written to a temporary path and renamed into place, so a
+    crash never leaves a truncated registry behind. Registry changes made
+    while other runs may be active should go through update_registry,
+    which does not overwrite their changes.
+
+    Args:
+        config (dict): Configuration dictionary.
+    """
+    from domain_manager.utils.locks import registry_lock
+
+    with registry_lock(config):
+        _write_config(config, get_config_path())
+
+
+def refresh_registry(config):
+    """
+    Pick up registry changes written by other runs since this process last read config.yaml.
+
+    The registry dict is updated in place, so references to it stay valid.
+    Nothing is read if the file has not changed. Each instance view (see
+    instances.py) holds its own copy of the registry and is tracked on its own.
+    """
+    config_path = get_config_path()
+    view = config.get('instance')
+    stamp = _registry_stamps.get(view)
+    if stamp is not None and _file_stamp(config_path) == stamp:
+        return
+    registry = config.setdefault('subdomains', {})
+    registry.clear()
+    registry.update(_read_config(config_path, view)['subdomains'])
+
+
+def update_registry(config, changes):
+    """
+    Merge subdomain changes into config.yaml without losing concurrent changes.
+
+    Under the registry lock, the registry is re-read from disk (if another
+    run changed it), the changes are applied and the file is rewritten.
+    The in-memory registry ends up identical to the file.
+
+    Args:
+        config (dict): Configuration dictionary.
+        changes (dict): subdomain -> new registry entry, or None to remove it.
+    """
+    from domain_manager.utils.locks import registry_lock
+
+    with registry_lock(config, quiet=True):
+        refresh_registry(config)
+        registry = config['subdomains']
+        for subdomain, details in changes.items():
+            if details is None:
+                registry.pop(subdomain, None)
+            else:
+                registry[subdomain] = details
+        settings = _disk_settings
+        if settings is None:
+            settings = {key: value for key, value in config.items() if key != 'subdomains'}
+        _write_config({**settings, 'subdomains': registry}, get_config_path(), config.get('instance'))
+
+
 def load_config():
     """Load the configuration from config.yaml."""
-    config_path = os.path.join(os.path.dirname(__file__), 'config.yaml')
+    config_path = get_config_path()
     if not os.path.exists(config_path):
         # Create a default config if not present
         default_config = {
             'log_file': '/var/log/nginx_domain_manager.log',
             'subdomains': {}
         }
-        with open(config_path, 'w') as f:
-            yaml.dump(default_config, f)
+        save_config(default_config)
         return default_config
-    
-    with open(config_path, 'r') as f:
-        config = yaml.safe_load(f)
-    return config
+
+    return _read_config(config_path)
 
 def configure_settings(config):
     """Allow user to configure settings."""
     import logging
+    from domain_manager.bulk import apply_batch, print_summary
+    from domain_manager.utils.display import manage_backends
+    from domain_manager.utils.domain import list_subdomains
+    from domain_manager.utils.picker import pick_subdomain
     logger = logging.getLogger('NGINXDomainManager')
     
     print("\nConfigure Settings:")
@@ -48,13 +168,11 @@ def configure_settings(config):
                 break
             add_custom = input("Add another custom option? (y/n): ").strip().lower()
         
-        config['subdomains'][subdomain] = {
+        update_registry(config, {subdomain: {
             'target_ip': target_ip,
             'target_port': target_port,
             'custom_options': custom_options
-        }
-        with open(os.path.join(os.path.dirname(__file__), 'config.yaml'), 'w') as f:
-            yaml.dump(config, f)
+        }})
         print(Fore.GREEN + f"Subdomain {subdomain} added successfully.")
         logger.info(f"Subdomain {subdomain} added successfully.")
     
@@ -64,24 +182,13 @@ def configure_settings(config):
             print(Fore.YELLOW + "No subdomains to remove.")
             return
         print("\nSelect the subdomain to remove:")
-        for idx, sub in enumerate(subdomains, 1):
-            print(f"{idx}) {sub}")
-        selection = input("Enter the number of the subdomain to remove (or 'q' to cancel): ").strip()
-        if selection.lower() == 'q':
+        subdomain = pick_subdomain(subdomains, 'remove')
+        if subdomain is None:
             print(Fore.YELLOW + "Operation cancelled.")
             return
-        try:
-            idx = int(selection) - 1
-            if idx < 0 or idx >= len(subdomains):
-                raise ValueError
-            subdomain = subdomains[idx]
-            del config['subdomains'][subdomain]
-            with open(os.path.join(os.path.dirname(__file__), 'config.yaml'), 'w') as f:
-                yaml.dump(config, f)
-            print(Fore.GREEN + f"Subdomain {subdomain} removed successfully.")
-            logger.info(f"Subdomain {subdomain} removed successfully.")
-        except (ValueError, IndexError):
-            print(Fore.RED + "Invalid selection.")
+        update_registry(config, {subdomain: None})
+        print(Fore.GREEN + f"Subdomain {subdomain} removed successfully.")
+        logger.info(f"Subdomain {subdomain} removed successfully.")
     
     elif choice == '3':
         subdomains = list_subdomains(config)
@@ -89,41 +196,41 @@ def configure_settings(config):
             print(Fore.YELLOW + "No subdomains to update.")
             return
         print("\nSelect the subdomain to update:")
-        for idx, sub in enumerate(subdomains, 1):
-            print(f"{idx}) {sub}")
-        selection = input("Enter the number of the subdomain to update (or 'q' to cancel): ").strip()
-        if selection.lower() == 'q':
+        subdomain = pick_subdomain(subdomains, 'update')
+        if subdomain is None:
             print(Fore.YELLOW + "Operation cancelled.")
             return
-        try:
-            idx = int(selection) - 1
-            if idx < 0 or idx >= len(subdomains):
-                raise ValueError
-            subdomain = subdomains[idx]
-            print(f"\nUpdating subdomain: {subdomain}")
-            target_ip = input(f"Enter the new internal IP address [{config['subdomains'][subdomain]['target_ip']}]: ").strip() or config['subdomains'][subdomain]['target_ip']
-            target_port = input(f"Enter the new port [{config['subdomains'][subdomain]['target_port']}]: ").strip() or config['subdomains'][subdomain]['target_port']
-            
-            custom_options = config['subdomains'][subdomain].get('custom_options', [])
-            update_custom = input("Do you want to update custom Nginx options? (y/n): ").strip().lower()
-            if update_custom == 'y':
-                custom_options = []
-                add_custom = input("Enter custom Nginx directive (leave blank to stop): ").strip()
-                while add_custom:
-                    custom_options.append(add_custom)
-                    add_custom = input("Enter another custom Nginx directive (leave blank to stop): ").strip()
-            
-            config['subdomains'][subdomain] = {
-                'target_ip': target_ip,
-                'target_port': target_port,
-                'custom_options': custom_options
-            }
-            with open(os.path.join(os.path.dirname(__file__), 'config.yaml'), 'w') as f:
-                yaml.dump(config, f)
+        details = config['subdomains'].get(subdomain)
+        if not details:
+            print(Fore.RED + f"{subdomain} is not in the configuration. Use option 1 to add it.")
+            return
+        print(f"\nUpdating subdomain: {subdomain}")
+        target_ip = details.get('target_ip')
+        target_port = details.get('target_port')
+        if not details.get('backends'):
+            target_ip = input(f"Enter the new internal IP address [{target_ip}]: ").strip() or target_ip
+            target_port = input(f"Enter the new port [{target_port}]: ").strip() or target_port
+
+        custom_options = details.get('custom_options', [])
+        update_custom = input("Do you want to update custom Nginx options? (y/n): ").strip().lower()
+        if update_custom == 'y':
+            custom_options = []
+            add_custom = input("Enter custom Nginx directive (leave blank to stop): ").strip()
+            while add_custom:
+                custom_options.append(add_custom)
+                add_custom = input("Enter another custom Nginx directive (leave blank to stop): ").strip()
+
+        new_details = {**details, 'target_ip': target_ip, 'target_port': target_port, 'custom_options': custom_options}
+        if details.get('backends'):
+            # Load-balanced: the backends are edited as a whole, target_ip/target_port follow them
+            new_details = manage_backends(new_details)
+
+        # Update config.yaml, recreate the Nginx config and reload, as the main menu's edit does
+        summary = apply_batch(config, [(subdomain, new_details)])
+        print_summary(summary)
+        if summary['ok']:
             print(Fore.GREEN + f"Subdomain {subdomain} updated successfully.")
             logger.info(f"Subdomain {subdomain} updated successfully.")
-        except (ValueError, IndexError):
-            print(Fore.RED + "Invalid selection.")
     
     elif choice == '4':
         # Go back to Settings Menu
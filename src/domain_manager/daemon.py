@@ -0,0 +1,380 @@
+# domain_manager/daemon.py
+
+"""
+Long-running daemon with a local Unix-socket API.
+
+The daemon keeps the registry, the set of enabled vhosts and the
+certificate inventory in memory. Clients send newline-delimited JSON
+requests and receive one JSON response per request, in order:
+
+    -> {"id": 1, "op": "create", "subdomain": "app.example.com", "target_ip": "10.0.0.5", "target_port": "8080"}
+    <- {"id": 1, "ok": true, "result": {"subdomain": "app.example.com", "action": "created", ...}}
+
+Read-only operations (list, status, ping) are answered from memory.
+Mutations (create, edit, delete) go through a single queue. The worker
+drains it in batches: everything that arrived within `batch_window`
+seconds (up to `max_batch` operations) is applied by one
+bulk.apply_batch call. A batch writes the registry once, runs one
+`nginx -t` and one reload.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+from domain_manager.bulk import ABSENT, apply_batch
+from domain_manager.client import DEFAULT_SOCKET
+from domain_manager.metrics import flush_metrics, record_operation
+from domain_manager.profiling import profile_operation
+from domain_manager.utils.domain import certificate_exists, list_subdomains
+from domain_manager.utils.validation import BatchValidator
+from domain_manager.version import get_version
+
+logger = logging.getLogger('NGINXDomainManager')
+
+DEFAULT_DAEMON = {
+    'socket': DEFAULT_SOCKET,
+    'batch_window': 0.05,
+    'max_batch': 500,
+    'certificates': True,
+}
+
+READ_OPS = ('ping', 'list', 'status')
+MUTATION_OPS = ('create', 'edit', 'delete')
+
+
+def daemon_settings(config):
+    """Return daemon settings from config.yaml merged over the defaults."""
+    settings = dict(DEFAULT_DAEMON)
+    settings.update(config.get('daemon') or {})
+    return settings
+
+
+class DaemonError(Exception):
+    """A request that cannot be served; reported to the client, not logged as a failure."""
+
+
+class Daemon:
+    """In-memory state, request dispatch and the mutation worker."""
+
+    def __init__(self, config, batch_window=None, max_batch=None, certificates=None):
+        settings = daemon_settings(config)
+        self.config = config
+        self.registry = config.setdefault('subdomains', {})
+        self.batch_window = batch_window if batch_window is not None else settings['batch_window']
+        self.max_batch = max_batch if max_batch is not None else settings['max_batch']
+        self.certificates = certificates if certificates is not None else settings['certificates']
+        self.enabled = set()
+        self.certs = {}
+        self.queue = None
+        self.started_at = time.time()
+        self.counters = {'requests': 0, 'mutations': 0, 'batches': 0, 'reloads': 0, 'failed_batches': 0}
+
+    def load_inventory(self):
+        """Scan the vhost directory and the certificate store once, at startup."""
+        start = time.perf_counter()
+        self.enabled = set(list_subdomains(self.config))
+        self.certs = {subdomain: certificate_exists(subdomain) for subdomain in self.registry}
+        logger.info(f"Daemon inventory loaded: {len(self.registry)} subdomains, {len(self.enabled)} enabled vhosts, "
+                    f"{sum(self.certs.values())} certificates in {time.perf_counter() - start:.2f}s.")
+
+    # Read-only operations
+
+    def op_ping(self, request):
+        return {'version': get_version()}
+
+    def op_list(self, request):
+        entries = []
+        for subdomain, details in list(self.registry.items()):
+            entries.append({
+                'subdomain': subdomain,
+                'target_ip': details.get('target_ip'),
+                'target_port': details.get('target_port'),
+                'custom_options': details.get('custom_options') or [],
+                'backends': details.get('backends') or [],
+                'enabled': subdomain in self.enabled,
+                'certificate': self.certs.get(subdomain, False),
+            })
+        return entries
+
+    def op_status(self, request):
+        subdomain = request.get('subdomain')
+        if subdomain:
+            details = self.registry.get(subdomain)
+            if details is None:
+                raise DaemonError(f"Subdomain {subdomain} does not exist.")
+            return {'subdomain': subdomain, **details, 'enabled': subdomain in self.enabled,
+                    'certificate': self.certs.get(subdomain, False)}
+        return {
+            'version': get_version(),
+            'pid': os.getpid(),
+            'uptime_s': round(time.time() - self.started_at, 1),
+            'subdomains': len(self.registry),
+            'enabled': len(self.enabled),
+            'certificates': sum(self.certs.values()),
+            'queued': self.queue.qsize() if self.queue else 0,
+            **self.counters,
+        }
+
+    # Mutations
+
+    async def submit(self, request):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    def _plan(self, request, pending):
+        """
+        Turn one mutation request into a (subdomain, details) batch entry.
+
+        `pending` holds the entries already planned for this batch, so a
+        create followed by an edit of the same subdomain behaves as if
+        they had been applied one after the other.
+        """
+        op = request['op']
+        subdomain = str(request.get('subdomain') or '').strip().lower()
+        if not subdomain:
+            raise DaemonError("Missing 'subdomain'.")
+        current = pending.get(subdomain, self.registry.get(subdomain))
+        if current is not None and current.get('state') == ABSENT:
+            current = None
+
+        if op == 'delete':
+            if current is None:
+                raise DaemonError(f"Subdomain {subdomain} does not exist.")
+            return subdomain, {'state': ABSENT}
+
+        if op == 'create':
+            if current is not None:
+                raise DaemonError(f"Subdomain {subdomain} already exists. Use 'edit' to change it.")
+            details = {'custom_options': []}
+        else:
+            if current is None:
+                raise DaemonError(f"Subdomain {subdomain} does not exist.")
+            details = dict(current)
+        for key in ('target_ip', 'target_port', 'custom_options', 'backends', 'balance', 'hash_key'):
+            if request.get(key) is not None:
+                details[key] = request[key] if key in ('custom_options', 'backends') else str(request[key])
+        errors = BatchValidator(self.config).check(subdomain, details)
+        if errors:
+            raise DaemonError('; '.join(errors))
+        return subdomain, details
+
+    async def _next_batch(self):
+        """Wait for one mutation, then collect whatever else arrives within the batch window."""
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _apply(self, entries):
+        """Apply a batch; if nginx rejects it as a whole, apply its entries one by one."""
+        start = time.perf_counter()
+        with profile_operation(f"daemon batch of {len(entries)}"):
+            summary = apply_batch(self.config, entries, certificates=self.certificates)
+            summaries = [(entries, summary)]
+            if summary['status'] == 'nginx_test_failed' and len(entries) > 1:
+                logger.warning(f"Batch of {len(entries)} rejected by nginx -t; retrying entries individually.")
+                summaries = [([entry], apply_batch(self.config, [entry], certificates=self.certificates))
+                             for entry in entries]
+        record_operation('daemon batch', time.perf_counter() - start, all(s['ok'] for _, s in summaries))
+        flush_metrics()
+        return summaries
+
+    def _refresh_inventory(self, subdomains):
+        for subdomain in subdomains:
+            if subdomain in self.registry:
+                self.enabled.add(subdomain)
+                self.certs[subdomain] = certificate_exists(subdomain)
+            else:
+                self.enabled.discard(subdomain)
+                self.certs.pop(subdomain, None)
+
+    @staticmethod
+    def _result_for(subdomain, summary):
+        action = 'unchanged'
+        for key in ('created', 'updated', 'deleted'):
+            if subdomain in summary[key]:
+                action = key
+        certificates = summary['certificates']
+        if subdomain in certificates['issued']:
+            certificate = 'issued'
+        elif subdomain in certificates['existing']:
+            certificate = 'existing'
+        elif subdomain in certificates['failed']:
+            certificate = 'failed'
+        else:
+            certificate = None
+        errors = list(summary['errors'].get(subdomain, []))
+        if summary['status'] in ('invalid', 'write_failed', 'nginx_test_failed'):
+            errors.extend(message for messages in summary['errors'].values() for message in messages)
+            action = 'rejected'
+        return {
+            'subdomain': subdomain,
+            'action': action,
+            'certificate': certificate,
+            'reload': summary['reload'],
+            'status': summary['status'],
+            'errors': errors,
+        }
+
+    async def worker(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._process(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _process(self, batch):
+        pending = {}
+        waiters = {}
+        for request, future in batch:
+            try:
+                subdomain, details = self._plan(request, pending)
+            except DaemonError as e:
+                future.set_result({'ok': False, 'error': str(e)})
+                continue
+            pending[subdomain] = details
+            waiters.setdefault(subdomain, []).append(future)
+        self.counters['mutations'] += len(batch)
+        if not pending:
+            return
+
+        entries = list(pending.items())
+        try:
+            summaries = await asyncio.get_running_loop().run_in_executor(None, self._apply, entries)
+        except Exception as e:
+            logger.exception(f"Daemon batch of {len(entries)} failed: {e}")
+            self.counters['failed_batches'] += 1
+            for futures in waiters.values():
+                for future in futures:
+                    future.set_result({'ok': False, 'error': f"Internal error: {e}"})
+            return
+
+        self.counters['batches'] += 1
+        for batch_entries, summary in summaries:
+            if summary['reload'] != 'skipped':
+                self.counters['reloads'] += 1
+            if not summary['ok']:
+                self.counters['failed_batches'] += 1
+            for subdomain, _ in batch_entries:
+                result = self._result_for(subdomain, summary)
+                ok = result['action'] != 'rejected' and not result['errors'] and result['certificate'] != 'failed'
+                for future in waiters[subdomain]:
+                    future.set_result({'ok': ok, 'result': result})
+        self._refresh_inventory(pending)
+
+    # Protocol
+
+    async def dispatch(self, request):
+        self.counters['requests'] += 1
+        op = request.get('op')
+        if op in READ_OPS:
+            try:
+                return {'ok': True, 'result': getattr(self, f"op_{op}")(request)}
+            except DaemonError as e:
+                return {'ok': False, 'error': str(e)}
+        if op in MUTATION_OPS:
+            return await self.submit(request)
+        return {'ok': False, 'error': f"Unknown op: {op!r}"}
+
+    async def handle_client(self, reader, writer):
+        """Serve one connection; requests are answered in the order they were sent."""
+        responses = asyncio.Queue()
+
+        async def send_responses():
+            while True:
+                task = await responses.get()
+                if task is None:
+                    break
+                response = await task
+                writer.write(json.dumps(response, separators=(',', ':')).encode() + b'\n')
+                if responses.empty():
+                    await writer.drain()
+
+        sender = asyncio.ensure_future(send_responses())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("expected a JSON object")
+                except ValueError as e:
+                    await responses.put(_completed({'ok': False, 'error': f"Invalid request: {e}"}))
+                    continue
+                await responses.put(asyncio.ensure_future(self._respond(request)))
+        finally:
+            await responses.put(None)
+            await sender
+            writer.close()
+
+    async def _respond(self, request):
+        response = await self.dispatch(request)
+        if 'id' in request:
+            response = {'id': request['id'], **response}
+        return response
+
+
+def _completed(value):
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(value)
+    return future
+
+
+async def _serve(daemon, socket_path):
+    daemon.queue = asyncio.Queue()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+    server = await asyncio.start_unix_server(daemon.handle_client, path=socket_path)
+    os.chmod(socket_path, 0o600)
+    worker = asyncio.ensure_future(daemon.worker())
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    logger.info(f"Daemon listening on {socket_path} (pid {os.getpid()}).")
+    print(f"Listening on {socket_path}. Press Ctrl+C to stop.")
+    try:
+        await stop.wait()
+    finally:
+        # Stop accepting connections, then let queued mutations finish before exiting
+        server.close()
+        await daemon.queue.join()
+        worker.cancel()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        logger.info("Daemon stopped.")
+
+
+def run_daemon(config, socket_path=None, batch_window=None, max_batch=None, certificates=None):
+    """
+    Load the inventory and serve requests until SIGINT or SIGTERM.
+
+    Args:
+        config (dict): Configuration dictionary; the daemon owns its registry.
+        socket_path (str, optional): Override the configured socket path.
+        batch_window (float, optional): Seconds to wait for more mutations before applying a batch.
+        max_batch (int, optional): Maximum mutations per batch.
+        certificates (bool, optional): Obtain certificates for new subdomains.
+    """
+    daemon = Daemon(config, batch_window=batch_window, max_batch=max_batch, certificates=certificates)
+    daemon.load_inventory()
+    asyncio.run(_serve(daemon, socket_path or daemon_settings(config)['socket']))
@@ -0,0 +1,584 @@
+# domain_manager/fleet.py
+
+"""
+Fleet mode: push the registry's vhosts to several Nginx nodes at once.
+
+The vhosts are rendered once. The rollout then runs in three steps:
+
+1. push the rendered files to every node concurrently and run the node's
+   configuration test. If any push or test fails, every node gets its
+   previous files back and nothing is reloaded;
+2. reload the nodes in waves of `wave_size`, each wave in parallel;
+3. if a reload fails, restore the previous files on every node and
+   reload the nodes that already took the new configuration.
+
+Nodes are reached through transports. A transport pushes files, restores
+them, and runs the node's test and reload commands. `local` (directories
+on this host plus local commands) is built in. Other transports register
+themselves with register_transport.
+
+Certificates can be issued centrally as well. This host obtains and
+renews them, and nodes with a `letsencrypt_dir` receive the `live/` and
+`archive/` lineages before their vhosts are pushed. Only files whose size
+or modification time differs are copied, so a node can reload with
+renewed certificates without ever running certbot itself.
+Certificates are not rolled back: every version in `archive/` stays
+valid, and a failed rollout leaves the new files unused.
+
+Each node's last successfully rolled-out file set is kept in
+`<state_dir>/fleet/<node>.json`, so vhosts removed from the registry are
+removed from the nodes too. Files the tool never pushed are left alone.
+"""
+
+import json
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from colorama import Fore
+
+from domain_manager.logger import log_span
+from domain_manager.utils.locks import DEFAULT_STATE_DIR, file_lock, lock_dir
+
+logger = logging.getLogger('NGINXDomainManager')
+
+DEFAULT_FLEET = {
+    'concurrency': 8,
+    'wave_size': 1,
+    'command_timeout': 60,
+    'nodes': {},
+}
+
+
+def fleet_settings(config):
+    """Return fleet settings from config.yaml merged over the defaults."""
+    settings = dict(DEFAULT_FLEET)
+    settings.update(config.get('fleet') or {})
+    return settings
+
+
+class FleetError(Exception):
+    """Raised for an unusable fleet configuration."""
+
+
+def _run_command(command, timeout):
+    """Run a command line; returns (ok, combined output)."""
+    try:
+        result = subprocess.run(shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return False, str(e)
+    return result.returncode == 0, result.stdout.strip()
+
+
+# Transports
+
+class Transport:
+    """
+    How the fan-out reaches one node.
+
+    Subclasses implement every method below. `files` maps file names (e.g.
+    'app.example.com.conf') to their rendered content; `stale` lists
+    previously pushed file names that must be removed.
+    """
+
+    def __init__(self, name, settings, timeout):
+        self.name = name
+        self.settings = settings
+        self.timeout = timeout
+
+    def diff(self, files, stale):
+        """Return (names whose content differs, stale names present on the node)."""
+        raise NotImplementedError
+
+    def push(self, files, stale):
+        """Install `files`, remove `stale`, and return a token that restore() accepts."""
+        raise NotImplementedError
+
+    def restore(self, token):
+        """Put back the node's files as they were before push()."""
+        raise NotImplementedError
+
+    def test(self):
+        """Validate the node's configuration; returns (ok, output)."""
+        raise NotImplementedError
+
+    def reload(self):
+        """Reload the node's Nginx; returns (ok, output)."""
+        raise NotImplementedError
+
+    # Whether the node receives centrally issued certificates
+    receives_certificates = False
+
+    def certificate_state(self, lineages):
+        """Return the node's copy of some certificate lineages, in the format of certificate_files."""
+        raise NotImplementedError
+
+    def sync_certificates(self, source_root, changes, removals):
+        """
+        Copy changed certificate files from `source_root` and delete `removals`.
+
+        Args:
+            source_root (str): Let's Encrypt directory on this host.
+            changes (list): (relative path, entry) pairs from certificate_files.
+            removals (list): Relative paths to delete.
+        """
+        raise NotImplementedError
+
+    def _run(self, command):
+        return _run_command(command, self.timeout)
+
+
+class LocalTransport(Transport):
+    """
+    A node whose configuration lives in directories on this host.
+
+    Settings: `sites_available`, `sites_enabled`, `test_command` (default
+    'nginx -t'), `reload_command` (default 'systemctl reload nginx') and,
+    to receive certificates, `letsencrypt_dir`.
+    """
+
+    def __init__(self, name, settings, timeout):
+        super().__init__(name, settings, timeout)
+        for key in ('sites_available', 'sites_enabled'):
+            if not settings.get(key):
+                raise FleetError(f"Node {name}: '{key}' is required for the local transport")
+        self.available = settings['sites_available']
+        self.enabled = settings['sites_enabled']
+        self.receives_certificates = bool(settings.get('letsencrypt_dir'))
+
+    def _paths(self, filename):
+        return os.path.join(self.available, filename), os.path.join(self.enabled, filename)
+
+    def diff(self, files, stale):
+        changed = []
+        for filename, content in files.items():
+            available_path, enabled_path = self._paths(filename)
+            try:
+                with open(available_path, 'r') as f:
+                    same = f.read() == content
+            except OSError:
+                same = False
+            if not same or not os.path.lexists(enabled_path):
+                changed.append(filename)
+        removed = [filename for filename in stale if any(os.path.lexists(path) for path in self._paths(filename))]
+        return changed, removed
+
+    def push(self, files, stale):
+        changed, removed = self.diff(files, stale)
+        token = {}
+        for filename in changed + removed:
+            for path in self._paths(filename):
+                if os.path.islink(path):
+                    token[path] = ('link', os.readlink(path))
+                elif os.path.isfile(path):
+                    with open(path, 'r') as f:
+                        token[path] = ('file', f.read())
+                else:
+                    token[path] = (None, None)
+        os.makedirs(self.available, exist_ok=True)
+        os.makedirs(self.enabled, exist_ok=True)
+        for filename in changed:
+            available_path, enabled_path = self._paths(filename)
+            tmp_path = f"{available_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(files[filename])
+            os.replace(tmp_path, available_path)
+            if not os.path.lexists(enabled_path):
+                os.symlink(available_path, enabled_path)
+        for filename in removed:
+            for path in self._paths(filename):
+                if os.path.lexists(path):
+                    os.remove(path)
+        return token
+
+    def restore(self, token):
+        for path, (kind, value) in token.items():
+            if os.path.lexists(path):
+                os.remove(path)
+            if kind == 'file':
+                with open(path, 'w') as f:
+                    f.write(value)
+            elif kind == 'link':
+                os.symlink(value, path)
+
+    def certificate_state(self, lineages):
+        return certificate_files(self.settings['letsencrypt_dir'], lineages)
+
+    def sync_certificates(self, source_root, changes, removals):
+        root = self.settings['letsencrypt_dir']
+        # Archive files first, then the live/ links to them, so a link never points at a missing file
+        for relpath, entry in sorted(changes, key=lambda change: change[1][0] == 'link'):
+            target = os.path.join(root, relpath)
+            os.makedirs(os.path.dirname(target), mode=0o700, exist_ok=True)
+            tmp_path = f"{target}.tmp"
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            if entry[0] == 'link':
+                os.symlink(entry[1], tmp_path)
+            else:
+                shutil.copy2(os.path.join(source_root, relpath), tmp_path)
+            os.replace(tmp_path, target)
+        for relpath in sorted(removals, key=lambda path: not path.startswith('live/')):
+            path = os.path.join(root, relpath)
+            if os.path.lexists(path):
+                os.remove(path)
+            directory = os.path.dirname(path)
+            if os.path.isdir(directory) and not os.listdir(directory):
+                os.rmdir(directory)
+
+    def test(self):
+        return self._run(self.settings.get('test_command', 'nginx -t'))
+
+    def reload(self):
+        return self._run(self.settings.get('reload_command', 'systemctl reload nginx'))
+
+
+TRANSPORTS = {'local': LocalTransport}
+
+
+def register_transport(name, transport_class):
+    """Make a Transport subclass available as `transport: <name>` in fleet node settings."""
+    TRANSPORTS[name] = transport_class
+
+
+def load_nodes(config, names=None):
+    """
+    Build the transports of the configured nodes.
+
+    Args:
+        config (dict): Configuration dictionary.
+        names (list, optional): Only these nodes (default: all).
+
+    Raises:
+        FleetError: If no nodes are configured, a name is unknown or a node is misconfigured.
+    """
+    settings = fleet_settings(config)
+    nodes = settings['nodes'] or {}
+    if not nodes:
+        raise FleetError("No fleet nodes configured (see 'fleet.nodes' in config.yaml)")
+    unknown = sorted(set(names or ()) - set(nodes))
+    if unknown:
+        raise FleetError(f"Unknown fleet nodes: {', '.join(unknown)}")
+    transports = []
+    for name, node in nodes.items():
+        if names and name not in names:
+            continue
+        kind = (node or {}).get('transport', 'local')
+        if kind not in TRANSPORTS:
+            raise FleetError(f"Node {name}: unknown transport '{kind}'")
+        transports.append(TRANSPORTS[kind](name, node or {}, settings['command_timeout']))
+    return transports
+
+
+# Certificates
+
+def letsencrypt_root():
+    """The Let's Encrypt directory of this host (the parent of live/)."""
+    from domain_manager.utils import domain
+
+    return os.path.dirname(domain.LETSENCRYPT_LIVE_DIR.rstrip(os.sep))
+
+
+def certificate_files(root, lineages):
+    """
+    Describe the live/ and archive/ entries of some certificate lineages.
+
+    Returns:
+        dict: Relative path (e.g. 'archive/app.example.com/cert1.pem') ->
+        ('link', target) for symlinks or ('file', size, mtime_ns) for files.
+    """
+    entries = {}
+    for lineage in lineages:
+        for kind in ('live', 'archive'):
+            directory = os.path.join(root, kind, lineage)
+            try:
+                with os.scandir(directory) as items:
+                    for item in items:
+                        relpath = f"{kind}/{lineage}/{item.name}"
+                        if item.is_symlink():
+                            entries[relpath] = ('link', os.readlink(item.path))
+                        elif item.is_file():
+                            stat = item.stat()
+                            entries[relpath] = ('file', stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                continue
+    return entries
+
+
+def issue_missing_certificates(config):
+    """
+    Obtain certificates on this host for registry entries that have none.
+
+    Returns:
+        dict: subdomain -> True if the certificate was obtained.
+    """
+    from domain_manager.utils.domain import certificate_exists, obtain_certificate
+
+    return {subdomain: obtain_certificate(subdomain, install=False, quiet=True, config=config)
+            for subdomain in (config.get('subdomains') or {}) if not certificate_exists(subdomain)}
+
+
+def renew_issued_certificates():
+    """Run `certbot renew` on this host; returns (ok, output)."""
+    return _step('certbot', None, lambda: _run_command('certbot renew --non-interactive', None))
+
+
+# Fan-out
+
+class _StepFailed(Exception):
+    pass
+
+
+def _step(phase, node, action):
+    """Run a transport's test or reload inside a log span that records failures; returns (ok, output)."""
+    output = ''
+    try:
+        with log_span(phase, node):
+            ok, output = action()
+            if not ok:
+                raise _StepFailed()
+    except _StepFailed:
+        return False, output
+    return True, output
+
+
+def render_fleet_files(config):
+    """
+    Render every registry entry once; returns file name -> content (grouped per apex in the apex layout).
+
+    Nodes include sites-enabled in the http context, so what the vhosts
+    need from that context is pushed alongside them: the zone declarations
+    if any vhost uses rate or connection limits, the timing log format if
+    any vhost writes an access log, and the TLS settings if any vhost
+    serves HTTPS. Node vhosts include nothing from this host's
+    configuration directory.
+    """
+    from domain_manager.utils.access_stats import ACCESS_LOG_FORMAT_FILE, access_log_format, access_log_settings
+    from domain_manager.utils.acme import SSL_SNIPPET, SSL_SNIPPET_FILE
+    from domain_manager.utils.domain import certificate_exists
+    from domain_manager.utils.nginx_config import render_vhost
+    from domain_manager.utils.rate_limits import LIMITS_FILE, limit_zones, render_limit_zones
+    from domain_manager.utils.vhost_layout import layout_files
+
+    registry = config.get('subdomains') or {}
+    secured = {subdomain for subdomain in registry if certificate_exists(subdomain)}
+    with log_span('render'):
+        files = layout_files(config, {
+            subdomain: render_vhost(config, subdomain, details, ssl=subdomain in secured, node=True)
+            for subdomain, details in registry.items()
+        })
+    if limit_zones(config, registry):
+        files[LIMITS_FILE] = render_limit_zones(config, registry)
+    if any(access_log_settings(config, details)['enabled'] for details in registry.values()):
+        files[ACCESS_LOG_FORMAT_FILE] = access_log_format()
+    if secured:
+        files[SSL_SNIPPET_FILE] = SSL_SNIPPET
+    return files
+
+
+def _manifest_path(config, node, kind=None):
+    name = f"{node}.{kind}.json" if kind else f"{node}.json"
+    return os.path.join(config.get('state_dir', DEFAULT_STATE_DIR), 'fleet', name)
+
+
+def _load_manifest(config, node, kind=None):
+    try:
+        with open(_manifest_path(config, node, kind), 'r') as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+
+def _save_manifest(config, node, filenames, kind=None):
+    path = _manifest_path(config, node, kind)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(sorted(filenames), f)
+    os.replace(tmp_path, path)
+
+
+def _node_summary():
+    return {'changed': 0, 'removed': 0, 'certificates': 0, 'push': 'skipped', 'test': 'skipped', 'reload': 'skipped',
+            'rollback': 'skipped', 'error': None}
+
+
+def _certificate_plan(config, transports):
+    """Return (lineages, node -> (changes, removals)) for the nodes that receive certificates."""
+    from domain_manager.utils.domain import certificate_exists
+
+    lineages = sorted(subdomain for subdomain in (config.get('subdomains') or {}) if certificate_exists(subdomain))
+    source = certificate_files(letsencrypt_root(), lineages)
+    plans = {}
+    for transport in transports:
+        if not transport.receives_certificates:
+            continue
+        stale = sorted(_load_manifest(config, transport.name, 'certs') - set(lineages))
+        current = transport.certificate_state(lineages + stale)
+        changes = [(relpath, entry) for relpath, entry in source.items() if current.get(relpath) != entry]
+        removals = [relpath for relpath in current if relpath not in source]
+        plans[transport.name] = (changes, removals)
+    return lineages, plans
+
+
+def fan_out(config, nodes=None, concurrency=None, wave_size=None, dry_run=False, certificates=True):
+    """
+    Render the registry once and roll it out to the fleet.
+
+    Args:
+        config (dict): Configuration dictionary.
+        nodes (list, optional): Node names to roll out to (default: all).
+        concurrency (int, optional): Nodes pushed, tested or rolled back at once.
+        wave_size (int, optional): Nodes reloaded per wave.
+        dry_run (bool): Only report what would change on each node.
+        certificates (bool): Sync this host's certificates to the nodes that
+            have a `letsencrypt_dir`.
+
+    Returns:
+        dict: Summary with 'ok', 'status' ('applied', 'unchanged', 'dry_run',
+        'test_failed', 'reload_failed' or 'invalid'), 'nodes' (name -> node
+        summary), 'waves', 'files' and 'duration_s'.
+    """
+    start = time.perf_counter()
+    settings = fleet_settings(config)
+    concurrency = max(1, concurrency or settings['concurrency'])
+    wave_size = max(1, wave_size or settings['wave_size'])
+    summary = {'ok': True, 'status': 'applied', 'nodes': {}, 'waves': 0, 'files': 0, 'errors': []}
+    try:
+        transports = load_nodes(config, nodes)
+    except FleetError as e:
+        summary.update(ok=False, status='invalid', errors=[str(e)])
+        return summary
+
+    files = render_fleet_files(config)
+    summary['files'] = len(files)
+    results = {transport.name: _node_summary() for transport in transports}
+    summary['nodes'] = results
+    stale = {transport.name: sorted(_load_manifest(config, transport.name) - set(files)) for transport in transports}
+
+    with file_lock(os.path.join(lock_dir(config), 'fleet.lock'), description='fleet'), \
+            ThreadPoolExecutor(max_workers=min(concurrency, len(transports))) as pool:
+        lineages, cert_plans = _certificate_plan(config, transports) if certificates else ([], {})
+        for name, (changes, removals) in cert_plans.items():
+            results[name]['certificates'] = len(changes) + len(removals)
+
+        if dry_run:
+            for transport, (changed, removed) in zip(transports, pool.map(
+                    lambda t: t.diff(files, stale[t.name]), transports)):
+                results[transport.name].update(changed=len(changed), removed=len(removed))
+            summary['status'] = 'dry_run'
+            summary['duration_s'] = round(time.perf_counter() - start, 3)
+            return summary
+
+        tokens = {}
+
+        def push_and_test(transport):
+            result = results[transport.name]
+            try:
+                if result['certificates']:
+                    with log_span('push certificates', transport.name):
+                        transport.sync_certificates(letsencrypt_root(), *cert_plans[transport.name])
+                changed, removed = transport.diff(files, stale[transport.name])
+                result.update(changed=len(changed), removed=len(removed))
+                with log_span('push', transport.name):
+                    tokens[transport.name] = transport.push(files, stale[transport.name])
+                result['push'] = 'ok'
+            except Exception as e:  # any transport failure must still lead to a rollback
+                result.update(push='failed', error=str(e) or e.__class__.__name__)
+                return False
+            ok, output = _step('nginx -t', transport.name, transport.test)
+            result['test'] = 'ok' if ok else 'failed'
+            if not ok:
+                result['error'] = output
+            return ok
+
+        def restore(transport):
+            if transport.name not in tokens:
+                return
+            try:
+                transport.restore(tokens[transport.name])
+                results[transport.name]['rollback'] = 'ok'
+            except Exception as e:
+                results[transport.name]['rollback'] = 'failed'
+                logger.error(f"Fleet rollback failed on {transport.name}: {e}")
+
+        def reload(transport):
+            return _step('reload', transport.name, transport.reload)
+
+        # 1. Push and test everywhere before any node reloads
+        if not all(list(pool.map(push_and_test, transports))):
+            list(pool.map(restore, transports))
+            failed = [name for name, result in results.items() if result['error']]
+            logger.error(f"Fleet rollout aborted before any reload; failed on: {', '.join(failed)}")
+            summary.update(ok=False, status='test_failed')
+            summary['duration_s'] = round(time.perf_counter() - start, 3)
+            return summary
+
+        if not any(result['changed'] or result['removed'] or result['certificates'] for result in results.values()):
+            summary['status'] = 'unchanged'
+        else:
+            # 2. Reload in waves
+            reloaded = []
+            for offset in range(0, len(transports), wave_size):
+                wave = transports[offset:offset + wave_size]
+                summary['waves'] += 1
+                outcomes = list(pool.map(reload, wave))
+                for transport, (ok, output) in zip(wave, outcomes):
+                    results[transport.name]['reload'] = 'ok' if ok else 'failed'
+                    if ok:
+                        reloaded.append(transport)
+                    else:
+                        results[transport.name]['error'] = output
+                if not all(ok for ok, _ in outcomes):
+                    # 3. Roll every node back; reload the ones running the new configuration
+                    failed = [t.name for t, (ok, _) in zip(wave, outcomes) if not ok]
+                    logger.error(f"Fleet reload failed on {', '.join(failed)}; rolling back all nodes.")
+                    list(pool.map(restore, transports))
+                    for transport, (ok, output) in zip(reloaded, pool.map(reload, reloaded)):
+                        if not ok:
+                            results[transport.name]['rollback'] = 'failed'
+                            results[transport.name]['error'] = output
+                    summary.update(ok=False, status='reload_failed')
+                    summary['duration_s'] = round(time.perf_counter() - start, 3)
+                    return summary
+
+        for transport in transports:
+            _save_manifest(config, transport.name, files)
+            if transport.name in cert_plans:
+                _save_manifest(config, transport.name, lineages, 'certs')
+
+    changed = sum(1 for result in results.values() if result['changed'] or result['removed'] or result['certificates'])
+    logger.info(f"Fleet rollout of {len(files)} vhosts: {changed} of {len(transports)} nodes changed, "
+                f"{summary['waves']} reload waves, in {time.perf_counter() - start:.3f}s.")
+    summary['duration_s'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def print_fleet_summary(summary):
+    """Print a fan-out summary for interactive use."""
+    for error in summary['errors']:
+        print(Fore.RED + error)
+    for name, result in summary['nodes'].items():
+        color = Fore.RED if result['error'] else Fore.GREEN
+        line = (f"{name}: {result['changed']} changed, {result['removed']} removed, "
+                f"{result['certificates']} certificate files synced, push {result['push']}, "
+                f"test {result['test']}, reload {result['reload']}")
+        if result['rollback'] != 'skipped':
+            line += f", rollback {result['rollback']}"
+        print(color + line)
+        if result['error']:
+            print(Fore.RED + f"  {result['error']}")
+    messages = {
+        'applied': Fore.GREEN + "Fleet rollout complete.",
+        'unchanged': Fore.GREEN + "Every node is already up to date.",
+        'dry_run': Fore.YELLOW + "Dry run: nothing was changed.",
+        'test_failed': Fore.RED + "Configuration test failed; no node was reloaded and all files were restored.",
+        'reload_failed': Fore.RED + "Reload failed; every node was rolled back.",
+    }
+    if summary['status'] in messages:
+        print(messages[summary['status']])
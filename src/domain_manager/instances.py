@@ -0,0 +1,195 @@
+# domain_manager/instances.py
+
+"""
+Named Nginx instances on one host.
+
+Without an `instances` section the tool manages the system Nginx: vhosts
+under /etc/nginx, `nginx -t` and `systemctl reload nginx`. Several
+instances (to spread load across cores, or one per tenant) are declared
+by name:
+
+    instances:
+      edge-a:
+        root: /srv/nginx/edge-a              # the instance's /etc/nginx is <root>/etc/nginx
+        nginx: /usr/sbin/nginx
+        conf: /srv/nginx/edge-a/etc/nginx/nginx.conf
+        reload_command: "systemctl reload nginx@edge-a"
+      edge-b:
+        root: /srv/nginx/edge-b
+
+`nginx_conf_dir`, `sites_available`, `sites_enabled` and `backup_dir` may
+be set per instance; they are derived from `root` otherwise. An instance
+with its own `root` or `nginx_conf_dir` is tested against
+`<nginx_conf_dir>/nginx.conf` unless `conf` says otherwise, so `nginx -t`
+never checks the system configuration instead. Without a `reload_command`,
+an instance with its own binary or conf is reloaded with
+`<nginx> -c <conf> -s reload`.
+
+Every instance serves the same registry and the same certificates (one
+Certbot per host). Each has its own state under
+`<state_dir>/instances/<name>`: Nginx and subdomain locks, job runs, the
+pending reload flag and the listener owner. The registry lock and a
+Certbot lock stay host-wide, so instances never issue the same
+certificate twice.
+
+Commands that change Nginx target the instances given with `--instance`
+(repeatable; `all` for every instance), or all of them by default. Each
+targeted instance runs the command in its own thread, and the exit code is
+the worst of them.
+"""
+
+import os
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
+from colorama import Fore
+
+from domain_manager.utils.locks import DEFAULT_STATE_DIR
+
+DEFAULT_NGINX_CONF_DIR = '/etc/nginx'
+ALL = 'all'
+
+
+def instance_names(config):
+    return list((config or {}).get('instances') or {})
+
+
+def resolve_instances(config, requested=None):
+    """
+    Return the instances a command should run on.
+
+    Args:
+        config (dict): Configuration dictionary.
+        requested (list, optional): Names from --instance; 'all' or nothing
+            means every instance.
+
+    Returns:
+        list: Instance names; empty when no instances are configured.
+
+    Raises:
+        ValueError: If an unknown instance is requested.
+    """
+    names = instance_names(config)
+    if not names:
+        if requested:
+            raise ValueError("No instances are configured; remove --instance or add an `instances` section")
+        return []
+    if not requested or ALL in requested:
+        return names
+    unknown = [name for name in requested if name not in names]
+    if unknown:
+        raise ValueError(f"Unknown instance: {', '.join(unknown)} (configured: {', '.join(names)})")
+    return list(dict.fromkeys(requested))
+
+
+def shared_state_dir(config):
+    """Return the host-wide state directory, also when given an instance's configuration."""
+    config = config or {}
+    return config.get('shared_state_dir') or config.get('state_dir', DEFAULT_STATE_DIR)
+
+
+def instance_config(config, name):
+    """
+    Return the configuration as seen by one instance.
+
+    The instance gets its own copy of the registry dict, so instances can
+    run side by side in one process.
+    """
+    settings = (config.get('instances') or {})[name] or {}
+    root = settings.get('root') or os.sep
+    conf_dir = settings.get('nginx_conf_dir') or os.path.join(root, DEFAULT_NGINX_CONF_DIR.lstrip(os.sep))
+    state_dir = shared_state_dir(config)
+    derived = {
+        **config,
+        'subdomains': dict(config.get('subdomains') or {}),
+        'instance': name,
+        'nginx_conf_dir': conf_dir,
+        'sites_available': settings.get('sites_available') or os.path.join(conf_dir, 'sites-available'),
+        'sites_enabled': settings.get('sites_enabled') or os.path.join(conf_dir, 'sites-enabled'),
+        'backup_dir': settings.get('backup_dir') or os.path.join(conf_dir, 'backups'),
+        'state_dir': os.path.join(state_dir, 'instances', name),
+        'shared_state_dir': state_dir,
+    }
+    for key, setting in (('nginx_binary', 'nginx'), ('nginx_conf', 'conf'), ('reload_command', 'reload_command')):
+        derived.pop(key, None)
+        if settings.get(setting):
+            derived[key] = settings[setting]
+    if 'nginx_conf' not in derived and (settings.get('root') or settings.get('nginx_conf_dir')):
+        derived['nginx_conf'] = os.path.join(conf_dir, 'nginx.conf')
+    return derived
+
+
+def sibling_configs(config):
+    """Return the configurations of the other instances, given one instance's configuration."""
+    if not config.get('instance'):
+        return []
+    return [instance_config(config, name) for name in instance_names(config) if name != config['instance']]
+
+
+def instance_state_dirs(config):
+    """Return the state directory of every instance (the host-wide one without instances)."""
+    state_dir = shared_state_dir(config)
+    names = instance_names(config)
+    return [os.path.join(state_dir, 'instances', name) for name in names] if names else [state_dir]
+
+
+def nginx_conf_dir(config):
+    return (config or {}).get('nginx_conf_dir', DEFAULT_NGINX_CONF_DIR)
+
+
+def sites_available_dir(config):
+    return (config or {}).get('sites_available') or os.path.join(nginx_conf_dir(config), 'sites-available')
+
+
+def sites_enabled_dir(config):
+    return (config or {}).get('sites_enabled') or os.path.join(nginx_conf_dir(config), 'sites-enabled')
+
+
+def nginx_test_command(config):
+    """Return the command that tests an instance's configuration."""
+    config = config or {}
+    command = [config.get('nginx_binary') or 'nginx', '-t']
+    if config.get('nginx_conf'):
+        command += ['-c', config['nginx_conf']]
+    return command
+
+
+def nginx_reload_command(config):
+    """Return the command that reloads an instance."""
+    config = config or {}
+    if config.get('reload_command'):
+        return shlex.split(config['reload_command'])
+    if config.get('nginx_binary') or config.get('nginx_conf'):
+        command = [config.get('nginx_binary') or 'nginx']
+        if config.get('nginx_conf'):
+            command += ['-c', config['nginx_conf']]
+        return command + ['-s', 'reload']
+    return ['systemctl', 'reload', 'nginx']
+
+
+def run_on_instances(config, names, func):
+    """
+    Run func(instance_config) for several instances at once.
+
+    Args:
+        config (dict): Configuration dictionary.
+        names (list): Instance names.
+        func (callable): Receives an instance's configuration and returns an exit code.
+
+    Returns:
+        int: The highest exit code.
+    """
+    def run(name):
+        try:
+            return func(instance_config(config, name))
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            print(Fore.RED + f"[{name}] {e}")
+            return 1
+
+    with ThreadPoolExecutor(max_workers=max(1, len(names))) as pool:
+        codes = dict(zip(names, pool.map(run, names)))
+    for name, code in codes.items():
+        print((Fore.GREEN if not code else Fore.RED) + f"[{name}] exit code {code}")
+    return max(codes.values(), default=0)
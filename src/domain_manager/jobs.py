@@ -0,0 +1,423 @@
+# domain_manager/jobs.py
+
+"""
+Durable queue for certificate and provisioning jobs.
+
+Long runs (renewing every certificate, resetting every vhost, fixing
+missing certificates) are recorded as a run with one job per subdomain
+and step, in `<state_dir>/jobs.sqlite3`. A job's state is committed as
+soon as it changes. A run that dies halfway (a crash, Ctrl-C, a failed
+reload) therefore leaves an exact record of what is done, and `resume`
+continues it. Finished jobs are never run again, so no certificate is
+requested twice and ACME rate limits are not spent again. Starting the
+same kind of run while an earlier one is unfinished continues the
+earlier one as well.
+
+A failed job is retried with exponential backoff and jitter, up to
+`max_attempts` times. If more than `failure_budget` attempts fail in one
+invocation, the run is paused: that many failures point at something
+beyond a single domain (DNS, the ACME server, rate limiting). When every
+remaining job is backing off, the run is paused as well rather than
+waiting, and `resume` (for example from a timer) continues it later; what
+is already done is reloaded first. A vhost is written without SSL until
+its certificate exists, and vhosts written by earlier jobs are loaded
+before a certificate is requested. Once every job has finished, Nginx is
+tested and reloaded once. The run only counts as complete after that
+reload.
+
+Only the queue lock is held for the whole run. The Nginx lock is taken
+around each vhost write and around the final test and reload, so other
+commands are not blocked while Certbot runs.
+
+Jobs of one subdomain run in the order they were queued. If a step fails
+for good or is skipped, the subdomain's later steps are skipped too.
+"""
+
+import contextlib
+import logging
+import os
+import random
+import sqlite3
+import time
+
+from colorama import Fore
+
+from domain_manager.utils.locks import DEFAULT_STATE_DIR, file_lock, lock_dir, nginx_lock
+
+logger = logging.getLogger('NGINXDomainManager')
+
+QUEUE_FILE = 'jobs.sqlite3'
+QUEUE_LOCK = 'jobs.lock'
+
+DEFAULT_JOBS = {
+    'max_attempts': 4,
+    'backoff_base': 30,
+    'backoff_max': 900,
+    'jitter': 0.5,
+    'failure_budget': 10,
+}
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+# Run states; 'active' and 'paused' runs are unfinished
+ACTIVE = 'active'
+PAUSED = 'paused'
+COMPLETE = 'complete'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    note TEXT NOT NULL DEFAULT '',
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    action TEXT NOT NULL,
+    subdomain TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT NOT NULL DEFAULT '',
+    updated REAL NOT NULL DEFAULT 0,
+    UNIQUE (run_id, action, subdomain)
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (run_id, state, next_attempt);
+"""
+
+
+def job_settings(config):
+    """Return job queue settings from config.yaml merged over the defaults."""
+    settings = dict(DEFAULT_JOBS)
+    settings.update(config.get('jobs') or {})
+    return settings
+
+
+def queue_lock(config):
+    """
+    Exclusive lock on the job queue, held while a run is created or processed.
+
+    It is taken before the Nginx lock, never while holding it.
+    """
+    return file_lock(os.path.join(lock_dir(config), QUEUE_LOCK), description='job queue')
+
+
+def open_queue(config):
+    """Open (and create, if needed) the queue database; every statement commits immediately."""
+    state_dir = config.get('state_dir', DEFAULT_STATE_DIR)
+    os.makedirs(state_dir, exist_ok=True)
+    db = sqlite3.connect(os.path.join(state_dir, QUEUE_FILE), timeout=30, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA journal_mode=WAL')
+    db.executescript(SCHEMA)
+    return db
+
+
+def backoff_delay(attempts, settings, rng=random):
+    """
+    Seconds to wait before the next attempt of a job that failed `attempts` times.
+
+    The delay doubles with every failure, up to `backoff_max`, and a random
+    fraction (up to `jitter`) is taken off so that retries spread out.
+    """
+    delay = min(settings['backoff_max'], settings['backoff_base'] * 2 ** max(0, attempts - 1))
+    return delay * (1 - rng.uniform(0, settings['jitter']))
+
+
+class _Nginx:
+    """
+    Nginx as seen by a run's jobs: the lock, and vhosts written but not yet loaded.
+
+    A vhost is only rendered with SSL once its certificate exists, so the
+    HTTP variant (which answers the ACME challenge) is loaded before any
+    certificate is requested.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.unloaded = False
+
+    def lock(self, shared=False):
+        return nginx_lock(self.config, shared=shared, quiet=True)
+
+    def load(self):
+        """Test and reload Nginx if a job wrote an HTTP vhost since the last reload."""
+        from domain_manager.utils.domain import reload_nginx_service, test_nginx_config
+
+        if not self.unloaded:
+            return True, ''
+        with self.lock():
+            ok, detail = test_nginx_config(quiet=True, config=self.config)
+            if ok:
+                ok, detail = reload_nginx_service(quiet=True, config=self.config)
+        if ok:
+            self.unloaded = False
+        return ok, detail
+
+
+# Actions. A handler receives (config, subdomain, nginx), nginx being the
+# run's _Nginx, and returns (ok, detail); detail says why the job was
+# skipped or failed.
+
+def _certificate(config, subdomain, nginx):
+    from domain_manager.utils.domain import certificate_exists, obtain_certificate, write_vhost
+
+    ok, detail = nginx.load()
+    if not ok:
+        return False, f"Nginx reload failed: {detail}"
+    print(f"Updating SSL certificate for {subdomain}...")
+    details = config.get('subdomains', {}).get(subdomain)
+    issued = certificate_exists(subdomain)
+    # The tool renders the SSL vhost of registered subdomains itself
+    if not obtain_certificate(subdomain, install=details is None, config=config):
+        print(Fore.RED + f"Failed to update SSL certificate for {subdomain}.")
+        return False, "Certbot failed; see the log for details"
+    logger.info(f"SSL certificate updated for {subdomain}.")
+    print(Fore.GREEN + f"SSL certificate updated for {subdomain}.")
+    if details is not None and not issued:
+        try:
+            with nginx.lock(shared=True):
+                # Loaded by the run's final reload; the next certificate does not need it
+                write_vhost(config, subdomain, details, ssl=True)
+        except OSError as e:
+            print(Fore.RED + f"Failed to switch {subdomain} to SSL: {e}")
+            return False, str(e)
+    return True, ''
+
+
+def _provision(config, subdomain, nginx):
+    from domain_manager.utils.domain import write_vhost
+
+    details = config.get('subdomains', {}).get(subdomain)
+    if details is None:
+        return None, "No longer in the registry"
+    try:
+        with nginx.lock(shared=True):
+            nginx.unloaded |= write_vhost(config, subdomain, details)
+    except OSError as e:
+        print(Fore.RED + f"Failed to create Nginx configuration for {subdomain}: {e}")
+        return False, str(e)
+    logger.info(f"Created Nginx configuration for {subdomain}.")
+    print(Fore.GREEN + f"Created Nginx configuration for {subdomain}.")
+    return True, ''
+
+
+ACTIONS = {
+    'certificate': _certificate,
+    'provision': _provision,
+}
+
+
+def _set_run(db, run_id, status, note=''):
+    db.execute('UPDATE runs SET status = ?, note = ?, updated = ? WHERE id = ?', (status, note, time.time(), run_id))
+
+
+def _finish_job(db, job, state, error='', next_attempt=0):
+    db.execute('UPDATE jobs SET state = ?, last_error = ?, next_attempt = ?, updated = ? WHERE id = ?',
+               (state, error, next_attempt, time.time(), job['id']))
+
+
+def unfinished_runs(config, kind=None):
+    """Return the runs that have not completed (oldest first), with job counts per state."""
+    db = open_queue(config)
+    try:
+        query = 'SELECT * FROM runs WHERE status != ?'
+        params = [COMPLETE]
+        if kind:
+            query += ' AND kind = ?'
+            params.append(kind)
+        runs = [dict(row) for row in db.execute(query + ' ORDER BY id', params)]
+        for run in runs:
+            run['jobs'] = dict(db.execute('SELECT state, COUNT(*) FROM jobs WHERE run_id = ? GROUP BY state',
+                                          (run['id'],)).fetchall())
+        return runs
+    finally:
+        db.close()
+
+
+def run_jobs(config, run_id, locked=False):
+    """
+    Process a run's jobs until they have all finished or the run is paused.
+
+    Jobs left 'running' by a process that died are retried. Each attempt
+    is committed before the job runs, so a job that crashes the process
+    counts as a failed attempt.
+
+    Args:
+        config (dict): Configuration dictionary.
+        run_id (int): The run.
+        locked (bool): The caller holds the queue lock; otherwise it is
+            taken here. The Nginx lock is always taken here, only while
+            writing vhosts and reloading.
+
+    Returns:
+        dict: 'run', 'kind', 'status' (complete or paused), 'note', and
+        'jobs': (action, subdomain) -> (state, last error).
+    """
+    with contextlib.ExitStack() as stack:
+        if not locked:
+            stack.enter_context(queue_lock(config))
+        return _run_jobs(config, run_id)
+
+
+def _run_jobs(config, run_id):
+    from domain_manager.utils.acme import clear_reload_pending
+    from domain_manager.utils.domain import reload_nginx_service, test_nginx_config
+    from domain_manager.utils.listeners import reassign_listener_owner
+
+    nginx = _Nginx(config)
+    settings = job_settings(config)
+    db = open_queue(config)
+    try:
+        run = db.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+        if run is None:
+            raise ValueError(f"No job run {run_id}")
+        _set_run(db, run_id, ACTIVE)
+        db.execute('UPDATE jobs SET state = ? WHERE run_id = ? AND state = ?', (PENDING, run_id, RUNNING))
+
+        failures = 0
+        note = ''
+        backing_off = False
+        while True:
+            # The next job whose backoff has expired and whose earlier steps are done
+            job = db.execute(
+                'SELECT * FROM jobs j WHERE run_id = ? AND state = ? AND next_attempt <= ? '
+                'AND NOT EXISTS (SELECT 1 FROM jobs e WHERE e.run_id = j.run_id AND e.subdomain = j.subdomain '
+                'AND e.id < j.id AND e.state != ?) ORDER BY next_attempt, id LIMIT 1',
+                (run_id, PENDING, time.time(), DONE)).fetchone()
+            if job is None:
+                waiting = db.execute('SELECT MIN(next_attempt) FROM jobs WHERE run_id = ? AND state = ?',
+                                     (run_id, PENDING)).fetchone()[0]
+                if waiting is None:
+                    break
+                # Waiting here would keep the queue locked; pause and let `resume` continue later
+                note = f"Every remaining job is backing off until {time.strftime('%H:%M:%S', time.localtime(waiting))}"
+                backing_off = True
+                break
+
+            attempt = job['attempts'] + 1
+            db.execute('UPDATE jobs SET state = ?, attempts = ?, updated = ? WHERE id = ?',
+                       (RUNNING, attempt, time.time(), job['id']))
+            try:
+                ok, detail = ACTIONS[job['action']](config, job['subdomain'], nginx)
+            except KeyboardInterrupt:
+                db.execute('UPDATE jobs SET state = ?, attempts = ? WHERE id = ?', (PENDING, job['attempts'], job['id']))
+                note = "Interrupted"
+                break
+
+            if ok:
+                _finish_job(db, job, DONE)
+            elif ok is None or attempt >= settings['max_attempts']:
+                state = SKIPPED if ok is None else FAILED
+                _finish_job(db, job, state, detail)
+                if state == FAILED:
+                    logger.error(f"Giving up on {job['action']} for {job['subdomain']} after {attempt} attempts: "
+                                 f"{detail}")
+                # Later steps of the subdomain cannot run without this one
+                db.execute('UPDATE jobs SET state = ?, last_error = ?, updated = ? '
+                           'WHERE run_id = ? AND subdomain = ? AND id > ? AND state = ?',
+                           (SKIPPED, f"{job['action']} {state}", time.time(), run_id, job['subdomain'], job['id'],
+                            PENDING))
+            else:
+                _finish_job(db, job, PENDING, detail, time.time() + backoff_delay(attempt, settings))
+            if not ok and ok is not None:
+                failures += 1
+                if failures > settings['failure_budget']:
+                    note = f"Failure budget exhausted ({failures} failed attempts)"
+                    logger.error(f"Job run {run_id}: {note.lower()}; pausing.")
+                    break
+
+        if (not note or backing_off) and db.execute('SELECT 1 FROM jobs WHERE run_id = ? AND state = ? LIMIT 1',
+                                   (run_id, DONE)).fetchone():
+            with nginx.lock():
+                reassign_listener_owner(config, logger)
+                ok, detail = test_nginx_config(quiet=True, config=config)
+                if ok:
+                    ok, detail = reload_nginx_service(quiet=True, config=config)
+            if ok:
+                clear_reload_pending(config)
+            else:
+                note = f"Nginx reload failed: {detail}"
+        _set_run(db, run_id, PAUSED if note else COMPLETE, note)
+        if note:
+            print(Fore.YELLOW + f"Job run {run_id} paused: {note}. Continue it with 'NGINXDomainManager resume'.")
+
+        jobs = {(row['action'], row['subdomain']): (row['state'], row['last_error'])
+                for row in db.execute('SELECT * FROM jobs WHERE run_id = ? ORDER BY id', (run_id,))}
+        return {'run': run_id, 'kind': run['kind'], 'status': PAUSED if note else COMPLETE, 'note': note,
+                'jobs': jobs}
+    finally:
+        db.close()
+
+
+def start_run(config, kind, jobs, locked=False):
+    """
+    Queue jobs as a run of `kind` and process them.
+
+    If a run of the same kind is unfinished, the jobs are added to it
+    instead (jobs it already has keep their state), so whatever it already
+    did is not done again.
+
+    Args:
+        config (dict): Configuration dictionary.
+        kind (str): What the run does, e.g. 'renew'.
+        jobs (list): (action, subdomain) pairs, in the order they should run.
+        locked (bool): See run_jobs.
+
+    Returns:
+        dict: See run_jobs.
+    """
+    with contextlib.ExitStack() as stack:
+        if not locked:
+            stack.enter_context(queue_lock(config))
+        db = open_queue(config)
+        try:
+            row = db.execute('SELECT id FROM runs WHERE kind = ? AND status != ? ORDER BY id DESC LIMIT 1',
+                             (kind, COMPLETE)).fetchone()
+            if row:
+                run_id = row['id']
+                logger.info(f"Continuing unfinished {kind} run {run_id}.")
+                print(Fore.YELLOW + f"Continuing unfinished {kind} run {run_id}; finished jobs are skipped.")
+            else:
+                now = time.time()
+                run_id = db.execute('INSERT INTO runs (kind, status, created, updated) VALUES (?, ?, ?, ?)',
+                                    (kind, ACTIVE, now, now)).lastrowid
+            db.execute('BEGIN')
+            db.executemany('INSERT OR IGNORE INTO jobs (run_id, action, subdomain) VALUES (?, ?, ?)',
+                           [(run_id, action, subdomain) for action, subdomain in jobs])
+            db.execute('COMMIT')
+        finally:
+            db.close()
+        return _run_jobs(config, run_id)
+
+
+def resume_runs(config, run_id=None):
+    """
+    Continue every unfinished run (or just `run_id`), oldest first.
+
+    Returns:
+        list: One summary per run; see run_jobs.
+    """
+    run_ids = [run['id'] for run in unfinished_runs(config) if run_id is None or run['id'] == run_id]
+    return [run_jobs(config, run) for run in run_ids]
+
+
+def print_run_summary(summary):
+    """Print how a run's jobs ended."""
+    counts = {}
+    for state, _ in summary['jobs'].values():
+        counts[state] = counts.get(state, 0) + 1
+    color = Fore.GREEN if summary['status'] == COMPLETE and not counts.get(FAILED) else Fore.YELLOW
+    print(color + f"{summary['kind'].capitalize()} run {summary['run']}: {summary['status']} ("
+          + ', '.join(f"{counts[state]} {state}" for state in sorted(counts)) + ")")
+    for (action, subdomain), (state, error) in summary['jobs'].items():
+        if state in (FAILED, SKIPPED) or (state == PENDING and error):
+            print(f"  {subdomain}: {action} {state}: {error}")
@@ -0,0 +1,275 @@
+# domain_manager/log_index.py
+
+import hashlib
+import json
+import os
+import re
+import time
+
+from domain_manager.log_viewer import (
+    DEFAULT_BACKUP_COUNT, parse_log_line, rotated_log_files, subdomain_pattern
+)
+
+INDEX_VERSION = 2
+SIGNATURE_BYTES = 256
+BUCKET_FORMAT = '%Y%m%d%H'
+
+# Domain-like tokens inside free-text messages. Tokens that are really file
+# names (app.example.com.conf, fullchain.pem, ...) are dropped afterwards.
+DOMAIN_TOKEN_PATTERN = re.compile(r'(?<![\w.-])((?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63})(?![\w-])',
+                                  re.IGNORECASE)
+# Subdomain names usable as index file names as they are
+SAFE_NAME_PATTERN = re.compile(r'[a-z0-9][a-z0-9.-]{0,250}')
+FILE_SUFFIXES = ('.conf', '.log', '.pem', '.bak', '.backup', '.yaml', '.yml', '.py', '.json', '.idx', '.gz')
+
+
+def index_path(log_file):
+    """
+    Return the directory of the sidecar index for a log file.
+
+    It holds `files.json`, which records how far each log file has been
+    indexed, and one small file per subdomain under `subdomains/`, so a
+    lookup reads only the entries of the subdomain it asks for.
+    """
+    return f"{log_file}.idx.d"
+
+
+def _subdomain_path(log_file, name):
+    """Return the index file of one subdomain; names that are not plain host names are hashed."""
+    if not SAFE_NAME_PATTERN.fullmatch(name):
+        name = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return os.path.join(index_path(log_file), 'subdomains', f"{name}.json")
+
+
+def extract_subdomains(record):
+    """
+    Find the subdomains a log record refers to.
+
+    JSON-lines records carry an explicit 'subdomain' field; text records are
+    scanned for domain-like tokens.
+
+    Args:
+        record (dict): Record returned by parse_log_line.
+
+    Returns:
+        set: Lower-cased subdomain names.
+    """
+    names = set()
+    fields = record.get('fields') or {}
+    if fields.get('subdomain'):
+        names.add(str(fields['subdomain']).lower())
+    for token in DOMAIN_TOKEN_PATTERN.findall(record['message'].split('\n', 1)[0]):
+        token = token.lower()
+        if not token.endswith(FILE_SUFFIXES):
+            names.add(token)
+    return names
+
+
+def _file_signature(path):
+    """Hash the first bytes of a file so a reused inode is not mistaken for an indexed file."""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(SIGNATURE_BYTES)).hexdigest()
+
+
+def _load_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _save_json(path, data):
+    """Write an index file atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def load_index(log_file):
+    """Load the index manifest, returning an empty one if it is missing or unreadable."""
+    index = _load_json(os.path.join(index_path(log_file), 'files.json'), {})
+    if index.get('version') == INDEX_VERSION:
+        return index
+    return {'version': INDEX_VERSION, 'files': {}}
+
+
+def save_index(log_file, index):
+    """Write the index manifest atomically."""
+    _save_json(os.path.join(index_path(log_file), 'files.json'), index)
+
+
+def load_subdomain_index(log_file, name, files):
+    """
+    Load one subdomain's index, keeping only spans of the log files in the manifest.
+
+    Returns:
+        dict: inode -> {'generation': ..., 'hours': {hour: [start, end]}}.
+    """
+    entries = _load_json(_subdomain_path(log_file, name), {})
+    return {key: entry for key, entry in entries.items()
+            if key in files and isinstance(entry, dict) and entry.get('generation') == files[key]['generation']}
+
+
+def _index_file(path, entry, buckets):
+    """
+    Index a log file forward from entry['indexed_to'].
+
+    New spans are collected in `buckets`, subdomain -> hour ->
+    [first_offset, end_offset], the byte range covering every record for
+    that subdomain in that hour. Only complete lines are indexed, so a
+    record being written is picked up next time.
+    """
+    with open(path, 'rb') as f:
+        f.seek(entry['indexed_to'])
+        offset = entry['indexed_to']
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break
+            line_start = offset
+            offset += len(raw)
+            record = parse_log_line(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+            if record is None:
+                continue
+            hour = record['timestamp'].strftime(BUCKET_FORMAT)
+            for name in extract_subdomains(record):
+                span = buckets.setdefault(name, {}).setdefault(hour, [line_start, offset])
+                span[1] = offset
+        entry['indexed_to'] = offset
+
+
+def update_index(log_file, backup_count=DEFAULT_BACKUP_COUNT):
+    """
+    Bring the sidecar index up to date with the log file and its rotations.
+
+    Files are tracked by inode, so a rotation (log -> log.1) keeps its
+    existing entries; only bytes appended since the last update are read,
+    and only the files of subdomains that appear in them are rewritten. A
+    file that shrank or whose first bytes changed is re-indexed from the
+    start under a new generation, which retires its old spans in every
+    subdomain file; entries for rotated-away files are ignored the same way.
+
+    Args:
+        log_file (str): Path to the active log file.
+        backup_count (int): Number of rotations to index.
+
+    Returns:
+        dict: The manifest, with a 'paths' map of inode -> current path
+        ordered from the newest file to the oldest rotation.
+    """
+    index = load_index(log_file)
+    if not index['files'] and os.path.isfile(f"{log_file}.idx"):
+        # Single-file index of earlier versions, superseded by the directory
+        os.remove(f"{log_file}.idx")
+    files = {}
+    paths = {}
+    new_spans = {}
+    changed = False
+    for path in rotated_log_files(log_file, backup_count):
+        try:
+            stat = os.stat(path)
+            signature = _file_signature(path)
+        except OSError:
+            continue
+        key = str(stat.st_ino)
+        entry = index['files'].get(key)
+        if entry is None or entry.get('signature') != signature or stat.st_size < entry['indexed_to']:
+            entry = {'signature': signature, 'generation': f"{signature[:12]}-{time.time_ns()}", 'indexed_to': 0}
+            changed = True
+        if stat.st_size > entry['indexed_to']:
+            buckets = {}
+            _index_file(path, entry, buckets)
+            for name, hours in buckets.items():
+                new_spans.setdefault(name, {})[key] = hours
+            changed = True
+        files[key] = entry
+        paths[key] = path
+
+    for name, by_file in new_spans.items():
+        entries = load_subdomain_index(log_file, name, files)
+        for key, hours in by_file.items():
+            stored = entries.setdefault(key, {'generation': files[key]['generation'], 'hours': {}})['hours']
+            for hour, (start, end) in hours.items():
+                span = stored.get(hour)
+                stored[hour] = [min(span[0], start), max(span[1], end)] if span else [start, end]
+        _save_json(_subdomain_path(log_file, name), entries)
+    if changed or set(files) != set(index['files']):
+        index['files'] = files
+        save_index(log_file, index)
+    index['files'] = files
+    index['paths'] = paths
+    return index
+
+
+def _read_span(path, start, end, subdomain_re):
+    """Yield matching records from a byte range, including trailing continuation lines."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        offset = start
+        record = None
+        for raw in f:
+            line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+            parsed = parse_log_line(line)
+            if parsed is None:
+                if record is not None:
+                    record['lines'].append(line)
+                    record['message'] += '\n' + line
+                offset += len(raw)
+                continue
+            if record is not None and subdomain_re.search(record['message']):
+                yield record
+            record = None
+            if offset >= end:
+                break
+            record = parsed
+            offset += len(raw)
+        if record is not None and subdomain_re.search(record['message']):
+            yield record
+
+
+def subdomain_history(log_file, subdomain, since=None, until=None, backup_count=DEFAULT_BACKUP_COUNT):
+    """
+    Yield log records mentioning a subdomain, oldest first, using the index.
+
+    Only the byte ranges recorded for the subdomain's hour buckets are read,
+    so the cost depends on how much history the subdomain has rather than on
+    the total log volume.
+
+    Args:
+        log_file (str): Path to the active log file.
+        subdomain (str): Subdomain to look up.
+        since (datetime, optional): Oldest timestamp to include.
+        until (datetime, optional): Newest timestamp to include.
+        backup_count (int): Number of rotations to consider.
+
+    Yields:
+        dict: Parsed records.
+    """
+    index = update_index(log_file, backup_count)
+    name = subdomain.lower()
+    subdomain_re = subdomain_pattern(name)
+    since_bucket = since.strftime(BUCKET_FORMAT) if since else None
+    until_bucket = until.strftime(BUCKET_FORMAT) if until else None
+
+    entries = load_subdomain_index(log_file, name, index['files'])
+
+    # Oldest rotation first so output is chronological.
+    for key in reversed(list(index['paths'])):
+        buckets = entries.get(key, {}).get('hours')
+        if not buckets:
+            continue
+        for hour in sorted(buckets):
+            if since_bucket and hour < since_bucket:
+                continue
+            if until_bucket and hour > until_bucket:
+                continue
+            start, end = buckets[hour]
+            for record in _read_span(index['paths'][key], start, end, subdomain_re):
+                if since and record['timestamp'] < since:
+                    continue
+                if until and record['timestamp'] > until:
+                    continue
+                yield record
+
@@ -0,0 +1,316 @@
+# domain_manager/log_viewer.py
+
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+# Matches the text file formatter used by setup_logging:
+# '%(asctime)s - %(levelname)s - %(message)s'
+LOG_LINE_PATTERN = re.compile(
+    r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d{3} - ([A-Z]+) - (.*)$'
+)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+RELATIVE_TIME_PATTERN = re.compile(r'^(\d+)\s*([smhdw])$')
+RELATIVE_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+DEFAULT_BACKUP_COUNT = 5
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def rotated_log_files(log_file, backup_count=DEFAULT_BACKUP_COUNT):
+    """
+    List the active log file and its rotations, newest first.
+
+    Args:
+        log_file (str): Path to the active log file.
+        backup_count (int): Number of RotatingFileHandler backups to consider.
+
+    Returns:
+        list: Existing paths ordered from newest (log_file) to oldest (log_file.N).
+    """
+    candidates = [log_file] + [f"{log_file}.{i}" for i in range(1, backup_count + 1)]
+    return [path for path in candidates if os.path.isfile(path)]
+
+
+def read_lines_reversed(path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield the lines of a file from last to first without loading it into memory.
+
+    Args:
+        path (str): File to read.
+        chunk_size (int): Number of bytes read per seek.
+
+    Yields:
+        str: Decoded lines without their trailing newline.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b''
+        while position > 0:
+            read_size = min(chunk_size, position)
+            position -= read_size
+            f.seek(position)
+            block = f.read(read_size) + remainder
+            lines = block.split(b'\n')
+            # The first piece may be a partial line; keep it for the next block.
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line.decode('utf-8', errors='replace').rstrip('\r')
+        if remainder:
+            yield remainder.decode('utf-8', errors='replace').rstrip('\r')
+
+
+def parse_log_line(line):
+    """
+    Parse a log record header line, in either text or JSON-lines format.
+
+    Args:
+        line (str): A single line from the log file.
+
+    Returns:
+        dict or None: Record with 'timestamp', 'level' and 'message', or None
+        if the line is a continuation (e.g. a traceback line).
+    """
+    if line.startswith('{'):
+        return parse_json_line(line)
+    match = LOG_LINE_PATTERN.match(line)
+    if not match:
+        return None
+    try:
+        timestamp = datetime.strptime(match.group(1), TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+    return {
+        'timestamp': timestamp,
+        'level': match.group(2),
+        'message': match.group(3),
+        'lines': [line],
+    }
+
+
+def parse_json_line(line):
+    """Parse a line written by the JSON-lines formatter, or return None."""
+    try:
+        entry = json.loads(line)
+        timestamp = datetime.strptime(entry['time'].split(',')[0], TIMESTAMP_FORMAT)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+    message = entry.get('message', '')
+    if entry.get('exc_info'):
+        message = f"{message}\n{entry['exc_info']}"
+    return {
+        'timestamp': timestamp,
+        'level': entry.get('level', 'INFO'),
+        'message': message,
+        'lines': [line],
+        'fields': entry,
+    }
+
+
+def iter_records_reversed(log_file, backup_count=DEFAULT_BACKUP_COUNT):
+    """
+    Yield log records newest first across the active log and its rotations.
+
+    Continuation lines (tracebacks, multi-line messages) are attached to the
+    record that precedes them in the file.
+
+    Args:
+        log_file (str): Path to the active log file.
+        backup_count (int): Number of rotations to include.
+
+    Yields:
+        dict: Parsed records, see parse_log_line.
+    """
+    for path in rotated_log_files(log_file, backup_count):
+        continuation = []
+        for line in read_lines_reversed(path):
+            record = parse_log_line(line)
+            if record is None:
+                continuation.append(line)
+                continue
+            if continuation:
+                record['lines'].extend(reversed(continuation))
+                record['message'] = '\n'.join([record['message']] + list(reversed(continuation)))
+                continuation = []
+            yield record
+
+
+def parse_level(level):
+    """Convert a level name such as 'warning' into its numeric value, or None."""
+    if not level:
+        return None
+    value = logging.getLevelName(level.strip().upper())
+    return value if isinstance(value, int) else None
+
+
+def parse_time_bound(value, now=None):
+    """
+    Parse a user supplied time bound.
+
+    Accepts absolute timestamps ('2024-10-01', '2024-10-01 13:45',
+    '2024-10-01 13:45:10') and relative ones ('30m', '2h', '7d', '1w')
+    measured back from now.
+
+    Args:
+        value (str): Time bound entered by the user.
+        now (datetime, optional): Reference time for relative bounds.
+
+    Returns:
+        datetime or None: Parsed time, or None if the value is empty.
+
+    Raises:
+        ValueError: If the value cannot be parsed.
+    """
+    if not value or not value.strip():
+        return None
+    value = value.strip()
+    relative = RELATIVE_TIME_PATTERN.match(value)
+    if relative:
+        amount, unit = relative.groups()
+        return (now or datetime.now()) - timedelta(**{RELATIVE_UNITS[unit]: int(amount)})
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised time: {value}")
+
+
+def subdomain_pattern(subdomain):
+    """Compile a pattern matching a subdomain as a whole name inside a message."""
+    return re.compile(r'(?<![\w.-])' + re.escape(subdomain) + r'(?![\w-]|\.\w)', re.IGNORECASE)
+
+
+def record_matches(record, min_level=None, subdomain_re=None, since=None, until=None):
+    """
+    Check whether a record passes the given filters.
+
+    Args:
+        record (dict): Parsed record.
+        min_level (int, optional): Minimum numeric log level.
+        subdomain_re (re.Pattern, optional): Pattern from subdomain_pattern.
+        since (datetime, optional): Oldest timestamp to keep.
+        until (datetime, optional): Newest timestamp to keep.
+
+    Returns:
+        bool: True if the record matches all filters.
+    """
+    if min_level is not None and (parse_level(record['level']) or 0) < min_level:
+        return False
+    if since is not None and record['timestamp'] < since:
+        return False
+    if until is not None and record['timestamp'] > until:
+        return False
+    if subdomain_re is not None and not subdomain_re.search(record['message']):
+        return False
+    return True
+
+
+def iter_filtered_records(log_file, level=None, subdomain=None, since=None, until=None,
+                          backup_count=DEFAULT_BACKUP_COUNT):
+    """
+    Yield matching records newest first.
+
+    Reading stops as soon as a record older than `since` is reached, so a
+    narrow time window never touches older rotations.
+
+    Args:
+        log_file (str): Path to the active log file.
+        level (str, optional): Minimum level name (e.g. 'WARNING').
+        subdomain (str, optional): Only keep records mentioning this subdomain.
+        since (datetime, optional): Oldest timestamp to keep.
+        until (datetime, optional): Newest timestamp to keep.
+        backup_count (int): Number of rotations to include.
+
+    Yields:
+        dict: Matching records.
+    """
+    min_level = parse_level(level)
+    subdomain_re = subdomain_pattern(subdomain) if subdomain else None
+    for record in iter_records_reversed(log_file, backup_count):
+        if since is not None and record['timestamp'] < since:
+            break
+        if record_matches(record, min_level, subdomain_re, None, until):
+            yield record
+
+
+def follow_log(log_file, level=None, subdomain=None, poll_interval=1.0, stop=None):
+    """
+    Yield new records appended to the log file, like `tail -f`.
+
+    Rotation is detected by an inode change or the file shrinking, in which
+    case reading restarts at the beginning of the new file.
+
+    Args:
+        log_file (str): Path to the active log file.
+        level (str, optional): Minimum level name.
+        subdomain (str, optional): Only keep records mentioning this subdomain.
+        poll_interval (float): Seconds to sleep when no new data is available.
+        stop (callable, optional): Returns True to end following.
+
+    Yields:
+        dict: Matching records as they are written.
+    """
+    min_level = parse_level(level)
+    subdomain_re = subdomain_pattern(subdomain) if subdomain else None
+
+    f = None
+    inode = None
+    pending = None
+    try:
+        while not (stop and stop()):
+            if f is None:
+                try:
+                    f = open(log_file, 'r', errors='replace')
+                except FileNotFoundError:
+                    time.sleep(poll_interval)
+                    continue
+                inode = os.fstat(f.fileno()).st_ino
+                if pending is None:
+                    # First open: start at the end, like tail -f.
+                    f.seek(0, os.SEEK_END)
+                    pending = []
+
+            line = f.readline()
+            if line:
+                line = line.rstrip('\n')
+                record = parse_log_line(line)
+                if record is None:
+                    if pending:
+                        pending[-1]['lines'].append(line)
+                        pending[-1]['message'] += '\n' + line
+                    continue
+                for previous in pending:
+                    if record_matches(previous, min_level, subdomain_re):
+                        yield previous
+                pending = [record]
+                continue
+
+            # No new data: flush what we have, then check for rotation.
+            for previous in pending:
+                if record_matches(previous, min_level, subdomain_re):
+                    yield previous
+            pending = []
+            try:
+                stat = os.stat(log_file)
+                if stat.st_ino != inode or stat.st_size < f.tell():
+                    f.close()
+                    f = open(log_file, 'r', errors='replace')
+                    inode = os.fstat(f.fileno()).st_ino
+                    continue
+            except FileNotFoundError:
+                pass
+            time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
+
+
+def format_record(record):
+    """Return the original text of a record."""
+    return '\n'.join(record['lines'])
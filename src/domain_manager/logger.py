@@ -1,124 +1,274 @@
 # logger.py
 
+import atexit
+import json
 import logging
-import os
-from logging.handlers import RotatingFileHandler
-import requests
+import queue
+import time
+from contextlib import contextmanager
+from itertools import islice
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from colorama import Fore, Style, init
 
+from domain_manager.log_viewer import (
+    follow_log, format_record, iter_filtered_records, parse_level, parse_time_bound, rotated_log_files
+)
 
-def setup_logging(log_file):
+
+LOGGER_NAME = 'NGINXDomainManager'
+
+# Extra record attributes emitted by log_span and included in JSON output.
+SPAN_FIELDS = ('phase', 'subdomain', 'duration_ms', 'status')
+
+# Define color mapping for different log levels
+LOG_COLORS = {
+    logging.DEBUG: Fore.CYAN,
+    logging.INFO: Fore.GREEN,
+    logging.WARNING: Fore.YELLOW,
+    logging.ERROR: Fore.RED,
+    logging.CRITICAL: Fore.MAGENTA + Style.BRIGHT,
+}
+
+# Phases that wait on an external process; profiling reports them apart from Python work.
+EXTERNAL_PHASES = frozenset({'certbot', 'certbot delete', 'nginx -t', 'reload'})
+
+_listener = None
+_span_listeners = []
+
+
+class ColorFormatter(logging.Formatter):
+    def format(self, record):
+        log_color = LOG_COLORS.get(record.levelno, Fore.WHITE)
+        formatted_message = super().format(record)
+        return f"{log_color}{formatted_message}{Style.RESET_ALL}"
+
+
+def _is_not_span(record):
+    """Keep timing spans out of the console; they belong in the log file."""
+    return getattr(record, 'phase', None) is None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in SPAN_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(log_file, log_format='text'):
     """
-    Setup logging with both console and rotating file handlers.
+    Setup logging with a colored console handler and a background file writer.
+
+    File output goes through a QueueHandler so that callers never block on
+    disk I/O; a QueueListener thread drains the queue into a rotating file
+    handler. Console output stays synchronous so it interleaves correctly
+    with interactive prompts. Handlers are installed on the root logger once,
+    which also captures messages from modules that log via ``logging.info``.
 
     Args:
         log_file (str): Path to the log file.
-    
+        log_format (str): 'text' (default) or 'json' for JSON-lines file output.
+
     Returns:
         logger (logging.Logger): Configured logger instance.
     """
-    logger = logging.getLogger('NGINXDomainManager')
-    if not logger.handlers:
+    global _listener
+
+    logger = logging.getLogger(LOGGER_NAME)
+    if _listener is None:
         logger.setLevel(logging.DEBUG)
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
 
-        # Rotating File Handler
+        # Rotating File Handler, fed by the background listener
         file_handler = RotatingFileHandler(
             log_file,
             maxBytes=5 * 1024 * 1024,  # 5 MB
             backupCount=5
         )
         file_handler.setLevel(logging.INFO)
+        if log_format == 'json':
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = QueueHandler(log_queue)
+        queue_handler.setLevel(logging.INFO)
+        _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
 
         # Console Handler
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.DEBUG)
+        console_handler.setFormatter(ColorFormatter('%(levelname)s - %(message)s'))
+        console_handler.addFilter(_is_not_span)
 
-        # Define color mapping for different log levels
-        LOG_COLORS = {
-            logging.DEBUG: Fore.CYAN,
-            logging.INFO: Fore.GREEN,
-            logging.WARNING: Fore.YELLOW,
-            logging.ERROR: Fore.RED,
-            logging.CRITICAL: Fore.MAGENTA + Style.BRIGHT,
-        }
+        root.addHandler(queue_handler)
+        root.addHandler(console_handler)
 
-        class ColorFormatter(logging.Formatter):
-            def format(self, record):
-                log_color = LOG_COLORS.get(record.levelno, Fore.WHITE)
-                formatted_message = super().format(record)
-                return f"{log_color}{formatted_message}{Style.RESET_ALL}"
+    return logger
 
-        # Create formatters
-        file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        console_formatter = ColorFormatter('%(levelname)s - %(message)s')
 
-        # Add formatters to handlers
-        file_handler.setFormatter(file_formatter)
-        console_handler.setFormatter(console_formatter)
+def shutdown_logging():
+    """Flush queued records to disk and stop the background writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
-        # Add handlers to the logger
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
 
-    return logger
+def add_span_listener(listener):
+    """Call `listener(phase, subdomain, duration_ms, status)` whenever a span ends."""
+    _span_listeners.append(listener)
+
+
+def remove_span_listener(listener):
+    if listener in _span_listeners:
+        _span_listeners.remove(listener)
+
+
+@contextmanager
+def log_span(phase, subdomain=None, logger=None, level=logging.INFO):
+    """
+    Time a phase of an operation and log its duration.
 
+    Usage:
+        with log_span('certbot', subdomain):
+            obtain_certificate(subdomain)
+
+    The record carries 'phase', 'subdomain', 'duration_ms' and 'status'
+    attributes, which appear as fields in JSON-lines output.
+
+    Args:
+        phase (str): Name of the phase (e.g. 'render', 'write', 'nginx -t', 'reload', 'certbot').
+        subdomain (str, optional): Subdomain the phase operates on.
+        logger (logging.Logger, optional): Logger to use; defaults to the application logger.
+        level (int): Level of the timing record.
+    """
+    logger = logger or logging.getLogger(LOGGER_NAME)
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        duration_ms = round((time.perf_counter() - start) * 1000, 3)
+        target = f" for {subdomain}" if subdomain else ""
+        outcome = 'completed' if status == 'ok' else 'failed'
+        logger.log(
+            level,
+            f"Phase '{phase}'{target} {outcome} in {duration_ms:.1f} ms",
+            extra={'phase': phase, 'subdomain': subdomain, 'duration_ms': duration_ms, 'status': status},
+        )
+        for listener in list(_span_listeners):
+            listener(phase, subdomain, duration_ms, status)
 
 
 def show_logs(config, logger):
     """
-    Display the contents of the log file.
+    Interactively browse the log file and its rotations.
+
+    Records are streamed newest first, filtered by level, subdomain and time
+    range, and shown one page at a time. Follow mode prints new records as
+    they are written until interrupted with Ctrl+C.
 
     Args:
         config (dict): Configuration dictionary containing log file path.
         logger (logging.Logger): Logger instance.
     """
     log_file = config.get('log_file', 'nginx_domain_manager.log')
-    if os.path.exists(log_file):
-        try:
-            with open(log_file, 'r') as f:
-                print(Fore.WHITE + f.read())
-            logger.info(f"Displayed logs from {log_file}")
-        except Exception as e:
-            error_message = f"Failed to read log file {log_file}: {e}"
-            print(Fore.RED + f"Failed to read log file: {e}")
-            logger.error(error_message)
-    else:
+    if not rotated_log_files(log_file):
         error_message = f"Log file not found at {log_file}"
         print(Fore.RED + error_message)
         logger.error(error_message)
+        return
 
+    level = input("Minimum level (DEBUG/INFO/WARNING/ERROR/CRITICAL) [all]: ").strip() or None
+    if level and parse_level(level) is None:
+        print(Fore.RED + f"Unknown log level: {level}")
+        return
+    subdomain = input("Only show entries for subdomain [all]: ").strip() or None
+    follow = input("Follow new entries (tail -f)? (y/n): ").strip().lower() == 'y'
+
+    if follow:
+        print(Fore.YELLOW + "Following log, press Ctrl+C to stop...")
+        try:
+            for record in follow_log(log_file, level=level, subdomain=subdomain):
+                print(Fore.WHITE + format_record(record))
+        except KeyboardInterrupt:
+            print()
+        return
 
-def show_changelog(logger):
+    try:
+        since = parse_time_bound(input("Since (e.g. 2h, 7d, 2024-10-01 12:00) [any]: "))
+        until = parse_time_bound(input("Until (e.g. 30m, 2024-10-02) [now]: "))
+    except ValueError as e:
+        print(Fore.RED + str(e))
+        return
+
+    page_size = int(config.get('log_page_size', 40))
+    records = iter_filtered_records(log_file, level=level, subdomain=subdomain, since=since, until=until)
+    shown = 0
+    try:
+        while True:
+            page = list(islice(records, page_size))
+            if not page:
+                if not shown:
+                    print(Fore.YELLOW + "No log entries match the selected filters.")
+                break
+            # Pages are collected newest first; print them in chronological order.
+            for record in reversed(page):
+                print(Fore.WHITE + format_record(record))
+            shown += len(page)
+            if len(page) < page_size:
+                break
+            more = input(f"-- {shown} entries shown. Enter for older entries, 'q' to quit: ").strip().lower()
+            if more == 'q':
+                break
+        logger.info(f"Displayed {shown} log entries from {log_file}")
+    except OSError as e:
+        error_message = f"Failed to read log file {log_file}: {e}"
+        print(Fore.RED + f"Failed to read log file: {e}")
+        logger.error(error_message)
+
+
+def show_changelog(logger, config=None):
     """
-    Fetch and display the latest changelog from GitHub releases.
+    Display the latest changelog from GitHub releases.
+
+    Uses the same cached release lookup as the update check, so it does not
+    hit the GitHub API again when the updater already has the data.
 
     Args:
         logger (logging.Logger): Logger instance.
+        config (dict, optional): Configuration dictionary.
     """
+    from domain_manager.updater import get_latest_release_details
+
     logger.info("Fetching latest changelog from GitHub...")
     print(Fore.YELLOW + "Fetching latest changelog from GitHub...")
-    try:
-        # GitHub API endpoint for the latest release
-        REPO_API_URL = "https://api.github.com/repos/Bof98/NGINXDomainManager/releases/latest"
-        response = requests.get(REPO_API_URL, timeout=10)
-        response.raise_for_status()
-        release_data = response.json()
-
-        latest_version = release_data.get('tag_name', 'Unknown')
-        changelog = release_data.get('body', 'No changelog provided.')
-
-        if latest_version != 'Unknown':
-            print(Fore.CYAN + f"Latest Version: {latest_version}\n")
-            print(Fore.GREEN + "Changelog:\n" + Fore.WHITE + changelog + "\n")
-            logger.info(f"Displayed changelog for version {latest_version}")
-        else:
-            print(Fore.RED + "Could not retrieve the latest version from GitHub.\n")
-            logger.error("Could not retrieve the latest version from GitHub.")
-    except requests.exceptions.RequestException as e:
-        error_message = f"Failed to fetch changelog from GitHub: {e}"
-        print(Fore.RED + error_message)
-        logger.error(error_message)
-    except Exception as e:
-        error_message = f"An unexpected error occurred while fetching changelog: {e}"
-        print(Fore.RED + error_message)
-        logger.error(error_message)
+    latest_version, changelog = get_latest_release_details(config)
+
+    if latest_version != 'Unknown':
+        print(Fore.CYAN + f"Latest Version: {latest_version}\n")
+        print(Fore.GREEN + "Changelog:\n" + Fore.WHITE + changelog + "\n")
+        logger.info(f"Displayed changelog for version {latest_version}")
+    else:
+        print(Fore.RED + "Could not retrieve the latest version from GitHub.\n")
+        logger.error("Could not retrieve the latest version from GitHub.")
@@ -10,63 +10,62 @@ Requires: Python 3.6+, PyYAML, colorama
 # Main Function
 import os
 import sys
-import subprocess
-from colorama import init
+from colorama import Fore, init
 
 # Add the src directory to the Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
+from domain_manager.cli import apply_global_options, menu_config, parse_args, run_command
 from domain_manager.config import load_config
-from domain_manager.logger import setup_logging, show_logs, show_changelog
-from domain_manager.updater import check_for_updates
-from domain_manager.utils.display import display_startup, main_menu
+from domain_manager.logger import setup_logging
+from domain_manager.metrics import record_metrics
+from domain_manager.updater import start_release_lookup
 from domain_manager.utils.permissions import check_permissions
+from domain_manager.version import get_version
 
 # Initialize colorama
 init(autoreset=True)
 
 
-def get_current_version():
-    """Fetch the current version from Git tags."""
-    try:
-        # Run `git describe --tags --abbrev=0` to get the latest tag without commit hash
-        version_str = subprocess.check_output(
-            ["git", "describe", "--tags", "--abbrev=0"],
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-            universal_newlines=True,
-        ).strip()
-        return version_str
-    except subprocess.CalledProcessError:
-        print(Fore.RED + "Unable to determine version from Git. Defaulting to '0.0.0'.")
-        return "0.0.0"
-
-
-# Application version (dynamically fetched)
-__version__ = get_current_version()
+# Application version, resolved from package metadata (no subprocesses)
+__version__ = get_version()
 
 # Package details
 package_name = "NGINXDomainManager"
 
 
-def main():
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
     # Ensure the script is run as root/admin
     check_permissions()
 
     # Load configuration
     config = load_config()
-    logger = setup_logging(config['log_file'])
+    apply_global_options(args, config)
+    logger = setup_logging(config['log_file'], config.get('log_format', 'text'))
+    record_metrics(config)
 
-    # Display startup graphic
-    display_startup(__version__)
+    # Subcommands run non-interactively and skip the menu
+    if args.command:
+        sys.exit(run_command(args, config, logger))
 
-    # Check for updates before proceeding
-    check_for_updates()
+    # The menu manages one Nginx instance
+    try:
+        config = menu_config(args, config)
+    except ValueError as e:
+        print(Fore.RED + str(e))
+        sys.exit(2)
 
-    # Load configuration again in case it was updated
-    config = load_config()
+    # Look up the latest release in the background so startup never waits on the network
+    start_release_lookup(config)
+
+    # The menu pulls in every subsystem, so only import it when it is needed
+    from domain_manager.utils.display import display_startup, main_menu, show_update_notice
 
-    # Setup logging again in case it was updated
-    logger = setup_logging(config['log_file'])
+    # Display startup graphic
+    display_startup(__version__)
+    show_update_notice(__version__)
 
     # Proceed with the main menu
     main_menu(config, __version__)  # Pass both config and __version__
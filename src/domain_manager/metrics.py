@@ -0,0 +1,391 @@
+# domain_manager/metrics.py
+
+"""
+Prometheus metrics for node_exporter's textfile collector.
+
+Two halves:
+
+- every run records how long its phases (render, nginx -t, reload,
+  certbot, ...) and subcommands took and whether they failed. The totals
+  are merged into `<state_dir>/metrics.json` when the run exits (and after
+  every daemon batch);
+- `export_metrics` (the `metrics` subcommand, meant for a one-minute
+  timer) combines those totals with a scan of the vhost tree, certificate
+  expiry dates and the last health check, and atomically replaces the
+  `.prom` file.
+
+Certificate expiry dates are read straight from the DER encoding and
+cached by file identity in `<state_dir>/cert_expiry.json`, so a refresh
+only parses certificates that changed since the last one.
+"""
+
+import atexit
+import base64
+import binascii
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from domain_manager.utils.locks import DEFAULT_STATE_DIR, file_lock, lock_dir
+
+PREFIX = 'nginx_domain_manager'
+METRICS_STATE_FILE = 'metrics.json'
+CERT_CACHE_FILE = 'cert_expiry.json'
+
+DEFAULT_METRICS = {
+    'enabled': True,
+    'textfile': '/var/lib/node_exporter/textfile_collector/nginx_domain_manager.prom',
+}
+
+logger = logging.getLogger('NGINXDomainManager')
+
+
+def metrics_settings(config):
+    """Return metrics settings from config.yaml merged over the defaults."""
+    settings = dict(DEFAULT_METRICS)
+    settings.update(config.get('metrics') or {})
+    return settings
+
+
+def _state_path(config, name):
+    return os.path.join(config.get('state_dir', DEFAULT_STATE_DIR), name)
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Recording: per-run totals, merged into the state file
+
+class _Recorder:
+    """Accumulates span and subcommand outcomes in memory; thread-safe."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.operations = {}
+        self.last_reload = None
+
+    @staticmethod
+    def _add(totals, name, seconds, ok):
+        entry = totals.setdefault(name, {'ok': 0, 'error': 0, 'seconds': 0.0})
+        entry['ok' if ok else 'error'] += 1
+        entry['seconds'] += seconds
+
+    def span(self, phase, subdomain, duration_ms, status):
+        with self.lock:
+            self._add(self.phases, phase, duration_ms / 1000, status == 'ok')
+            if phase == 'reload':
+                self.last_reload = {'timestamp': time.time(), 'duration_seconds': duration_ms / 1000,
+                                    'success': status == 'ok'}
+
+    def operation(self, name, seconds, ok):
+        with self.lock:
+            self._add(self.operations, name, seconds, ok)
+
+    def take(self):
+        """Return and reset everything recorded so far."""
+        with self.lock:
+            taken = (self.phases, self.operations, self.last_reload)
+            self.phases, self.operations, self.last_reload = {}, {}, None
+        return taken
+
+
+_recorder = None
+_config = None
+
+
+def record_metrics(config):
+    """
+    Record this run's phases and subcommands, and merge them into the state file at exit.
+
+    Does nothing if `metrics.enabled` is false.
+    """
+    global _recorder, _config
+    from domain_manager.logger import add_span_listener
+
+    if _recorder is not None or not metrics_settings(config)['enabled']:
+        return
+    _recorder = _Recorder()
+    _config = config
+    add_span_listener(_recorder.span)
+    atexit.register(flush_metrics)
+
+
+def record_operation(name, seconds, ok):
+    """Record the duration and outcome of a subcommand or daemon batch."""
+    if _recorder is not None:
+        _recorder.operation(name, seconds, ok)
+
+
+def flush_metrics():
+    """Merge the totals recorded since the last flush into `<state_dir>/metrics.json`."""
+    if _recorder is None:
+        return
+    phases, operations, last_reload = _recorder.take()
+    if not phases and not operations:
+        return
+    path = _state_path(_config, METRICS_STATE_FILE)
+    try:
+        with file_lock(os.path.join(lock_dir(_config), 'metrics.lock'), quiet=True):
+            state = _read_json(path)
+            for key, totals in (('phases', phases), ('operations', operations)):
+                merged = state.setdefault(key, {})
+                for name, entry in totals.items():
+                    target = merged.setdefault(name, {'ok': 0, 'error': 0, 'seconds': 0.0})
+                    for field, value in entry.items():
+                        target[field] = target.get(field, 0) + value
+            if last_reload and last_reload['timestamp'] >= (state.get('last_reload') or {}).get('timestamp', 0):
+                state['last_reload'] = last_reload
+            _write_json(path, state)
+    except OSError as e:
+        logger.error(f"Failed to save metrics to {path}: {e}")
+
+
+# Certificate expiry
+
+def _der_header(data, offset):
+    """Return (tag, content start, content end) of the DER element at `offset`."""
+    tag, length = data[offset], data[offset + 1]
+    start = offset + 2
+    if length & 0x80:
+        count = length & 0x7f
+        length = int.from_bytes(data[start:start + count], 'big')
+        start += count
+    return tag, start, start + length
+
+
+def certificate_not_after(pem):
+    """
+    Return the expiry time (epoch seconds) of the first certificate in PEM data.
+
+    Parses just enough DER to reach tbsCertificate.validity.notAfter.
+
+    Raises:
+        ValueError: If the data holds no parsable certificate.
+    """
+    text = pem.decode('ascii', 'replace') if isinstance(pem, bytes) else pem
+    begin = text.find('-----BEGIN CERTIFICATE-----')
+    end = text.find('-----END CERTIFICATE-----', begin)
+    if begin < 0 or end < 0:
+        raise ValueError("no certificate found")
+    try:
+        der = base64.b64decode(''.join(text[begin + 27:end].split()))
+        _, offset, _ = _der_header(der, 0)        # Certificate
+        _, offset, _ = _der_header(der, offset)   # tbsCertificate
+        if der[offset] == 0xa0:                   # [0] version
+            offset = _der_header(der, offset)[2]
+        for _ in range(3):                        # serialNumber, signature, issuer
+            offset = _der_header(der, offset)[2]
+        _, offset, _ = _der_header(der, offset)   # validity
+        offset = _der_header(der, offset)[2]      # notBefore
+        tag, start, stop = _der_header(der, offset)
+        value = der[start:stop].decode('ascii')
+    except (IndexError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f"malformed certificate: {e}")
+    formats = {0x17: '%y%m%d%H%M%SZ', 0x18: '%Y%m%d%H%M%SZ'}
+    if tag not in formats:
+        raise ValueError(f"unexpected time tag {tag:#x}")
+    return datetime.strptime(value, formats[tag]).replace(tzinfo=timezone.utc).timestamp()
+
+
+def certificate_expiries(config):
+    """
+    Return subdomain -> expiry (epoch seconds) for every certificate in the Let's Encrypt live directory.
+
+    Only certificates whose file changed since the previous call are parsed.
+    """
+    from domain_manager.utils import domain
+
+    cache_path = _state_path(config, CERT_CACHE_FILE)
+    cache = _read_json(cache_path)
+    fresh = {}
+    expiries = {}
+    try:
+        entries = list(os.scandir(domain.LETSENCRYPT_LIVE_DIR))
+    except OSError:
+        entries = []
+    for entry in entries:
+        if not entry.is_dir():
+            continue
+        for name in ('cert.pem', 'fullchain.pem'):
+            path = os.path.join(entry.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            identity = [stat.st_ino, stat.st_mtime_ns, stat.st_size]
+            cached = cache.get(entry.name)
+            if cached and cached[:3] == identity:
+                not_after = cached[3]
+            else:
+                try:
+                    with open(path, 'rb') as f:
+                        not_after = certificate_not_after(f.read())
+                except (OSError, ValueError) as e:
+                    logger.debug(f"Cannot read the expiry date of {path}: {e}")
+                    not_after = None
+            fresh[entry.name] = identity + [not_after]
+            if not_after is not None:
+                expiries[entry.name] = not_after
+            break
+    if fresh != cache:
+        try:
+            _write_json(cache_path, fresh)
+        except OSError as e:
+            logger.error(f"Failed to save the certificate expiry cache to {cache_path}: {e}")
+    return expiries
+
+
+# Exposition
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Exposition:
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help_text, samples):
+        """Add a metric family; `samples` is a list of (suffix, labels dict, value)."""
+        if not samples:
+            return
+        self.lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        self.lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for suffix, labels, value in samples:
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            value = repr(float(value)) if isinstance(value, float) else str(value)
+            self.lines.append(f"{PREFIX}_{name}{suffix}{{{label_text}}} {value}" if label_text
+                              else f"{PREFIX}_{name}{suffix} {value}")
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _count_confs(directory):
+    try:
+        with os.scandir(directory) as entries:
+            return sum(1 for entry in entries if entry.name.endswith('.conf'))
+    except OSError:
+        return 0
+
+
+def collect_metrics(config):
+    """
+    Build the metrics exposition text.
+
+    Returns:
+        str: Metrics in the Prometheus text format.
+    """
+    from domain_manager.instances import instance_config, instance_names, sites_available_dir, sites_enabled_dir
+    from domain_manager.utils.health import load_health_state
+
+    start = time.perf_counter()
+    now = time.time()
+    out = _Exposition()
+
+    vhosts = []
+    for name in instance_names(config) or [None]:
+        view, labels = (instance_config(config, name), {'instance': name}) if name else (config, {})
+        vhosts += [('', {**labels, 'state': 'available'}, _count_confs(sites_available_dir(view))),
+                   ('', {**labels, 'state': 'enabled'}, _count_confs(sites_enabled_dir(view)))]
+    out.family('vhosts', 'gauge', 'Vhost files by state.', vhosts)
+    out.family('registry_subdomains', 'gauge', 'Subdomains in the registry.',
+               [('', {}, len(config.get('subdomains') or {}))])
+
+    expiries = certificate_expiries(config)
+    out.family('certificates', 'gauge', 'Certificates found in the Let\'s Encrypt live directory.',
+               [('', {}, len(expiries))])
+    out.family('certificate_expiry_days', 'gauge', 'Days until the certificate expires (negative once expired).',
+               [('', {'subdomain': sub}, (not_after - now) / 86400) for sub, not_after in sorted(expiries.items())])
+
+    state = _read_json(_state_path(config, METRICS_STATE_FILE))
+    last_reload = state.get('last_reload')
+    if last_reload:
+        out.family('last_reload_timestamp_seconds', 'gauge', 'Time of the last Nginx reload.',
+                   [('', {}, last_reload['timestamp'])])
+        out.family('last_reload_duration_seconds', 'gauge', 'Duration of the last Nginx reload.',
+                   [('', {}, last_reload['duration_seconds'])])
+        out.family('last_reload_success', 'gauge', 'Whether the last Nginx reload succeeded (1) or failed (0).',
+                   [('', {}, 1 if last_reload['success'] else 0)])
+
+    phases = state.get('phases', {})
+    certbot = phases.get('certbot', {})
+    out.family('certbot_runs_total', 'counter', 'Certbot runs that obtained or renewed a certificate, by result.', [
+        ('', {'result': 'success'}, certbot.get('ok', 0)),
+        ('', {'result': 'failure'}, certbot.get('error', 0)),
+    ])
+    for key, label, what in (('phases', 'phase', 'phase'), ('operations', 'operation', 'subcommand')):
+        totals = sorted(state.get(key, {}).items())
+        out.family(f'{label}_duration_seconds', 'summary', f'Time spent per {what}.',
+                   [sample for name, entry in totals for sample in (
+                       ('_sum', {label: name}, entry['seconds']),
+                       ('_count', {label: name}, entry['ok'] + entry['error']),
+                   )])
+        out.family(f'{label}_failures_total', 'counter', f'Failed runs per {what}.',
+                   [('', {label: name}, entry['error']) for name, entry in totals])
+
+    health = load_health_state(config)
+    out.family('backend_up', 'gauge', 'Whether the backend answered the last health check.',
+               [('', {'backend': backend}, 1 if result.get('healthy') else 0)
+                for backend, result in sorted(health.items())])
+    out.family('backend_latency_seconds', 'gauge', 'Backend response time in the last health check.',
+               [('', {'backend': backend}, result['latency_ms'] / 1000)
+                for backend, result in sorted(health.items()) if result.get('latency_ms') is not None])
+    checked = [result['checked_at'] for result in health.values() if result.get('checked_at')]
+    if checked:
+        out.family('health_check_timestamp_seconds', 'gauge', 'Time of the last backend health check.',
+                   [('', {}, max(checked))])
+
+    out.family('metrics_collection_seconds', 'gauge', 'Time taken to collect these metrics.',
+               [('', {}, time.perf_counter() - start)])
+    return out.text()
+
+
+def write_textfile(path, text):
+    """Replace `path` atomically, so the textfile collector never reads a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def export_metrics(config, path=None):
+    """
+    Collect metrics and write them to the textfile collector file.
+
+    Args:
+        config (dict): Configuration dictionary.
+        path (str, optional): Output file (default: `metrics.textfile`).
+
+    Returns:
+        str: The path written.
+    """
+    flush_metrics()
+    path = path or metrics_settings(config)['textfile']
+    write_textfile(path, collect_metrics(config))
+    return path
@@ -0,0 +1,162 @@
+# domain_manager/profiling.py
+
+"""
+Opt-in profiling of individual operations (`--profile`).
+
+Each profiled operation writes two files to the profile directory:
+
+    <timestamp>-<operation>.pstats   cProfile data, for pstats/snakeviz
+    <timestamp>-<operation>.txt      summary: wall time split into Python
+                                     work and external-process waits,
+                                     the slowest functions and, with
+                                     --profile-memory, the top allocations
+
+External waits come from log_span: every span whose phase is in
+logger.EXTERNAL_PHASES (certbot, nginx -t, reload) counts as time spent
+waiting on a subprocess.
+"""
+
+import io
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from domain_manager.logger import EXTERNAL_PHASES, LOGGER_NAME, add_span_listener, remove_span_listener
+
+DEFAULT_TOP = 25
+
+_settings = None
+_local = threading.local()
+
+
+def enable_profiling(output_dir, memory=False, top=DEFAULT_TOP):
+    """
+    Profile every operation wrapped in profile_operation from now on.
+
+    Args:
+        output_dir (str): Directory for the reports; created if needed.
+        memory (bool): Also trace allocations with tracemalloc (slower).
+        top (int): Number of functions and allocation sites per report.
+    """
+    global _settings
+    os.makedirs(output_dir, exist_ok=True)
+    _settings = {'output_dir': output_dir, 'memory': memory, 'top': top}
+
+
+def profiling_enabled():
+    return _settings is not None
+
+
+class _SpanTotals:
+    """Sums span durations per phase while an operation is profiled."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+
+    def __call__(self, phase, subdomain, duration_ms, status):
+        with self.lock:
+            count, total = self.phases.get(phase, (0, 0.0))
+            self.phases[phase] = (count + 1, total + duration_ms / 1000)
+
+    def external_seconds(self):
+        return sum(total for phase, (_, total) in self.phases.items() if phase in EXTERNAL_PHASES)
+
+
+def _report_name(operation):
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '-', operation).strip('-') or 'operation'
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{slug}"
+
+
+def _write_report(path, operation, wall, spans, profiler, snapshot, peak, top):
+    import pstats
+
+    external = spans.external_seconds()
+    lines = [
+        f"Operation: {operation}",
+        f"Wall time: {wall:.3f}s",
+        f"External processes: {external:.3f}s (summed over all threads)",
+        f"Python and other work: {max(wall - external, 0):.3f}s",
+        "",
+        "Spans:",
+    ]
+    for phase, (count, total) in sorted(spans.phases.items(), key=lambda item: -item[1][1]):
+        kind = 'external' if phase in EXTERNAL_PHASES else 'python'
+        lines.append(f"  {phase:<16} {kind:<9} {count:>6} x  {total:9.3f}s")
+    if not spans.phases:
+        lines.append("  (none)")
+
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(top)
+    lines += ["", f"Top {top} functions by cumulative time:", stream.getvalue()]
+
+    if snapshot is not None:
+        lines += [f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB", "", f"Top {top} allocation sites:"]
+        for stat in snapshot.statistics('lineno')[:top]:
+            lines.append(f"  {stat}")
+
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return external
+
+
+@contextmanager
+def profile_operation(operation):
+    """
+    Profile the enclosed block if profiling is enabled; otherwise do nothing.
+
+    Nested operations are folded into the outermost one, since only one
+    profiler can be active per thread.
+
+    Args:
+        operation (str): Name used in the report file names (e.g. 'apply', 'menu reset').
+    """
+    if _settings is None or getattr(_local, 'active', False):
+        yield
+        return
+
+    import cProfile
+    import tracemalloc
+
+    logger = logging.getLogger(LOGGER_NAME)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:  # another profiler (e.g. a debugger) is already active
+        logger.warning(f"Profiling of '{operation}' skipped: {e}")
+        yield
+        return
+
+    _local.active = True
+    spans = _SpanTotals()
+    add_span_listener(spans)
+    trace_memory = _settings['memory'] and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start
+        profiler.disable()
+        remove_span_listener(spans)
+        _local.active = False
+        snapshot = peak = None
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        base = os.path.join(_settings['output_dir'], _report_name(operation))
+        try:
+            profiler.dump_stats(f"{base}.pstats")
+            external = _write_report(f"{base}.txt", operation, wall, spans, profiler, snapshot, peak,
+                                     _settings['top'])
+            logger.info(f"Profile of '{operation}': {wall:.3f}s wall, {external:.3f}s in external processes. "
+                        f"Report: {base}.txt")
+        except OSError as e:
+            logger.error(f"Failed to write profile for '{operation}': {e}")
@@ -0,0 +1,289 @@
+# domain_manager/registry_io.py
+
+import csv
+import json
+import sys
+
+from domain_manager.utils.domain import certificate_exists
+from domain_manager.utils.upstreams import format_backend, parse_backend, with_primary
+from domain_manager.utils.validation import BatchValidator
+
+FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = ('subdomain', 'target_ip', 'target_port', 'custom_options', 'profile', 'cert_state',
+                 'backends', 'balance', 'hash_key', 'rate_limit', 'conn_limit')
+LIST_FIELDS = ('custom_options', 'backends')
+# true, false, a number or a mapping (see utils/rate_limits.py); CSV cells hold mappings as compact JSON
+LIMIT_FIELDS = ('rate_limit', 'conn_limit')
+
+# Custom options and backends are each kept in a single CSV cell, one per line.
+OPTION_SEPARATOR = '\n'
+
+
+def detect_format(path, explicit=None):
+    """
+    Pick the file format from an explicit choice or the file extension.
+
+    Args:
+        path (str): File path, or '-' for stdin/stdout.
+        explicit (str, optional): 'csv' or 'jsonl'.
+
+    Returns:
+        str: 'csv' or 'jsonl'.
+    """
+    if explicit:
+        return explicit
+    if path.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def _open(path, mode):
+    if path == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+    return open(path, mode, newline='' if 'b' not in mode else None, encoding='utf-8')
+
+
+def _backend_strings(backends):
+    """Return backends in the string form of utils/upstreams.py; unparsable ones are kept for validation to report."""
+    strings = []
+    for backend in backends or []:
+        try:
+            strings.append(format_backend(parse_backend(backend)))
+        except ValueError:
+            strings.append(str(backend))
+    return strings
+
+
+def _limit_cell(value):
+    """Render a rate_limit/conn_limit value for a CSV cell."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, dict):
+        return json.dumps(value, separators=(',', ':'), sort_keys=True)
+    return str(value)
+
+
+def _parse_limit(value):
+    """Read a rate_limit/conn_limit cell back; values that do not parse are kept for validation to report."""
+    if not isinstance(value, str):
+        return value
+    value = value.strip()
+    if value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    if value.isdigit():
+        return int(value)
+    if value.startswith('{'):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+def iter_export_rows(config, cert_state=True):
+    """
+    Yield one flat row per registry entry.
+
+    Args:
+        config (dict): Configuration dictionary.
+        cert_state (bool): Include whether a certificate exists ('valid'/'missing').
+
+    Yields:
+        dict: Row with the keys in EXPORT_FIELDS.
+    """
+    for subdomain, details in config.get('subdomains', {}).items():
+        yield {
+            'subdomain': subdomain,
+            'target_ip': details.get('target_ip'),
+            'target_port': details.get('target_port'),
+            'custom_options': list(details.get('custom_options') or []),
+            'profile': details.get('profile') or '',
+            'cert_state': ('valid' if certificate_exists(subdomain) else 'missing') if cert_state else '',
+            'backends': _backend_strings(details.get('backends')),
+            'balance': details.get('balance') or '',
+            'hash_key': details.get('hash_key') or '',
+            'rate_limit': details.get('rate_limit'),
+            'conn_limit': details.get('conn_limit'),
+        }
+
+
+def export_registry(config, path, fmt=None, cert_state=True):
+    """
+    Stream the registry to a CSV or JSON-lines file.
+
+    Rows are written as they are produced, so memory use does not grow
+    with the number of subdomains beyond the registry itself.
+
+    Args:
+        config (dict): Configuration dictionary.
+        path (str): Output file, or '-' for stdout.
+        fmt (str, optional): 'csv' or 'jsonl'; detected from the extension otherwise.
+        cert_state (bool): Include certificate state (one stat per subdomain).
+
+    Returns:
+        int: Number of rows written.
+    """
+    fmt = detect_format(path, fmt)
+    count = 0
+    f = _open(path, 'w')
+    try:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            for row in iter_export_rows(config, cert_state):
+                for field in LIST_FIELDS:
+                    row[field] = OPTION_SEPARATOR.join(map(str, row[field]))
+                for field in LIMIT_FIELDS:
+                    row[field] = _limit_cell(row[field])
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in iter_export_rows(config, cert_state):
+                f.write(json.dumps(row, separators=(',', ':')) + '\n')
+                count += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return count
+
+
+def iter_import_rows(path, fmt=None):
+    """
+    Stream rows from a CSV or JSON-lines file.
+
+    Args:
+        path (str): Input file, or '-' for stdin.
+        fmt (str, optional): 'csv' or 'jsonl'; detected from the extension otherwise.
+
+    Yields:
+        tuple: (line_number, row_dict or None, parse_error or None)
+    """
+    fmt = detect_format(path, fmt)
+    f = _open(path, 'r')
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row, None
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_number, None, f"Invalid JSON: {e}"
+                    continue
+                if not isinstance(row, dict):
+                    yield line_number, None, "Expected a JSON object"
+                    continue
+                yield line_number, row, None
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def row_to_entry(row):
+    """
+    Convert an import row into (subdomain, registry fields).
+
+    Only columns present in the row are returned, so a file without a
+    'profile' column leaves existing profiles alone, and a row that only
+    lists backends keeps the entry's target_ip/target_port.
+    """
+    subdomain = (row.get('subdomain') or '').strip().lower()
+    details = {}
+    for field in ('target_ip', 'target_port'):
+        if row.get(field) not in (None, ''):
+            details[field] = str(row[field]).strip()
+    for field in LIST_FIELDS:
+        if field in row:
+            values = row[field]
+            if isinstance(values, str):
+                values = [value.strip() for value in values.split(OPTION_SEPARATOR) if value.strip()]
+            details[field] = values if values is not None else []
+    if 'backends' in details:
+        details['backends'] = _backend_strings(details['backends'])
+    for field in ('profile', 'balance', 'hash_key'):
+        if row.get(field):
+            details[field] = str(row[field]).strip()
+    for field in LIMIT_FIELDS:
+        if row.get(field) not in (None, ''):
+            details[field] = _parse_limit(row[field])
+    return subdomain, details
+
+
+def _differs(current, details):
+    """Compare an import row with a registry entry; ports may be stored as int or str, lists may be absent."""
+    for key, value in details.items():
+        existing = current.get(key)
+        if key in ('target_ip', 'target_port'):
+            existing = str(existing)
+        elif key == 'backends':
+            existing = _backend_strings(existing)
+        elif key in LIST_FIELDS:
+            existing = list(existing or [])
+        if existing != value:
+            return True
+    return False
+
+
+def import_registry(config, path, fmt=None, strict=False, commit=True):
+    """
+    Upsert registry entries from a CSV or JSON-lines file.
+
+    Rows are validated in one streaming pass (see
+    utils.validation.BatchValidator): invalid rows, including duplicates,
+    are reported and skipped. Rows for existing subdomains replace only the columns they
+    carry.
+
+    Args:
+        config (dict): Configuration dictionary.
+        path (str): Input file, or '-' for stdin.
+        fmt (str, optional): 'csv' or 'jsonl'.
+        strict (bool): Change nothing if any row is invalid.
+        commit (bool): Update config['subdomains'] in memory. Pass False to
+            hand the returned entries to bulk.apply_batch instead, which
+            commits them together with the vhost files.
+
+    Returns:
+        dict: 'rows', 'created', 'updated', 'unchanged' and 'warnings'
+        counts, 'entries' ((subdomain, details) pairs that changed) and
+        'errors' (list of {'line', 'subdomain', 'errors'}).
+    """
+    registry = config.setdefault('subdomains', {})
+    result = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'entries': [], 'errors': [], 'warnings': 0}
+    validator = BatchValidator(config, registry)
+
+    for line_number, row, parse_error in iter_import_rows(path, fmt):
+        result['rows'] += 1
+        if parse_error:
+            result['errors'].append({'line': line_number, 'subdomain': None, 'errors': [parse_error]})
+            continue
+        subdomain, details = row_to_entry(row)
+        current = registry.get(subdomain)
+        problems = validator.check(subdomain, {**current, **details} if current else details,
+                                   label=f"line {line_number}")
+        if problems:
+            result['errors'].append({'line': line_number, 'subdomain': subdomain or None, 'errors': problems})
+            continue
+
+        if current is None:
+            details.setdefault('custom_options', [])
+            result['entries'].append((subdomain, with_primary(details)))
+            result['created'] += 1
+        elif _differs(current, details):
+            result['entries'].append((subdomain, with_primary({**current, **details})))
+            result['updated'] += 1
+        else:
+            result['unchanged'] += 1
+
+    result['warnings'] = sum(len(messages) for messages in validator.warnings.values())
+    if strict and result['errors']:
+        result['created'] = result['updated'] = 0
+        result['entries'] = []
+    if commit:
+        registry.update(result['entries'])
+    return result
@@ -1,25 +1,39 @@
+import json
 import logging
 import os
 import subprocess
 import sys
-import requests
+import threading
+import time
 from colorama import Fore, init
-from packaging import version
+
+from domain_manager.version import get_version
 
 # Initialize colorama
 init(autoreset=True)
 
-# Setup logging
-logging.basicConfig(
-    filename='updater.log',
-    level=logging.DEBUG,  # Set to DEBUG to capture detailed information
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Log through the application logger configured by setup_logging
+logger = logging.getLogger('NGINXDomainManager')
 
 # GitHub repository details
 REPO_URL = "https://github.com/Bof98/NGINXDomainManager.git"
+RELEASE_API_URL = "https://api.github.com/repos/Bof98/NGINXDomainManager/releases/latest"
 LOCAL_REPO_DIR = os.path.expanduser("~/NGINXDomainManager")
 
+DEFAULT_STATE_DIR = '/var/lib/nginx_domain_manager'
+RELEASE_CACHE_FILE = 'release_cache.json'
+DEFAULT_UPDATE_CHECK = {
+    'offline': False,
+    'ttl': 6 * 60 * 60,  # seconds between release lookups
+    'timeout': 10,
+    'url': RELEASE_API_URL,
+}
+
+# Result of the background release lookup, see start_release_lookup()
+_release_started = False
+_release_ready = threading.Event()
+_release_data = None
+
 
 def clear_terminal():
     """Clear the terminal screen."""
@@ -29,23 +43,175 @@ def clear_terminal():
         os.system('clear')
 
 
-def get_latest_release_details():
-    """Fetch the latest release details from GitHub."""
+def update_check_settings(config):
+    """Return update check settings from config.yaml merged over the defaults."""
+    settings = dict(DEFAULT_UPDATE_CHECK)
+    settings.update((config or {}).get('update_check') or {})
+    if (config or {}).get('offline'):
+        settings['offline'] = True
+    return settings
+
+
+def release_cache_path(config):
+    state_dir = (config or {}).get('state_dir', DEFAULT_STATE_DIR)
+    return os.path.join(state_dir, RELEASE_CACHE_FILE)
+
+
+def load_release_cache(config):
+    """Load the cached release lookup, or None if there is none."""
+    try:
+        with open(release_cache_path(config), 'r') as f:
+            cache = json.load(f)
+        if isinstance(cache.get('data'), dict):
+            return cache
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def save_release_cache(config, cache):
+    """Write the release cache atomically; failures only cost a refetch next time."""
+    path = release_cache_path(config)
     try:
-        url = "https://api.github.com/repos/Bof98/NGINXDomainManager/releases/latest"
-        response = requests.get(url, timeout=10)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.debug(f"Failed to write release cache {path}: {e}")
+
+
+def fetch_latest_release(config=None, force=False):
+    """
+    Return the latest release data, using the on-disk cache where possible.
+
+    A cache entry younger than the configured TTL is returned without any
+    network access. An older entry is revalidated with If-None-Match, so an
+    unchanged release costs a 304 response. If GitHub cannot be reached the
+    stale entry is returned. In offline mode the network is never touched.
+
+    Args:
+        config (dict, optional): Configuration dictionary.
+        force (bool): Revalidate even if the cache is still fresh.
+
+    Returns:
+        dict or None: Release data ('tag_name', 'body'), or None if unknown.
+    """
+    settings = update_check_settings(config)
+    cache = load_release_cache(config)
+    if settings['offline']:
+        return cache['data'] if cache else None
+    if cache and not force and time.time() - cache.get('fetched_at', 0) < settings['ttl']:
+        return cache['data']
+
+    import requests
+
+    headers = {'Accept': 'application/vnd.github+json'}
+    if cache and cache.get('etag'):
+        headers['If-None-Match'] = cache['etag']
+    try:
+        response = requests.get(settings['url'], headers=headers, timeout=settings['timeout'])
+        if response.status_code == 304 and cache:
+            cache['fetched_at'] = time.time()
+            save_release_cache(config, cache)
+            logger.debug("Release information unchanged (304 Not Modified).")
+            return cache['data']
         response.raise_for_status()
         release_data = response.json()
-        latest_version = release_data.get('tag_name', 'Unknown')
-        changelog = release_data.get('body', 'No changelog provided.')
-        return latest_version, changelog
+        data = {
+            'tag_name': release_data.get('tag_name', 'Unknown'),
+            'body': release_data.get('body') or 'No changelog provided.',
+        }
+        save_release_cache(config, {'fetched_at': time.time(), 'etag': response.headers.get('ETag'), 'data': data})
+        return data
     except Exception as e:
-        logging.error(f"Failed to fetch release details from GitHub: {e}")
+        logger.error(f"Failed to fetch release details from GitHub: {e}")
+        return cache['data'] if cache else None
+
+
+def _run_release_lookup(config):
+    global _release_data
+    try:
+        _release_data = fetch_latest_release(config)
+    finally:
+        _release_ready.set()
+
+
+def start_release_lookup(config=None):
+    """
+    Start the release lookup without blocking the caller.
+
+    A fresh cache entry (or offline mode) resolves immediately; otherwise the
+    lookup runs in a daemon thread and its result is picked up by
+    update_available() or get_latest_release_details().
+
+    Args:
+        config (dict, optional): Configuration dictionary.
+    """
+    global _release_started, _release_data
+    if _release_started:
+        return
+    _release_started = True
+    settings = update_check_settings(config)
+    cache = load_release_cache(config)
+    if settings['offline'] or (cache and time.time() - cache.get('fetched_at', 0) < settings['ttl']):
+        _release_data = cache['data'] if cache else None
+        _release_ready.set()
+        return
+    threading.Thread(target=_run_release_lookup, args=(config,), name='release-lookup', daemon=True).start()
+
+
+def get_latest_release_details(config=None, force=False):
+    """
+    Return (latest_version, changelog), shared by the updater and the changelog view.
+
+    Waits for a lookup started by start_release_lookup(), or performs one.
+
+    Args:
+        config (dict, optional): Configuration dictionary.
+        force (bool): Revalidate with GitHub even if the cache is fresh.
+    """
+    global _release_started, _release_data
+    if force:
+        _release_data = fetch_latest_release(config, force=True)
+        _release_started = True
+        _release_ready.set()
+    else:
+        start_release_lookup(config)
+        _release_ready.wait(update_check_settings(config)['timeout'] + 1)
+    data = _release_data
+    if not data:
         return "Unknown", "Could not fetch changelog."
+    return data['tag_name'], data['body']
+
+
+def update_available(current_version):
+    """
+    Return the newer version if the finished background lookup found one.
+
+    Never blocks: returns None while the lookup is still running.
+    """
+    from packaging import version
+
+    if not _release_ready.is_set() or not _release_data:
+        return None
+    latest_version = _release_data.get('tag_name', 'Unknown')
+    try:
+        if version.parse(latest_version) > version.parse(current_version):
+            return latest_version
+    except version.InvalidVersion:
+        pass
+    return None
 
 
 def get_current_version():
-    """Fetch the current version from Git tags."""
+    """Return the installed version (from package metadata, no subprocess)."""
+    return get_version()
+
+
+def get_repository_version():
+    """Fetch the version of the local checkout from Git tags, used to verify an update."""
     try:
         # Run `git describe --tags --abbrev=0` to get the latest tag without commit hash
         version_str = subprocess.check_output(
@@ -53,10 +219,10 @@ def get_current_version():
             cwd=LOCAL_REPO_DIR,
             universal_newlines=True,
         ).strip()
-        logging.debug(f"Current installed version: {version_str}")
+        logger.debug(f"Repository version: {version_str}")
         return version_str
-    except subprocess.CalledProcessError:
-        logging.error("Unable to determine current version from Git.")
+    except (subprocess.CalledProcessError, OSError):
+        logger.error("Unable to determine repository version from Git.")
         return "0.0.0"
 
 
@@ -64,68 +230,79 @@ def update_from_github():
     """Clone or pull the latest code from GitHub."""
     try:
         if not os.path.exists(LOCAL_REPO_DIR):
-            logging.info(f"Cloning repository from {REPO_URL}...")
+            logger.info(f"Cloning repository from {REPO_URL}...")
             subprocess.check_call(['git', 'clone', REPO_URL, LOCAL_REPO_DIR])
         else:
-            logging.info(f"Fetching latest tags and pulling changes into {LOCAL_REPO_DIR}...")
+            logger.info(f"Fetching latest tags and pulling changes into {LOCAL_REPO_DIR}...")
             subprocess.check_call(['git', '-C', LOCAL_REPO_DIR, 'fetch', '--tags'])
             subprocess.check_call(['git', '-C', LOCAL_REPO_DIR, 'pull'])
-        logging.info("Repository updated successfully.")
+        logger.info("Repository updated successfully.")
         print(Fore.GREEN + "Repository updated successfully.")
     except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to update the repository: {e}")
+        logger.error(f"Failed to update the repository: {e}")
         print(Fore.RED + "Failed to update the repository.")
         sys.exit(1)
 
 
 def restart_application():
     """Restart the application."""
-    logging.info("Restarting application...")
+    logger.info("Restarting application...")
     print(Fore.YELLOW + "Restarting application...")
     clear_terminal()
     os.execv(sys.executable, [sys.executable] + sys.argv)
 
 
-def check_for_updates():
-    """Check if there are updates available and update if needed."""
+def check_for_updates(config=None, force=False):
+    """
+    Check if there are updates available and update if needed.
+
+    Args:
+        config (dict, optional): Configuration dictionary.
+        force (bool): Revalidate with GitHub instead of trusting a fresh cache.
+    """
+    from packaging import version
+
+    if update_check_settings(config)['offline']:
+        print(Fore.YELLOW + "Offline mode: skipping update check.")
+        return
     print(Fore.YELLOW + "Checking for updates...")
-    logging.info("Checking for updates...")
+    logger.info("Checking for updates...")
     try:
-        latest_version, changelog = get_latest_release_details()
+        latest_version, changelog = get_latest_release_details(config, force=force)
         current_version = get_current_version()
 
         if latest_version == "Unknown":
             print(Fore.RED + "Could not retrieve the latest version from GitHub.")
-            logging.error("Could not retrieve the latest version from GitHub.")
+            logger.error("Could not retrieve the latest version from GitHub.")
             return
 
         # Compare versions using packaging.version
         if version.parse(latest_version) > version.parse(current_version):
             print(Fore.YELLOW + f"A new version ({latest_version}) is available.")
             print(Fore.CYAN + f"Changelog:\n{changelog}\n")
-            logging.info(f"A new version ({latest_version}) is available.")
+            logger.info(f"A new version ({latest_version}) is available.")
 
             choice = input("Do you want to update now? (y/n): ").strip().lower()
             if choice == 'y':
                 update_from_github()
                 # Fetch the new version after update
-                updated_version = get_current_version()
+                updated_version = get_repository_version()
                 if version.parse(updated_version) == version.parse(latest_version):
-                    logging.info(f"Update successful: now running version {updated_version}.")
+                    logger.info(f"Update successful: now running version {updated_version}.")
                     print(Fore.GREEN + f"Update successful: now running version {updated_version}.")
                     restart_application()
                 else:
-                    logging.error("Update failed: version mismatch after update.")
+                    logger.error("Update failed: version mismatch after update.")
                     print(Fore.RED + "Update failed: version mismatch. Please try again.")
                     sys.exit(1)
             else:
                 print(Fore.GREEN + "Update canceled.")
-                logging.info("Update canceled by the user.")
+                logger.info("Update canceled by the user.")
         else:
             print(Fore.GREEN + "You are using the latest version.")
-            logging.info("You are using the latest version.")
+            logger.info("You are using the latest version.")
     except Exception as e:
-        logging.error(f"Failed to check for updates: {e}")
+        logger.error(f"Failed to check for updates: {e}")
         print(Fore.RED + "Could not check for updates.")
 
 
@@ -0,0 +1,311 @@
+# domain_manager/utils/access_stats.py
+
+import glob
+import gzip
+import logging
+import os
+import time
+from array import array
+from collections import Counter
+
+from colorama import Fore
+
+ACCESS_LOG_FORMAT_NAME = 'dm_timed'
+ACCESS_LOG_FORMAT_FILE = 'domain_manager_log_format.conf'
+
+# Pipe separated so the parser never has to deal with quoting. $msec comes
+# first so out-of-window lines are rejected after a single split.
+ACCESS_LOG_FORMAT = (
+    "log_format {name} '$msec|$status|$request_time|$upstream_response_time|"
+    "$upstream_addr|$request_method|$body_bytes_sent|$request_uri';\n"
+)
+
+DEFAULT_ACCESS_LOG = {
+    'enabled': False,
+    'dir': '/var/log/nginx',
+    'buffer': '32k',
+    'flush': '5s',
+}
+
+PERCENTILES = (50, 95, 99)
+
+
+def access_log_settings(config, details=None):
+    """
+    Resolve access log settings for a subdomain.
+
+    The global `access_log` section in config.yaml provides the defaults; a
+    subdomain entry may set `access_log: true/false` to override `enabled`.
+
+    Args:
+        config (dict): Configuration dictionary.
+        details (dict, optional): The subdomain's registry entry.
+
+    Returns:
+        dict: Settings with 'enabled', 'dir', 'buffer' and 'flush'.
+    """
+    settings = dict(DEFAULT_ACCESS_LOG)
+    settings.update(config.get('access_log') or {})
+    if details and details.get('access_log') is not None:
+        settings['enabled'] = bool(details['access_log'])
+    return settings
+
+
+def access_log_path(settings, subdomain):
+    """Return the access log path for a subdomain."""
+    return os.path.join(settings['dir'], f"{subdomain}.access.log")
+
+
+def access_log_format():
+    """Return the content of the managed include that defines the timing log format."""
+    return "# Managed by NGINXDomainManager - do not edit\n" + ACCESS_LOG_FORMAT.format(name=ACCESS_LOG_FORMAT_NAME)
+
+
+def write_access_log_format(config, logger):
+    """
+    Write the managed conf.d include that defines the timing log format.
+
+    `log_format` is only valid in the http context, so it cannot live in the
+    generated server blocks. The file is rewritten only when its content
+    changes.
+
+    Args:
+        config (dict): Configuration dictionary.
+        logger (logging.Logger): Logger instance.
+    """
+    conf_dir = os.path.join(config.get('nginx_conf_dir', '/etc/nginx'), 'conf.d')
+    path = os.path.join(conf_dir, ACCESS_LOG_FORMAT_FILE)
+    content = access_log_format()
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return
+    except OSError:
+        pass
+    try:
+        os.makedirs(conf_dir, exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+        logger.info(f"Wrote access log format to {path}.")
+    except OSError as e:
+        logger.error(f"Failed to write access log format to {path}: {e}")
+        print(Fore.RED + f"Failed to write access log format to {path}: {e}")
+
+
+def rotated_access_logs(path):
+    """
+    List an access log and its logrotate rotations (plain or gzipped), newest first.
+
+    Args:
+        path (str): Path to the active access log.
+
+    Returns:
+        list: Existing file paths.
+    """
+    def rotation_number(candidate):
+        suffix = candidate[len(path):].lstrip('.')
+        number = suffix.split('.')[0]
+        return int(number) if number.isdigit() else 0
+
+    candidates = [p for p in glob.glob(f"{glob.escape(path)}*") if p == path or rotation_number(p) > 0]
+    return sorted(candidates, key=rotation_number)
+
+
+def _open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', errors='replace')
+    return open(path, 'r', errors='replace')
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def load_samples(paths, since=None, until=None):
+    """
+    Stream-parse access logs into compact typed arrays.
+
+    Args:
+        paths (list): Log files to read; '.gz' files are decompressed on the fly.
+        since (float, optional): Oldest epoch timestamp to keep.
+        until (float, optional): Newest epoch timestamp to keep.
+
+    Returns:
+        dict: 'timestamps' and 'request_times' as array('d'), 'statuses' as
+        array('H'), 'upstreams' mapping upstream address -> array('d') of
+        response times, and 'skipped' counting unparsable lines.
+    """
+    timestamps = array('d')
+    request_times = array('d')
+    statuses = array('H')
+    upstreams = {}
+    skipped = 0
+
+    for path in paths:
+        # A rotation last written before the window cannot contain matching lines.
+        if since is not None:
+            try:
+                if os.path.getmtime(path) < since:
+                    continue
+            except OSError:
+                continue
+        try:
+            with _open_log(path) as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('|', 7)
+                    if len(fields) < 6:
+                        skipped += 1
+                        continue
+                    timestamp = _parse_float(fields[0])
+                    if timestamp is None:
+                        skipped += 1
+                        continue
+                    if (since is not None and timestamp < since) or (until is not None and timestamp > until):
+                        continue
+                    request_time = _parse_float(fields[2])
+                    if request_time is None or not fields[1].isdigit():
+                        skipped += 1
+                        continue
+                    timestamps.append(timestamp)
+                    request_times.append(request_time)
+                    statuses.append(int(fields[1]))
+
+                    # Retries produce comma separated lists: "0.010, 0.250"
+                    addresses = fields[4].replace(' : ', ', ').split(', ')
+                    times = fields[3].replace(' : ', ', ').split(', ')
+                    for address, value in zip(addresses, times):
+                        upstream_time = _parse_float(value)
+                        if address and address != '-' and upstream_time is not None:
+                            upstreams.setdefault(address, array('d')).append(upstream_time)
+        except (OSError, EOFError) as e:
+            logging.error(f"Failed to read access log {path}: {e}")
+            skipped += 1
+
+    return {
+        'timestamps': timestamps,
+        'request_times': request_times,
+        'statuses': statuses,
+        'upstreams': upstreams,
+        'skipped': skipped,
+    }
+
+
+def percentiles(values, points=PERCENTILES):
+    """
+    Compute nearest-rank percentiles.
+
+    Args:
+        values (array): Numeric samples.
+        points (tuple): Percentiles to compute (0-100).
+
+    Returns:
+        dict: Percentile -> value, empty if there are no samples.
+    """
+    if not values:
+        return {}
+    ordered = sorted(values)
+    count = len(ordered)
+    return {p: ordered[min(count - 1, max(0, -(-p * count // 100) - 1))] for p in points}
+
+
+def compute_stats(samples, since=None, until=None, top=5):
+    """
+    Summarise parsed samples.
+
+    Args:
+        samples (dict): Output of load_samples.
+        since (float, optional): Window start; defaults to the first sample.
+        until (float, optional): Window end; defaults to the last sample.
+        top (int): Number of slowest upstreams to report.
+
+    Returns:
+        dict: Request count, RPS, latency percentiles, status mix and slowest upstreams.
+    """
+    timestamps = samples['timestamps']
+    count = len(timestamps)
+    if count:
+        start = since if since is not None else min(timestamps)
+        end = until if until is not None else max(timestamps)
+    else:
+        start, end = since, until
+    duration = (end - start) if (start is not None and end is not None) else 0
+
+    status_codes = Counter(samples['statuses'])
+    status_classes = Counter()
+    for code, hits in status_codes.items():
+        status_classes[f"{code // 100}xx"] += hits
+
+    slowest = []
+    for address, times in samples['upstreams'].items():
+        upstream_percentiles = percentiles(times)
+        slowest.append({
+            'upstream': address,
+            'requests': len(times),
+            'mean': sum(times) / len(times),
+            'p95': upstream_percentiles[95],
+            'max': max(times),
+        })
+    slowest.sort(key=lambda item: item['p95'], reverse=True)
+
+    return {
+        'requests': count,
+        'window_start': start,
+        'window_end': end,
+        'rps': count / duration if duration > 0 else float(count),
+        'latency': percentiles(samples['request_times']),
+        'status_classes': dict(sorted(status_classes.items())),
+        'status_codes': dict(sorted(status_codes.items())),
+        'slowest_upstreams': slowest[:top],
+        'skipped': samples['skipped'],
+    }
+
+
+def subdomain_stats(config, subdomain, since=None, until=None, top=5):
+    """
+    Collect access log statistics for a subdomain.
+
+    Args:
+        config (dict): Configuration dictionary.
+        subdomain (str): Subdomain whose access log to analyse.
+        since (float, optional): Oldest epoch timestamp to include.
+        until (float, optional): Newest epoch timestamp to include.
+        top (int): Number of slowest upstreams to report.
+
+    Returns:
+        dict or None: Statistics from compute_stats, or None if the subdomain has no access log.
+    """
+    details = config.get('subdomains', {}).get(subdomain)
+    path = access_log_path(access_log_settings(config, details), subdomain)
+    paths = rotated_access_logs(path)
+    if not paths:
+        return None
+    samples = load_samples(paths, since, until)
+    return compute_stats(samples, since, until, top)
+
+
+def print_stats(subdomain, stats):
+    """Print statistics produced by subdomain_stats."""
+    def fmt_time(epoch):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(epoch)) if epoch is not None else '-'
+
+    print(Fore.CYAN + f"Access statistics for {subdomain}")
+    print(f"Window:    {fmt_time(stats['window_start'])} - {fmt_time(stats['window_end'])}")
+    print(f"Requests:  {stats['requests']} ({stats['rps']:.2f} req/s)")
+    if stats['latency']:
+        latency = ', '.join(f"p{p}={value * 1000:.1f} ms" for p, value in stats['latency'].items())
+        print(f"Latency:   {latency}")
+    if stats['status_classes']:
+        mix = ', '.join(
+            f"{cls}={hits} ({hits * 100 / stats['requests']:.1f}%)" for cls, hits in stats['status_classes'].items()
+        )
+        print(f"Status:    {mix}")
+    if stats['slowest_upstreams']:
+        print("Slowest upstreams (by p95):")
+        for item in stats['slowest_upstreams']:
+            print(f"  {item['upstream']:<24} requests={item['requests']:<8} mean={item['mean'] * 1000:.1f} ms "
+                  f"p95={item['p95'] * 1000:.1f} ms max={item['max'] * 1000:.1f} ms")
+    if stats['skipped']:
+        print(Fore.YELLOW + f"Skipped {stats['skipped']} unparsable lines.")
@@ -0,0 +1,166 @@
+# domain_manager/utils/acme.py
+
+"""
+How certificates are obtained.
+
+`acme.mode: nginx` (the default) runs `certbot --nginx`, which answers the
+ACME challenge by temporarily editing the Nginx configuration and
+reloading it for every certificate.
+
+`acme.mode: webroot` leaves the configuration alone. Every generated vhost
+includes a shared snippet that serves `/.well-known/acme-challenge/` from
+`acme.webroot`. Certbot runs `certonly --webroot`, and its deploy hook only
+touches `<state_dir>/reload-pending`. Whoever reloads Nginx next (a batch,
+`reload --if-pending` from a timer) clears the flag, so issuing or
+renewing many certificates costs a single reload, and the generated files
+stay byte-identical. Only Certbot's nginx plugin creates
+/etc/letsencrypt/options-ssl-nginx.conf and ssl-dhparams.pem, so in webroot
+mode the HTTPS servers include a TLS settings snippet written by the tool
+instead. With named Nginx instances the hook flags every
+instance, since they all serve the same certificates.
+"""
+
+import os
+import shlex
+
+from domain_manager.instances import instance_state_dirs, nginx_conf_dir
+
+DEFAULT_STATE_DIR = '/var/lib/nginx_domain_manager'
+ACME_SNIPPET_FILE = 'domain_manager_acme.conf'
+SSL_SNIPPET_FILE = 'domain_manager_ssl.conf'
+RELOAD_PENDING_FILE = 'reload-pending'
+
+DEFAULT_ACME = {
+    'mode': 'nginx',
+    'webroot': '/var/www/letsencrypt',
+}
+
+ACME_SNIPPET = """# Managed by NGINXDomainManager - do not edit
+location ^~ /.well-known/acme-challenge/ {{
+    root {webroot};
+    default_type "text/plain";
+    try_files $uri =404;
+}}
+"""
+
+# Certbot's recommended settings, without the DHE ciphers that need ssl-dhparams.pem
+SSL_SNIPPET = """# Managed by NGINXDomainManager - do not edit
+ssl_session_cache shared:domain_manager_ssl:10m;
+ssl_session_timeout 1440m;
+ssl_session_tickets off;
+ssl_protocols TLSv1.2 TLSv1.3;
+ssl_prefer_server_ciphers off;
+ssl_ciphers "ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256:ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384:ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-RSA-CHACHA20-POLY1305";
+"""
+
+
+def acme_settings(config):
+    """Return ACME settings from config.yaml merged over the defaults."""
+    settings = dict(DEFAULT_ACME)
+    settings.update((config or {}).get('acme') or {})
+    return settings
+
+
+def webroot_mode(config):
+    return acme_settings(config)['mode'] == 'webroot'
+
+
+def acme_snippet_path(config):
+    return os.path.join(config.get('nginx_conf_dir', '/etc/nginx'), 'snippets', ACME_SNIPPET_FILE)
+
+
+def ssl_snippet_path(config):
+    return os.path.join(config.get('nginx_conf_dir', '/etc/nginx'), 'snippets', SSL_SNIPPET_FILE)
+
+
+def acme_snippets(config):
+    """
+    Return the snippets the generated vhosts include in webroot mode.
+
+    Returns:
+        dict: path -> content; empty in nginx mode.
+    """
+    if not webroot_mode(config):
+        return {}
+    return {
+        acme_snippet_path(config): ACME_SNIPPET.format(webroot=acme_settings(config)['webroot']),
+        ssl_snippet_path(config): SSL_SNIPPET,
+    }
+
+
+def write_acme_snippet(config, logger):
+    """
+    Write the challenge and TLS settings snippets and create the webroot, if webroot mode is on.
+
+    A snippet is rewritten only when its content changes.
+
+    Returns:
+        bool: False if a snippet could not be written.
+    """
+    snippets = acme_snippets(config)
+    if not snippets:
+        return True
+    try:
+        os.makedirs(os.path.join(acme_settings(config)['webroot'], '.well-known', 'acme-challenge'), exist_ok=True)
+    except OSError:
+        pass
+    written = True
+    for path, content in snippets.items():
+        try:
+            with open(path, 'r') as f:
+                if f.read() == content:
+                    continue
+        except OSError:
+            pass
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+            logger.info(f"Wrote ACME snippet to {path}.")
+        except OSError as e:
+            logger.error(f"Failed to write ACME snippet to {path}: {e}")
+            written = False
+    return written
+
+
+def reload_pending_path(config):
+    return os.path.join((config or {}).get('state_dir', DEFAULT_STATE_DIR), RELOAD_PENDING_FILE)
+
+
+def reload_pending(config):
+    return os.path.exists(reload_pending_path(config))
+
+
+def clear_reload_pending(config):
+    try:
+        os.remove(reload_pending_path(config))
+    except OSError:
+        pass
+
+
+def certbot_command(config, subdomain, install=True):
+    """
+    Build the Certbot command that obtains (or renews) a subdomain's certificate.
+
+    Args:
+        config (dict): Configuration dictionary (None means the defaults).
+        subdomain (str): The subdomain.
+        install (bool): In nginx mode, let Certbot install the certificate into
+            the vhost; ignored in webroot mode, which never touches the vhosts.
+
+    Returns:
+        list: The command line.
+    """
+    common = ['-d', subdomain, '--agree-tos', '--no-eff-email', '--non-interactive']
+    if webroot_mode(config):
+        paths = [os.path.join(state_dir, RELOAD_PENDING_FILE) for state_dir in instance_state_dirs(config)]
+        hook = ' && '.join(f"mkdir -p {shlex.quote(os.path.dirname(path))} && touch {shlex.quote(path)}"
+                           for path in paths)
+        return ['certbot', 'certonly', '--webroot', '-w', acme_settings(config)['webroot'], *common,
+                '--keep-until-expiring', '--deploy-hook', hook]
+    if config and config.get('instance'):
+        # Certbot's nginx plugin edits and reloads this instance rather than the system Nginx
+        common += ['--nginx-server-root', nginx_conf_dir(config), '--nginx-ctl', config.get('nginx_binary') or 'nginx']
+    if install:
+        return ['certbot', '--nginx', *common, '--redirect']
+    return ['certbot', 'certonly', '--nginx', *common, '--keep-until-expiring']
@@ -5,12 +5,14 @@ import os
 from colorama import Fore, Style
 from domain_manager.logger import show_logs, show_changelog, setup_logging
 from domain_manager.config import configure_settings
-from domain_manager.utils.domain import list_subdomains, get_subdomain_details, delete_subdomain, \
-    obtain_certificate, reload_nginx
+from domain_manager.bulk import ABSENT, apply_batch, print_summary
+from domain_manager.utils.domain import list_subdomains, renew_certificates
+from domain_manager.utils.picker import pick_subdomain
 from domain_manager.utils.validation import validate_subdomain, validate_ip, validate_port
 from domain_manager.utils.fix_nginx import fix_nginx_configuration
 from domain_manager.utils.reset_configs import reset_all_configurations
-from domain_manager.updater import check_for_updates
+from domain_manager.updater import check_for_updates, update_available
+from domain_manager.profiling import profile_operation
 
 def main_menu(config, version):
     logger = setup_logging(config['log_file'])
@@ -45,33 +47,18 @@ def main_menu(config, version):
                     break
                 add_custom = input("Add another custom option? (y/n): ").strip().lower()
 
-            # Update config.yaml
-            config['subdomains'][subdomain] = {
-                'target_ip': target_ip,
-                'target_port': target_port,
-                'custom_options': custom_options
-            }
-            with open(os.path.join(os.path.dirname(__file__), '..', 'config.yaml'), 'w') as f:
-                import yaml
-                yaml.dump(config, f)
-
-            # Create Nginx config
-            create_nginx_config(subdomain, target_ip, target_port, custom_options, logger)
-
-            # Obtain SSL certificate
-            success = obtain_certificate(subdomain)
-            if success:
-                logger.info(f"SSL certificate obtained for {subdomain}.")
-                print(Fore.GREEN + f"SSL certificate obtained for {subdomain}.")
-            else:
-                logger.error(f"Failed to obtain SSL certificate for {subdomain}.")
-                print(Fore.RED + f"Failed to obtain SSL certificate for {subdomain}.")
+            details = {'target_ip': target_ip, 'target_port': target_port, 'custom_options': custom_options}
+            if input("Do you want to load-balance over more backends? (y/n): ").strip().lower() == 'y':
+                details = manage_backends(details)
 
-            # Reload Nginx
-            reload_nginx()
+            # Update config.yaml, write the Nginx config, obtain the certificate and reload
+            with profile_operation('menu create'):
+                summary = apply_batch(config, [(subdomain, details)])
+            print_summary(summary)
 
-            print(Fore.GREEN + f"Nginx configuration and SSL setup for {subdomain} complete!")
-            logger.info(f"Nginx configuration and SSL setup for {subdomain} complete!")
+            if summary['ok']:
+                print(Fore.GREEN + f"Nginx configuration and SSL setup for {subdomain} complete!")
+                logger.info(f"Nginx configuration and SSL setup for {subdomain} complete!")
 
         elif choice == '2':
             # Edit an existing subdomain
@@ -80,83 +67,57 @@ def main_menu(config, version):
                 print(Fore.YELLOW + "No subdomains available to edit.")
                 continue
             print("\nSelect the subdomain to edit:")
-            for idx, sub in enumerate(subdomains, 1):
-                print(f"{idx}) {sub}")
-            selection = input("Enter the number of the subdomain you want to edit (or 'q' to go back): ").strip()
-            if selection.lower() == 'q':
+            from domain_manager.utils.health import health_label, load_health_state
+            health_state = load_health_state(config)
+            subdomain = pick_subdomain(subdomains, 'edit', lambda sub: health_label(config, sub, health_state))
+            if subdomain is None:
                 print(Fore.YELLOW + "Edit cancelled.")
                 continue
-            try:
-                idx = int(selection) - 1
-                if idx < 0 or idx >= len(subdomains):
-                    raise ValueError
-                subdomain = subdomains[idx]
-                details = get_subdomain_details(config, idx)
-                if not details:
-                    print(Fore.RED + "Invalid selection. Please try again.")
-                    continue
-                current_ip, current_port, custom_options = details
-                print(f"\nEditing subdomain: {subdomain}")
+            details = config['subdomains'].get(subdomain)
+            if not details:
+                print(Fore.RED + f"{subdomain} is not in the configuration. Use Settings to add it.")
+                continue
+            current_ip = details.get('target_ip')
+            current_port = details.get('target_port')
+            custom_options = details.get('custom_options', [])
+            print(f"\nEditing subdomain: {subdomain}")
+            if details.get('backends'):
+                # Load-balanced: the backends are edited as a whole, target_ip/target_port follow them
+                new_ip, new_port = current_ip, current_port
+            else:
                 new_ip = input(f"Enter the new internal IP address [{current_ip}]: ").strip() or current_ip
                 new_port = input(f"Enter the new port [{current_port}]: ").strip() or current_port
 
-                # Update custom options
-                update_custom = input("Do you want to update custom Nginx options? (y/n): ").strip().lower()
-                if update_custom == 'y':
-                    custom_options = []
-                    add_custom = input("Enter custom Nginx directive (leave blank to stop): ").strip()
-                    while add_custom:
-                        custom_options.append(add_custom)
-                        add_custom = input("Enter another custom Nginx directive (leave blank to stop): ").strip()
-
-                # Update config.yaml
-                config['subdomains'][subdomain] = {
-                    'target_ip': new_ip,
-                    'target_port': new_port,
-                    'custom_options': custom_options
-                }
-                with open(os.path.join(os.path.dirname(__file__), '..', 'config.yaml'), 'w') as f:
-                    import yaml
-                    yaml.dump(config, f)
-
-                # Recreate Nginx config
-                create_nginx_config(subdomain, new_ip, new_port, custom_options, logger)
-
-                # Obtain SSL certificate
-                success = obtain_certificate(subdomain)
-                if success:
-                    logger.info(f"SSL certificate obtained for {subdomain}.")
-                    print(Fore.GREEN + f"SSL certificate obtained for {subdomain}.")
-                else:
-                    logger.error(f"Failed to obtain SSL certificate for {subdomain}.")
-                    print(Fore.RED + f"Failed to obtain SSL certificate for {subdomain}.")
-
-                # Reload Nginx
-                reload_nginx()
-
+            # Update custom options
+            update_custom = input("Do you want to update custom Nginx options? (y/n): ").strip().lower()
+            if update_custom == 'y':
+                custom_options = []
+                add_custom = input("Enter custom Nginx directive (leave blank to stop): ").strip()
+                while add_custom:
+                    custom_options.append(add_custom)
+                    add_custom = input("Enter another custom Nginx directive (leave blank to stop): ").strip()
+
+            new_details = {**details, 'target_ip': new_ip, 'target_port': new_port, 'custom_options': custom_options}
+            if input("Do you want to add, drain or remove backends? (y/n): ").strip().lower() == 'y':
+                new_details = manage_backends(new_details)
+
+            # Update config.yaml, recreate the Nginx config and reload
+            with profile_operation('menu edit'):
+                summary = apply_batch(config, [(subdomain, new_details)])
+            print_summary(summary)
+
+            if summary['ok']:
                 print(Fore.GREEN + f"Nginx configuration and SSL setup for {subdomain} updated!")
                 logger.info(f"Nginx configuration and SSL setup for {subdomain} updated!")
 
-            except (ValueError, IndexError):
-                print(Fore.RED + "Invalid selection. Please try again.")
-
         elif choice == '3':
             # Update existing domains
             print(Fore.YELLOW + "Updating SSL certificates for all existing domains...")
-            subdomains = list_subdomains(config)
-            if not subdomains:
+            with profile_operation('menu renew'):
+                renewed = renew_certificates(config, logger)
+            if not renewed:
                 print(Fore.YELLOW + "No subdomains available to update.")
                 continue
-            for sub in subdomains:
-                print(f"Updating SSL certificate for {sub}...")
-                success = obtain_certificate(sub)
-                if success:
-                    logger.info(f"SSL certificate updated for {sub}.")
-                    print(Fore.GREEN + f"SSL certificate updated for {sub}.")
-                else:
-                    logger.error(f"Failed to update SSL certificate for {sub}.")
-                    print(Fore.RED + f"Failed to update SSL certificate for {sub}.")
-            reload_nginx()
             print(Fore.GREEN + "All SSL certificates updated.")
             logger.info("All SSL certificates updated.")
 
@@ -167,37 +128,24 @@ def main_menu(config, version):
                 print(Fore.YELLOW + "No subdomains available to delete.")
                 continue
             print("\nSelect the subdomain to delete:")
-            for idx, sub in enumerate(subdomains, 1):
-                print(f"{idx}) {sub}")
-            selection = input("Enter the number of the subdomain you want to delete (or 'q' to go back): ").strip()
-            if selection.lower() == 'q':
+            from domain_manager.utils.health import health_label, load_health_state
+            health_state = load_health_state(config)
+            subdomain = pick_subdomain(subdomains, 'delete', lambda sub: health_label(config, sub, health_state))
+            if subdomain is None:
                 print(Fore.YELLOW + "Deletion cancelled.")
                 continue
-            try:
-                idx = int(selection) - 1
-                if idx < 0 or idx >= len(subdomains):
-                    raise ValueError
-                subdomain = subdomains[idx]
-                confirmation = input(
-                    f"Are you sure you want to delete the subdomain {subdomain}? This action cannot be undone. (yes/no): ").strip().lower()
-                if confirmation != 'yes':
-                    print(Fore.YELLOW + "Deletion cancelled.")
-                    continue
-                # Remove from config.yaml
-                del config['subdomains'][subdomain]
-                with open(os.path.join(os.path.dirname(__file__), '..', 'config.yaml'), 'w') as f:
-                    import yaml
-                    yaml.dump(config, f)
-                # Delete Nginx config
-                delete_nginx_config(subdomain, logger)
-                # Delete SSL certificates
-                delete_ssl_certificate(subdomain, logger)
-                # Reload Nginx
-                reload_nginx()
+            confirmation = input(
+                f"Are you sure you want to delete the subdomain {subdomain}? This action cannot be undone. (yes/no): ").strip().lower()
+            if confirmation != 'yes':
+                print(Fore.YELLOW + "Deletion cancelled.")
+                continue
+            # Remove from config.yaml, delete the Nginx config and SSL certificate, reload
+            with profile_operation('menu delete'):
+                summary = apply_batch(config, [(subdomain, {'state': ABSENT})])
+            print_summary(summary)
+            if summary['ok']:
                 print(Fore.GREEN + f"Subdomain {subdomain} deleted successfully.")
                 logger.info(f"Subdomain {subdomain} deleted successfully.")
-            except (ValueError, IndexError):
-                print(Fore.RED + "Invalid selection. Please try again.")
 
         elif choice == '5':
             # Settings Menu
@@ -219,7 +167,7 @@ def main_menu(config, version):
 
                 elif sub_choice == '2':
                     # View changelog
-                    show_changelog(logger)
+                    show_changelog(logger, config)
 
                 elif sub_choice == '3':
                     # Configure settings
@@ -227,13 +175,14 @@ def main_menu(config, version):
 
                 elif sub_choice == '4':
                     # Check for updates
-                    check_for_updates()
+                    check_for_updates(config, force=True)
                     break
 
                 elif sub_choice == '5':
                     # Fix Nginx Configuration and SSL Certificates
                     print("Fixing Nginx configuration and handling SSL certificate issues...")
-                    fix_nginx_configuration(config, logger)
+                    with profile_operation('menu fix'):
+                        fix_nginx_configuration(config, logger)
                     print(Fore.GREEN + "Nginx configuration and SSL certificates fixed.")
                     logger.info("Nginx configuration and SSL certificates fixed.")
 
@@ -241,7 +190,8 @@ def main_menu(config, version):
                     # Reset All Configurations
                     confirm = input(Fore.RED + "Are you sure you want to reset all Nginx configurations? This will delete all existing configurations and recreate them based on the current settings. (yes/no): ").strip().lower()
                     if confirm == 'yes':
-                        reset_all_configurations(config, logger)
+                        with profile_operation('menu reset'):
+                            reset_all_configurations(config, logger)
                         print(Fore.GREEN + "All Nginx configurations have been reset.")
                         logger.info("All Nginx configurations have been reset.")
                     else:
@@ -268,6 +218,57 @@ def main_menu(config, version):
         input("Press Enter to return to the main menu...")
         clear_terminal()
         display_startup(version)
+        show_update_notice(version)
+
+def manage_backends(details):
+    """
+    Prompt for changes to a subdomain's load-balanced backends.
+
+    Changes only take effect when the caller applies the returned entry, so a
+    drained backend finishes its in-flight requests after the reload.
+
+    Returns:
+        dict: The updated registry entry.
+    """
+    from domain_manager.utils.upstreams import (
+        BALANCE_METHODS, add_backend, backends_of, format_backend, remove_backend, set_drain
+    )
+
+    while True:
+        backends = backends_of(details)
+        if backends:
+            print(f"\nBackends (balance: {details.get('balance') or 'round_robin'}):")
+            for backend in backends:
+                print(f"  {format_backend(backend)}")
+        print("a) Add or replace a backend  d) Drain  u) Undrain  r) Remove  b) Balancing method")
+        action = input("Choose an action (leave blank to finish): ").strip().lower()
+        if not action:
+            return details
+        try:
+            if action == 'a':
+                spec = input("Enter the backend as IP:PORT [weight=N] [max_fails=N] [fail_timeout=T] [backup]: ")
+                details = add_backend(details, spec.strip())
+            elif action in ('d', 'u', 'r'):
+                address = input("Enter the backend IP:PORT: ").strip()
+                if action == 'r':
+                    details = remove_backend(details, address)
+                else:
+                    details = set_drain(details, address, drain=action == 'd')
+            elif action == 'b':
+                method = input(f"Enter the balancing method ({', '.join(BALANCE_METHODS)}): ").strip()
+                if method not in BALANCE_METHODS:
+                    print(Fore.RED + f"Unknown balancing method: {method}")
+                    continue
+                details = {**details, 'balance': method}
+                if method == 'hash':
+                    key = input("Enter the hash key [$request_uri]: ").strip()
+                    if key:
+                        details['hash_key'] = key
+            else:
+                print(Fore.RED + "Invalid option.")
+        except ValueError as e:
+            print(Fore.RED + str(e))
+
 
 def clear_terminal():
     """Clear the terminal screen."""
@@ -281,3 +282,11 @@ def display_startup(version):
     =========================================
     """
     print(Fore.CYAN + banner)
+
+
+def show_update_notice(version):
+    """Mention a newer release once the background lookup has found one."""
+    latest_version = update_available(version)
+    if latest_version:
+        print(Fore.YELLOW + f"A new version ({latest_version}) is available. "
+                            f"Use Settings > Check for updates to install it.")
@@ -4,44 +4,298 @@ import subprocess
 import sys
 
 from colorama import Fore
-from domain_manager.utils.backup import backup_config
+from domain_manager.instances import nginx_reload_command, nginx_test_command, sites_available_dir, sites_enabled_dir
+from domain_manager.logger import log_span
+from domain_manager.utils.acme import clear_reload_pending
+from domain_manager.utils.locks import nginx_lock
+from domain_manager.utils.vhost_layout import (
+    APEX_FILE_SUFFIX, apex_layout, apex_subdomains, read_block, remove_block, vhost_file_name, write_block,
+    write_blocks
+)
+
+
+LETSENCRYPT_LIVE_DIR = "/etc/letsencrypt/live"
 
 
 # Obtain SSL Certificate
-def obtain_certificate(subdomain):
+def obtain_certificate(subdomain, install=True, quiet=False, config=None):
     """
     Obtain or renew SSL certificate for a given subdomain using Certbot.
 
     Args:
         subdomain (str): The subdomain to obtain the certificate for.
+        install (bool): Let Certbot install the certificate into the Nginx
+            configuration (with an HTTP->HTTPS redirect). When False the
+            certificate is only obtained (`certbot certonly`) because the
+            generated configuration already references it.
+        quiet (bool): Capture Certbot's output instead of printing it.
+        config (dict, optional): Configuration, for the `acme` settings. In
+            webroot mode Certbot never touches the Nginx configuration and
+            only queues a reload (see utils/acme.py).
 
     Returns:
         bool: True if certificate was obtained successfully, False otherwise.
     """
-    import subprocess
-    from colorama import Fore
+    from domain_manager.utils.acme import certbot_command
 
+    command = certbot_command(config, subdomain, install)
+    output = subprocess.PIPE if quiet else None
     try:
         # Run certbot to obtain/renew the certificate
-        subprocess.check_call([
-            'certbot', '--nginx', '-d', subdomain,
-            '--redirect', '--agree-tos', '--no-eff-email', '--non-interactive'
-        ])
+        with log_span('certbot', subdomain):
+            subprocess.run(command, check=True, stdout=output, stderr=output, universal_newlines=True)
         return True
-    except subprocess.CalledProcessError as e:
-        print(Fore.RED + f"Failed to obtain SSL certificate for {subdomain}: {e}")
-        logging.error(f"Failed to obtain SSL certificate for {subdomain}: {e}")
+    except (subprocess.CalledProcessError, OSError) as e:
+        detail = _last_line(getattr(e, 'stderr', None)) or str(e)
+        if not quiet:
+            print(Fore.RED + f"Failed to obtain SSL certificate for {subdomain}: {e}")
+        logging.error(f"Failed to obtain SSL certificate for {subdomain}: {detail}")
         return False
 
 
+def _last_line(text):
+    """Return the last non-empty line of command output, if any."""
+    lines = [line for line in (text or '').splitlines() if line.strip()]
+    return lines[-1].strip() if lines else ''
+
+
+def vhost_paths(config, subdomain):
+    """
+    Return the sites-available and sites-enabled paths of a subdomain's configuration.
+
+    In the apex layout these are the paths of the apex file that holds the
+    subdomain's vhost, shared with the apex's other subdomains.
+
+    Args:
+        config (dict): Configuration dictionary.
+        subdomain (str): The subdomain.
+
+    Returns:
+        tuple: (available_path, enabled_path)
+    """
+    filename = vhost_file_name(config, subdomain)
+    return (os.path.join(sites_available_dir(config), filename),
+            os.path.join(sites_enabled_dir(config), filename))
+
+
+def read_vhost(config, subdomain):
+    """Return a subdomain's configuration content, or None if it has none."""
+    available_path = vhost_paths(config, subdomain)[0]
+    if apex_layout(config):
+        return read_block(available_path, subdomain)
+    try:
+        with open(available_path, 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def vhost_exists(config, subdomain):
+    """Return True if a subdomain has a configuration in sites-available."""
+    if apex_layout(config):
+        return read_vhost(config, subdomain) is not None
+    return os.path.exists(vhost_paths(config, subdomain)[0])
+
+
+def vhost_up_to_date(config, subdomain, details):
+    """Return True if a subdomain's configuration on disk is what write_vhost would write for `details`."""
+    from domain_manager.utils.nginx_config import render_vhost
+
+    current = read_vhost(config, subdomain)
+    if current is None:
+        return False
+    content = render_vhost(config, subdomain, details, ssl=certificate_exists(subdomain))
+    return current.rstrip('\n') == content.rstrip('\n')
+
+
+def certificate_exists(subdomain):
+    """Return True if Let's Encrypt has issued a certificate and key for the subdomain."""
+    live_dir = os.path.join(LETSENCRYPT_LIVE_DIR, subdomain)
+    return (os.path.exists(os.path.join(live_dir, 'fullchain.pem'))
+            and os.path.exists(os.path.join(live_dir, 'privkey.pem')))
+
+
+def write_vhost(config, subdomain, details, ssl=None):
+    """
+    Render a subdomain's configuration, write it to sites-available and enable it.
+
+    The file is written atomically and left untouched when the rendered
+    content is unchanged.
+
+    Args:
+        config (dict): Configuration dictionary.
+        subdomain (str): The subdomain.
+        details (dict): Registry entry.
+        ssl (bool, optional): Render the HTTPS variant; defaults to whether a
+            certificate already exists.
+
+    Returns:
+        bool: True if the file content changed.
+    """
+    from domain_manager.utils.nginx_config import render_vhost
+
+    if ssl is None:
+        ssl = certificate_exists(subdomain)
+    available_path, enabled_path = vhost_paths(config, subdomain)
+    with log_span('render', subdomain):
+        content = render_vhost(config, subdomain, details, ssl=ssl)
+
+    if apex_layout(config):
+        with log_span('write', subdomain):
+            changed = write_block(config, available_path, subdomain, content)
+        if not os.path.lexists(enabled_path):
+            os.symlink(available_path, enabled_path)
+        return changed
+
+    changed = True
+    try:
+        with open(available_path, 'r') as f:
+            changed = f.read() != content
+    except OSError:
+        pass
+    if changed:
+        with log_span('write', subdomain):
+            tmp_path = f"{available_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, available_path)
+    if not os.path.lexists(enabled_path):
+        os.symlink(available_path, enabled_path)
+    return changed
+
+
+def write_vhosts(config, entries, ssl=None):
+    """
+    Write several subdomains' configurations, as write_vhost does.
+
+    In the apex layout each apex file is read and written once for the
+    whole batch instead of once per subdomain.
+
+    Args:
+        config (dict): Configuration dictionary.
+        entries (dict): subdomain -> registry entry.
+        ssl (bool, optional): See write_vhost.
+
+    Returns:
+        dict: subdomain -> True if its content changed.
+    """
+    from domain_manager.utils.nginx_config import render_vhost
+
+    if not apex_layout(config):
+        return {subdomain: write_vhost(config, subdomain, details, ssl=ssl) for subdomain, details in entries.items()}
+    grouped = {}
+    for subdomain, details in entries.items():
+        with log_span('render', subdomain):
+            content = render_vhost(config, subdomain, details,
+                                   ssl=certificate_exists(subdomain) if ssl is None else ssl)
+        grouped.setdefault(vhost_paths(config, subdomain), {})[subdomain] = content
+    changed = {}
+    for (available_path, enabled_path), blocks in grouped.items():
+        with log_span('write'):
+            changed.update(write_blocks(config, available_path, blocks))
+        if not os.path.lexists(enabled_path):
+            os.symlink(available_path, enabled_path)
+    return changed
+
+
+def remove_vhost(config, subdomain):
+    """
+    Disable and remove a subdomain's configuration files.
+
+    In the apex layout the subdomain's block is removed from its apex file,
+    and the file is disabled and removed once it holds no vhost. A
+    per-subdomain file left over from the other layout is removed as well.
+
+    Returns:
+        bool: True if anything was removed.
+    """
+    removed = False
+    filename = f"{subdomain}.conf"
+    paths = [os.path.join(sites_enabled_dir(config), filename),
+             os.path.join(sites_available_dir(config), filename)]
+    if apex_layout(config):
+        available_path, enabled_path = vhost_paths(config, subdomain)
+        removed = remove_block(config, available_path, subdomain)
+        if not os.path.exists(available_path):
+            paths.append(enabled_path)
+    for path in paths:
+        if os.path.lexists(path):
+            os.remove(path)
+            removed = True
+    return removed
+
+
+def delete_ssl_certificate(subdomain, quiet=False):
+    """
+    Delete a subdomain's certificate lineage with Certbot, if it has one.
+
+    Returns:
+        bool: True if a certificate was deleted or none existed.
+    """
+    if not os.path.isdir(os.path.join(LETSENCRYPT_LIVE_DIR, subdomain)):
+        return True
+    output = subprocess.PIPE if quiet else None
+    try:
+        with log_span('certbot delete', subdomain):
+            subprocess.run(['certbot', 'delete', '--cert-name', subdomain, '--non-interactive'],
+                           check=True, stdout=output, stderr=output, universal_newlines=True)
+        logging.info(f"Deleted SSL certificate for {subdomain}")
+        return True
+    except (subprocess.CalledProcessError, OSError) as e:
+        logging.error(f"Failed to delete SSL certificate for {subdomain}: {_last_line(getattr(e, 'stderr', None)) or e}")
+        return False
+
+
+def test_nginx_config(quiet=False, config=None):
+    """
+    Run `nginx -t` (for the configured instance) without exiting on failure.
+
+    Returns:
+        tuple: (ok, output) where output holds the captured error text when quiet.
+    """
+    output = subprocess.PIPE if quiet else None
+    try:
+        with log_span('nginx -t'):
+            subprocess.run(nginx_test_command(config), check=True, stdout=output, stderr=output,
+                           universal_newlines=True)
+        return True, ''
+    except (subprocess.CalledProcessError, OSError) as e:
+        detail = (getattr(e, 'stderr', None) or str(e)).strip()
+        logging.error(f"Nginx configuration test failed: {detail}")
+        return False, detail
+
+
+def reload_nginx_service(quiet=False, config=None):
+    """
+    Reload Nginx without testing the configuration first or exiting on failure.
+
+    Returns:
+        tuple: (ok, output)
+    """
+    output = subprocess.PIPE if quiet else None
+    try:
+        with log_span('reload'):
+            subprocess.run(nginx_reload_command(config), check=True, stdout=output, stderr=output,
+                           universal_newlines=True)
+        logging.info("Nginx reloaded successfully.")
+        return True, ''
+    except (subprocess.CalledProcessError, OSError) as e:
+        detail = (getattr(e, 'stderr', None) or str(e)).strip()
+        logging.error(f"Nginx reload failed: {detail}")
+        return False, detail
+
 
 # Reload Nginx
-def reload_nginx():
+def reload_nginx(config=None):
     try:
-        print("Testing Nginx configuration...")
-        subprocess.run(['nginx', '-t'], check=True)
-        print("Nginx configuration test successful. Reloading Nginx...")
-        subprocess.run(['systemctl', 'reload', 'nginx'], check=True)
+        with nginx_lock(config):
+            print("Testing Nginx configuration...")
+            with log_span('nginx -t'):
+                subprocess.run(nginx_test_command(config), check=True)
+            print("Nginx configuration test successful. Reloading Nginx...")
+            with log_span('reload'):
+                subprocess.run(nginx_reload_command(config), check=True)
+            clear_reload_pending(config)
         print(Fore.GREEN + "Nginx reloaded successfully.")
         logging.info("Nginx reloaded successfully.")
     except subprocess.CalledProcessError as e:
@@ -50,9 +304,36 @@ def reload_nginx():
         sys.exit(1)
         
 
-def validate_nginx_config():
+def renew_certificates(config, logger=None):
+    """
+    Run Certbot for every enabled subdomain, then test and reload Nginx once.
+
+    The renewals run as a job run (see jobs.py): failures are retried with
+    backoff, and an interrupted renewal is continued by `resume` or the
+    next renewal instead of starting over.
+
+    Args:
+        config (dict): Configuration dictionary.
+        logger (logging.Logger, optional): Logger instance.
+
+    Returns:
+        dict: subdomain -> True if its certificate was renewed; empty if
+        there are no subdomains.
+    """
+    from domain_manager.jobs import DONE, print_run_summary, start_run
+
+    subdomains = list_subdomains(config)
+    if not subdomains:
+        return {}
+    summary = start_run(config, 'renew', [('certificate', sub) for sub in subdomains])
+    print_run_summary(summary)
+    return {sub: state == DONE for (action, sub), (state, _) in summary['jobs'].items()}
+
+
+def validate_nginx_config(config=None):
     try:
-        subprocess.run(['nginx', '-t'], check=True)
+        with log_span('nginx -t'):
+            subprocess.run(nginx_test_command(config), check=True)
         print(Fore.GREEN + "Nginx configuration is valid.")
         return True
     except subprocess.CalledProcessError as e:
@@ -72,15 +353,23 @@ def list_subdomains(config):
     Returns:
         list: List of subdomain strings.
     """
-    sites_enabled_dir = "/etc/nginx/sites-enabled/"
+    enabled_dir = sites_enabled_dir(config)
     subdomains = []
+    apex_files = []
     try:
-        for config_file in os.listdir(sites_enabled_dir):
-            config_path = os.path.join(sites_enabled_dir, config_file)
+        for config_file in os.listdir(enabled_dir):
+            config_path = os.path.join(enabled_dir, config_file)
             if os.path.isfile(config_path):
+                if config_file.endswith(APEX_FILE_SUFFIX):
+                    apex_files.append(config_file)
+                    continue
                 # Extract subdomain from config file name
                 # Assumes config file is named as subdomain.conf or similar
+                subdomain = config_file[:-len('.conf')] if config_file.endswith('.conf') else config_file
                 subdomains.append(subdomain)
+        if apex_files:
+            # Apex files hold several vhosts each (see utils/vhost_layout.py)
+            subdomains = list(dict.fromkeys(subdomains + apex_subdomains(config, enabled_dir, apex_files)))
     except Exception as e:
         logging.error(f"Failed to list subdomains: {e}")
     return subdomains
@@ -88,22 +377,31 @@ def list_subdomains(config):
 
 # Extract IP and Port from Nginx Config
 def extract_ip_port(config, subdomain):
-    config_path = os.path.join(config['sites_available'], subdomain)
     target_ip = "Not found"
     target_port = "Not found"
     try:
-        with open(config_path, 'r') as f:
-            for line in f:
-                if 'proxy_pass' in line:
-                    # Example: proxy_pass http://192.168.0.215:8080;
-                    parts = line.strip().split()
-                    if len(parts) >= 2:
-                        url = parts[1].replace(';', '')
-                        if url.startswith('http://'):
-                            url = url.replace('http://', '')
-                        ip_port = url.split(':')
-                        if len(ip_port) == 2:
-                            target_ip, target_port = ip_port
+        content = read_vhost(config, subdomain)
+        if content is None:
+            raise FileNotFoundError(vhost_paths(config, subdomain)[0])
+        servers = []
+        for line in content.splitlines():
+            words = line.split()
+            if words[:1] == ['server'] and len(words) >= 2 and not {'backup', 'down;', 'backup;'} & set(words):
+                # Member of a load-balanced subdomain's upstream block
+                servers.append(words[1].rstrip(';'))
+            if 'proxy_pass' in line:
+                # Example: proxy_pass http://192.168.0.215:8080;
+                parts = line.strip().split()
+                if len(parts) >= 2:
+                    url = parts[1].replace(';', '')
+                    if url.startswith('http://'):
+                        url = url.replace('http://', '')
+                    if ':' not in url and servers:
+                        # proxy_pass http://dm_app.example.com; the first active member is the primary
+                        url = servers[0]
+                    ip_port = url.split(':')
+                    if len(ip_port) == 2:
+                        target_ip, target_port = ip_port
     except Exception as e:
         logging.error(f"Error reading Nginx config for {subdomain}: {e}")
     return target_ip, target_port
@@ -123,42 +421,3 @@ def get_subdomain_details(config, selection):
         return sub, target_ip, target_port
     except (ValueError, IndexError):
         return None
-
-
-# Delete Subdomain
-def delete_subdomain(config, subdomain):
-    config_path = os.path.join(config['sites_available'], subdomain)
-    enabled_path = os.path.join(config['sites_enabled'], subdomain)
-
-    # Backup before deletion
-    backup_config(config, config_path)
-
-    # Remove config files
-    try:
-        os.remove(config_path)
-        if os.path.islink(enabled_path):
-            os.remove(enabled_path)
-        logging.info(f"Removed Nginx configuration for {subdomain}")
-    except Exception as e:
-        print(Fore.RED + f"Failed to remove Nginx configuration: {e}")
-        logging.error(f"Failed to remove Nginx configuration for {subdomain}: {e}")
-        sys.exit(1)
-
-    # Remove SSL certificates
-    try:
-        certbot_output = subprocess.getoutput(['certbot', 'certificates'])
-        if f"Domains: {subdomain}" in certbot_output:
-            subprocess.run(['certbot', 'delete', '--cert-name', subdomain, '--non-interactive'], check=True)
-            logging.info(f"Deleted SSL certificate for {subdomain}")
-            print(Fore.GREEN + f"Deleted SSL certificate for {subdomain}")
-        else:
-            print(Fore.YELLOW + f"No SSL certificate found for {subdomain}.")
-            logging.info(f"No SSL certificate found for {subdomain}.")
-    except subprocess.CalledProcessError as e:
-        print(Fore.RED + f"Failed to delete SSL certificate for {subdomain}: {e}")
-        logging.error(f"Failed to delete SSL certificate for {subdomain}: {e}")
-
-    # Reload Nginx
-    reload_nginx()
-    print(Fore.GREEN + f"Subdomain {subdomain} has been deleted.")
-    logging.info(f"Subdomain {subdomain} has been deleted.")
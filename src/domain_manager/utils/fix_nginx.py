@@ -5,17 +5,28 @@ import os
 import subprocess
 from colorama import Fore, Style
 
-from domain_manager.utils.domain import list_subdomains, obtain_certificate, reload_nginx
-
-def backup_nginx_config(config_path, logger):
+from domain_manager.instances import nginx_reload_command, nginx_test_command, sites_enabled_dir
+from domain_manager.jobs import print_run_summary, queue_lock, start_run
+from domain_manager.logger import log_span
+from domain_manager.utils.acme import write_acme_snippet
+from domain_manager.utils.locks import nginx_lock
+from domain_manager.utils.vhost_layout import BEGIN_MARKER
+from domain_manager.utils.domain import certificate_exists, list_subdomains, reload_nginx
+
+def backup_nginx_config(config_path, logger, backup_dir=None):
     """
     Create a backup of the Nginx configuration file.
 
     Args:
         config_path (str): Path to the Nginx configuration file.
         logger (logging.Logger): Logger instance.
+        backup_dir (str, optional): Directory for the backup. Defaults to next
+            to the file, which for sites-enabled means Nginx would load it.
     """
     backup_path = f"{config_path}.backup"
+    if backup_dir:
+        os.makedirs(backup_dir, exist_ok=True)
+        backup_path = os.path.join(backup_dir, f"{os.path.basename(config_path)}.backup")
     try:
         subprocess.check_call(['cp', config_path, backup_path])
         logger.info(f"Backup created for {config_path} at {backup_path}.")
@@ -26,26 +37,42 @@ def backup_nginx_config(config_path, logger):
 
 def fix_nginx_configuration(config, logger):
     """
-    Fix Nginx configuration by removing redundant listen directives and obtaining missing SSL certificates.
+    Fix the Nginx configuration while holding the job queue lock, so no
+    other job run starts in the meantime. The exclusive Nginx lock is only
+    held while vhosts are rewritten, tested and reloaded.
+    """
+    with queue_lock(config):
+        with nginx_lock(config):
+            fixed = _fix_listen_directives(config, logger)
+        if fixed:
+            _obtain_missing_certificates(config, logger)
+
+
+def _fix_listen_directives(config, logger):
+    """
+    Remove redundant listen directives, then test and reload Nginx.
 
     Args:
         config (dict): Configuration dictionary.
         logger (logging.Logger): Logger instance.
+
+    Returns:
+        bool: True if Nginx was reloaded with the fixed configuration.
     """
     logger.info("Starting Nginx configuration fix process.")
     print(Fore.YELLOW + "Starting Nginx configuration fix process...")
 
     # Path to Nginx sites-enabled directory
-    sites_enabled_dir = "/etc/nginx/sites-enabled/"
+    enabled_dir = sites_enabled_dir(config)
 
-    if not os.path.isdir(sites_enabled_dir):
-        logger.error(f"Sites-enabled directory not found at {sites_enabled_dir}.")
-        print(Fore.RED + f"Sites-enabled directory not found at {sites_enabled_dir}.")
-        return
+    if not os.path.isdir(enabled_dir):
+        logger.error(f"Sites-enabled directory not found at {enabled_dir}.")
+        print(Fore.RED + f"Sites-enabled directory not found at {enabled_dir}.")
+        return False
 
     # Iterate through all configuration files in sites-enabled
-    for config_file in os.listdir(sites_enabled_dir):
-        config_path = os.path.join(sites_enabled_dir, config_file)
+    for config_file in os.listdir(enabled_dir):
+        config_path = os.path.join(enabled_dir, config_file)
         if not os.path.isfile(config_path):
             continue
 
@@ -53,7 +80,7 @@ def fix_nginx_configuration(config, logger):
         logger.info(f"Processing configuration for {subdomain}.")
 
         # Backup the configuration file before making changes
-        backup_nginx_config(config_path, logger)
+        backup_nginx_config(config_path, logger, config.get('backup_dir'))
 
         try:
             with open(config_path, 'r') as file:
@@ -63,6 +90,9 @@ def fix_nginx_configuration(config, logger):
             listen_directives = 0
             for line in lines:
                 stripped_line = line.strip()
+                if line.startswith(BEGIN_MARKER):
+                    # Each vhost of an apex file is checked on its own
+                    listen_directives = 0
                 if stripped_line.startswith("listen 443 ssl;") or stripped_line.startswith("listen [::]:443 ssl;"):
                     listen_directives += 1
                     if listen_directives > 1:
@@ -84,53 +114,49 @@ def fix_nginx_configuration(config, logger):
 
     # After fixing configurations, test Nginx configuration
     try:
-        subprocess.check_call(['nginx', '-t'])
+        with log_span('nginx -t'):
+            subprocess.check_call(nginx_test_command(config))
         logger.info("Nginx configuration test passed.")
         print(Fore.GREEN + "Nginx configuration test passed.")
     except subprocess.CalledProcessError as e:
         logger.error(f"Nginx configuration test failed: {e}")
         print(Fore.RED + "Nginx configuration test failed. Please check the log for details.")
-        return
+        return False
 
     # Reload Nginx to apply changes
     try:
-        subprocess.check_call(['systemctl', 'reload', 'nginx'])
+        with log_span('reload'):
+            subprocess.check_call(nginx_reload_command(config))
         logger.info("Nginx reloaded successfully.")
         print(Fore.GREEN + "Nginx reloaded successfully.")
     except subprocess.CalledProcessError as e:
         logger.error(f"Failed to reload Nginx: {e}")
         print(Fore.RED + "Failed to reload Nginx. Please check the log for details.")
-        return
+        return False
+    return True
 
+
+def _obtain_missing_certificates(config, logger):
+    """Obtain the certificates of subdomains that have none, as a job run."""
     # Handle missing SSL certificates
+    with nginx_lock(config):
+        write_acme_snippet(config, logger)
     subdomains = list_subdomains(config)
     if not subdomains:
         logger.info("No subdomains found to handle SSL certificates.")
         print(Fore.YELLOW + "No subdomains found to handle SSL certificates.")
         return
 
+    missing = []
     for sub in subdomains:
-        cert_path = f"/etc/letsencrypt/live/{sub}/fullchain.pem"
-        key_path = f"/etc/letsencrypt/live/{sub}/privkey.pem"
-        if not os.path.exists(cert_path) or not os.path.exists(key_path):
+        if not certificate_exists(sub):
             logger.warning(f"Missing SSL certificates for {sub}. Attempting to obtain certificates.")
             print(Fore.YELLOW + f"Missing SSL certificates for {sub}. Attempting to obtain certificates...")
-            success = obtain_certificate(sub)
-            if success:
-                logger.info(f"SSL certificate obtained for {sub}.")
-                print(Fore.GREEN + f"SSL certificate obtained for {sub}.")
-            else:
-                logger.error(f"Failed to obtain SSL certificate for {sub}.")
-                print(Fore.RED + f"Failed to obtain SSL certificate for {sub}.")
+            missing.append(('certificate', sub))
         else:
             logger.info(f"SSL certificates already exist for {sub}.")
             print(Fore.GREEN + f"SSL certificates already exist for {sub}.")
 
-    # Final reload to apply any new certificates
-    try:
-        subprocess.check_call(['systemctl', 'reload', 'nginx'])
-        logger.info("Nginx reloaded successfully after SSL certificate updates.")
-        print(Fore.GREEN + "Nginx reloaded successfully after SSL certificate updates.")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to reload Nginx after SSL certificate updates: {e}")
-        print(Fore.RED + "Failed to reload Nginx after SSL certificate updates. Please check the log for details.")
+    # Obtain the missing certificates as a job run, which reloads Nginx once at the end
+    if missing:
+        print_run_summary(start_run(config, 'fix', missing, locked=True))
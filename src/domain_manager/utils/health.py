@@ -0,0 +1,258 @@
+# domain_manager/utils/health.py
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from colorama import Fore
+
+from domain_manager.utils.upstreams import entry_backends
+
+DEFAULT_STATE_DIR = '/var/lib/nginx_domain_manager'
+HEALTH_STATE_FILE = 'health.json'
+
+DEFAULT_HEALTH = {
+    'timeout': 2.0,
+    'concurrency': 500,
+    'http': False,
+    'http_path': '/',
+}
+
+
+def health_settings(config):
+    """Return health check settings from config.yaml merged over the defaults."""
+    settings = dict(DEFAULT_HEALTH)
+    settings.update(config.get('health') or {})
+    return settings
+
+
+def collect_backends(config, subdomains=None):
+    """
+    Group configured subdomains by backend.
+
+    Every member of a load-balanced subdomain is included, except drained ones.
+
+    Args:
+        config (dict): Configuration dictionary.
+        subdomains (list, optional): Only include these subdomains.
+
+    Returns:
+        dict: (target_ip, target_port) -> list of subdomains using that backend.
+    """
+    backends = {}
+    for subdomain, details in config.get('subdomains', {}).items():
+        if subdomains and subdomain not in subdomains:
+            continue
+        for backend in entry_backends(details):
+            if not backend.get('drain'):
+                backends.setdefault((str(backend['ip']), str(backend['port'])), []).append(subdomain)
+    return backends
+
+
+async def probe_tcp(ip, port, timeout):
+    """
+    Open (and immediately close) a TCP connection to a backend.
+
+    Returns:
+        dict: Probe result with 'healthy', 'latency_ms' and 'error'.
+    """
+    start = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, int(port)), timeout)
+        writer.close()
+        return {'healthy': True, 'latency_ms': (time.perf_counter() - start) * 1000, 'error': None}
+    except asyncio.TimeoutError:
+        return {'healthy': False, 'latency_ms': None, 'error': f"timeout after {timeout}s"}
+    except (OSError, ValueError) as e:
+        return {'healthy': False, 'latency_ms': None, 'error': str(e) or e.__class__.__name__}
+
+
+async def probe_http(ip, port, timeout, path='/'):
+    """
+    Send an HTTP HEAD request to a backend and read the status line.
+
+    Any response below 500 counts as healthy: the backend is up and
+    answering, even if it rejects an anonymous request.
+
+    Returns:
+        dict: Probe result with 'healthy', 'latency_ms', 'status' and 'error'.
+    """
+    start = time.perf_counter()
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, int(port)), timeout)
+        writer.write(f"HEAD {path} HTTP/1.0\r\nHost: {ip}\r\nConnection: close\r\n\r\n".encode())
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        parts = status_line.decode('latin-1').split()
+        if len(parts) < 2 or not parts[1].isdigit():
+            return {'healthy': False, 'latency_ms': None, 'status': None, 'error': 'invalid HTTP response'}
+        status = int(parts[1])
+        return {
+            'healthy': status < 500,
+            'latency_ms': (time.perf_counter() - start) * 1000,
+            'status': status,
+            'error': None if status < 500 else f"HTTP {status}",
+        }
+    except asyncio.TimeoutError:
+        return {'healthy': False, 'latency_ms': None, 'status': None, 'error': f"timeout after {timeout}s"}
+    except (OSError, ValueError) as e:
+        return {'healthy': False, 'latency_ms': None, 'status': None, 'error': str(e) or e.__class__.__name__}
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def _probe_all(backends, timeout, concurrency, http, http_path):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(backend):
+        ip, port = backend
+        async with semaphore:
+            if http:
+                result = await probe_http(ip, port, timeout, http_path)
+            else:
+                result = await probe_tcp(ip, port, timeout)
+        result['checked_at'] = time.time()
+        return backend, result
+
+    results = await asyncio.gather(*(probe(backend) for backend in backends))
+    return dict(results)
+
+
+def probe_backends(backends, timeout=DEFAULT_HEALTH['timeout'], concurrency=DEFAULT_HEALTH['concurrency'],
+                   http=False, http_path='/'):
+    """
+    Probe backends concurrently.
+
+    At most `concurrency` connections are open at once, and every probe is
+    bounded by `timeout`, so the total time is roughly
+    len(backends) / concurrency * timeout in the worst case.
+
+    Args:
+        backends (iterable): (ip, port) tuples.
+        timeout (float): Per-probe timeout in seconds.
+        concurrency (int): Maximum number of probes in flight.
+        http (bool): Send an HTTP HEAD request instead of a plain TCP connect.
+        http_path (str): Path used for HTTP probes.
+
+    Returns:
+        dict: (ip, port) -> probe result.
+    """
+    backends = list(backends)
+    if not backends:
+        return {}
+    return asyncio.run(_probe_all(backends, timeout, concurrency, http, http_path))
+
+
+def health_state_path(config):
+    return os.path.join(config.get('state_dir', DEFAULT_STATE_DIR), HEALTH_STATE_FILE)
+
+
+def save_health_state(config, results):
+    """Persist the latest probe results so the subdomain list can show them."""
+    path = health_state_path(config)
+    state = {f"{ip}:{port}": result for (ip, port), result in results.items()}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.error(f"Failed to save health state to {path}: {e}")
+
+
+def load_health_state(config):
+    """Load the latest probe results, keyed by 'ip:port'."""
+    try:
+        with open(health_state_path(config), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def health_label(config, subdomain, state):
+    """
+    Describe the last known health of a subdomain's backends for listings.
+
+    Args:
+        config (dict): Configuration dictionary.
+        subdomain (str): Subdomain to describe.
+        state (dict): Output of load_health_state.
+
+    Returns:
+        str: Colored status suffix, or an empty string if the backend was never probed.
+    """
+    details = config.get('subdomains', {}).get(subdomain)
+    if not details:
+        return ""
+    results = []
+    for backend in entry_backends(details):
+        result = state.get(f"{backend['ip']}:{backend['port']}")
+        if result and not backend.get('drain'):
+            results.append(result)
+    if not results:
+        return ""
+    up = sum(1 for result in results if result['healthy'])
+    if up == len(results):
+        return Fore.GREEN + " [up]" + Fore.RESET
+    if up:
+        return Fore.YELLOW + f" [{up}/{len(results)} up]" + Fore.RESET
+    return Fore.RED + f" [down: {results[0]['error']}]" + Fore.RESET
+
+
+def check_health(config, logger, subdomains=None, http=None, timeout=None, concurrency=None):
+    """
+    Probe the backends of all (or selected) subdomains and record the results.
+
+    Args:
+        config (dict): Configuration dictionary.
+        logger (logging.Logger): Logger instance.
+        subdomains (list, optional): Only check these subdomains.
+        http (bool, optional): Override the configured probe type.
+        timeout (float, optional): Override the configured timeout.
+        concurrency (int, optional): Override the configured concurrency.
+
+    Returns:
+        tuple: (backends, results) as returned by collect_backends and probe_backends.
+    """
+    settings = health_settings(config)
+    backends = collect_backends(config, subdomains)
+    start = time.perf_counter()
+    results = probe_backends(
+        backends,
+        timeout=timeout if timeout is not None else settings['timeout'],
+        concurrency=concurrency if concurrency is not None else settings['concurrency'],
+        http=http if http is not None else settings['http'],
+        http_path=settings['http_path'],
+    )
+    elapsed = time.perf_counter() - start
+    down = sum(1 for result in results.values() if not result['healthy'])
+    logger.info(f"Probed {len(results)} backends in {elapsed:.2f}s: {len(results) - down} up, {down} down.")
+    if subdomains:
+        # Keep previous results for backends that were not probed this time.
+        state = load_health_state(config)
+        state.update({f"{ip}:{port}": result for (ip, port), result in results.items()})
+        merged = {tuple(key.rsplit(':', 1)): value for key, value in state.items()}
+        save_health_state(config, merged)
+    else:
+        save_health_state(config, results)
+    return backends, results
+
+
+def print_health(backends, results):
+    """Print probe results, unhealthy backends first."""
+    ordered = sorted(results.items(), key=lambda item: (item[1]['healthy'], item[0]))
+    for (ip, port), result in ordered:
+        names = ', '.join(sorted(backends.get((ip, port), [])))
+        if result['healthy']:
+            status = result.get('status')
+            detail = f"{result['latency_ms']:.1f} ms" + (f", HTTP {status}" if status else "")
+            print(Fore.GREEN + f"UP    {ip}:{port:<6} ({detail})  {names}")
+        else:
+            print(Fore.RED + f"DOWN  {ip}:{port:<6} ({result['error']})  {names}")
+    down = sum(1 for result in results.values() if not result['healthy'])
+    color = Fore.GREEN if not down else Fore.RED
+    print(color + f"{len(results) - down} of {len(results)} backends healthy.")
@@ -0,0 +1,158 @@
+# domain_manager/utils/listeners.py
+
+"""
+HTTP/2, HTTP/3 and listen socket ownership.
+
+The `protocols` section turns on newer protocols for every generated
+HTTPS server:
+
+    http2: true       # `http2 on;` (Nginx 1.25.1+); `listen` puts it on the listen line instead
+    http3: true       # `listen 443 quic` next to `listen 443 ssl`, advertised with Alt-Svc
+
+Some listen parameters may appear on only one server per address:port,
+whichever vhost it is in: `reuseport` (which HTTP/3 needs so that QUIC
+packets reach the worker that owns the connection) and `default_server`.
+The tool therefore picks one vhost, the listener owner, and puts those
+parameters on its listen lines only. The owner is recorded in
+`<state_dir>/listener_owner.json`. It stays the owner while it exists and
+has a certificate. When it is deleted, the first remaining subdomain (by
+name) with a certificate takes over, and both vhosts are rewritten in the
+same batch. With `default_server: true` the owner also answers requests
+for unknown names; leave it off while another site (such as the
+distribution's `default` site) claims default_server.
+"""
+
+import json
+import os
+
+DEFAULT_STATE_DIR = '/var/lib/nginx_domain_manager'
+OWNER_FILE = 'listener_owner.json'
+
+DEFAULT_PROTOCOLS = {
+    'http2': False,
+    'http3': False,
+    'alt_svc_max_age': 86400,
+    'default_server': False,
+}
+
+_owner_cache = {}
+
+
+def protocol_settings(config):
+    """Return protocol settings from config.yaml merged over the defaults."""
+    settings = dict(DEFAULT_PROTOCOLS)
+    settings.update((config or {}).get('protocols') or {})
+    return settings
+
+
+def owner_needed(config):
+    """Whether any listen parameter must be owned by a single vhost."""
+    settings = protocol_settings(config)
+    return bool(settings['http3'] or settings['default_server'])
+
+
+def owner_path(config):
+    return os.path.join((config or {}).get('state_dir', DEFAULT_STATE_DIR), OWNER_FILE)
+
+
+def listener_owner(config):
+    """Return the subdomain owning the shared listen parameters, or None."""
+    if not owner_needed(config):
+        return None
+    path = owner_path(config)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _owner_cache.get(path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    try:
+        with open(path, 'r') as f:
+            owner = json.load(f).get('owner')
+    except (OSError, ValueError):
+        owner = None
+    _owner_cache[path] = (mtime_ns, owner)
+    return owner
+
+
+def save_listener_owner(config, subdomain):
+    """Record the listener owner (None forgets it)."""
+    path = owner_path(config)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'owner': subdomain}, f)
+    os.replace(tmp_path, path)
+
+
+def plan_listener_owner(config, registry):
+    """
+    Decide which vhost owns the shared listen parameters for a registry.
+
+    Args:
+        config (dict): Configuration dictionary.
+        registry (dict): The registry as it will be once the batch is applied.
+
+    Returns:
+        tuple: (current owner, new owner); either may be None.
+    """
+    from domain_manager.utils.domain import certificate_exists
+
+    current = listener_owner(config)
+    if not owner_needed(config):
+        return current, None
+    if current in registry and certificate_exists(current):
+        return current, current
+    return current, next((subdomain for subdomain in sorted(registry) if certificate_exists(subdomain)), None)
+
+
+def reassign_listener_owner(config, logger, registry=None):
+    """
+    Move ownership to another vhost if the owner is gone, rewriting the vhosts involved.
+
+    The caller holds the Nginx lock and tests and reloads afterwards.
+
+    Returns:
+        bool: True if the owner changed.
+    """
+    from domain_manager.utils.domain import write_vhosts
+
+    registry = (config.get('subdomains') or {}) if registry is None else registry
+    current, owner = plan_listener_owner(config, registry)
+    if owner == current:
+        return False
+    save_listener_owner(config, owner)
+    write_vhosts(config, {subdomain: registry[subdomain] for subdomain in (current, owner) if subdomain in registry})
+    logger.info(f"Listener owner changed from {current or 'none'} to {owner or 'none'}.")
+    return True
+
+
+def listen_config(config, subdomain):
+    """
+    Return the listen lines and headers of a subdomain's vhost.
+
+    Returns:
+        dict: 'http' and 'https' (listen lines of the HTTP and HTTPS
+        servers) and 'headers' (directives for the proxied HTTPS location),
+        or None when every protocol setting is at its default.
+    """
+    settings = protocol_settings(config)
+    owner = owner_needed(config) and listener_owner(config) == subdomain
+    if not (settings['http2'] or settings['http3'] or owner):
+        return None
+    default = ' default_server' if owner and settings['default_server'] else ''
+    ssl = ' ssl http2' if settings['http2'] == 'listen' else ' ssl'
+    https = [f"listen 443{ssl}{default};", f"listen [::]:443{ssl}{default};"]
+    headers = []
+    if settings['http3']:
+        reuseport = ' reuseport' if owner else ''
+        https += [f"listen 443 quic{reuseport}{default};", f"listen [::]:443 quic{reuseport}{default};"]
+        headers.append(f"add_header Alt-Svc 'h3=\":443\"; ma={settings['alt_svc_max_age']}' always;")
+    if settings['http2'] is True:
+        https.append("http2 on;")
+    return {
+        'http': [f"listen 80{default};", f"listen [::]:80{default};"],
+        'https': https,
+        'headers': headers,
+    }
@@ -0,0 +1,152 @@
+# domain_manager/utils/locks.py
+
+"""
+Advisory file locks that make concurrent runs safe.
+
+Three kinds of lock live in `<state_dir>/locks`:
+
+- per-subdomain locks, held for the whole time a run changes a
+  subdomain (vhost, certificate, registry entry). Subdomains are hashed
+  onto SUBDOMAIN_STRIPES lock files, so a batch of thousands of
+  subdomains never needs more than that many open files;
+- the registry lock, held briefly while config.yaml is re-read, merged
+  and rewritten;
+- the nginx tree lock. Vhost writers hold it shared, so writes to
+  different subdomains proceed in parallel. `nginx -t` followed by a
+  reload holds it exclusively, so the tested tree is the tree that is
+  reloaded.
+
+With named Nginx instances (see instances.py) each instance has its own
+subdomain and nginx tree locks, while the registry lock and the Certbot
+lock, which keeps instances from requesting the same certificate at
+once, live in the host-wide `<state_dir>/locks`.
+
+Callers that find a lock taken wait for it rather than failing. Locks
+are always taken in the order subdomains (sorted) -> Certbot -> nginx
+tree -> registry, which rules out deadlocks between runs.
+
+flock locks belong to an open file, not a process, so the same lock must
+not be taken twice (even from different threads) without releasing it.
+"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import zlib
+
+from colorama import Fore
+
+DEFAULT_STATE_DIR = '/var/lib/nginx_domain_manager'
+REGISTRY_LOCK = 'registry.lock'
+NGINX_LOCK = 'nginx.lock'
+CERTBOT_LOCK = 'certbot.lock'
+
+SUBDOMAIN_STRIPES = 256
+
+
+def lock_dir(config=None):
+    """Return the lock directory for a configuration (the default state dir without one)."""
+    state_dir = (config or {}).get('state_dir', DEFAULT_STATE_DIR)
+    return os.path.join(state_dir, 'locks')
+
+
+def shared_lock_dir(config=None):
+    """Return the host-wide lock directory, which differs from lock_dir only for an instance's configuration."""
+    config = config or {}
+    return os.path.join(config.get('shared_state_dir') or config.get('state_dir', DEFAULT_STATE_DIR), 'locks')
+
+
+def _holder(f):
+    f.seek(0)
+    pid = f.read().strip()
+    return f" (held by pid {pid})" if pid else ""
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False, description=None, quiet=False):
+    """
+    Hold an flock on `path`, waiting for other holders to release it.
+
+    Exclusive holders record their PID in the lock file so that waiters
+    can say who they are waiting for.
+
+    Args:
+        path (str): Lock file path; created if needed.
+        shared (bool): Take a shared lock instead of an exclusive one.
+        description (str, optional): What the lock protects, for the waiting message.
+        quiet (bool): Only log (at DEBUG level) that the caller is waiting.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    with open(path, 'a+') as f:
+        try:
+            fcntl.flock(f, mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            message = f"Waiting for the {description or os.path.basename(path)} lock{_holder(f)}..."
+            logging.debug(message)
+            if not quiet:
+                print(Fore.YELLOW + message)
+            fcntl.flock(f, mode)
+        try:
+            if not shared:
+                f.truncate(0)
+                f.write(str(os.getpid()))
+                f.flush()
+            yield
+        finally:
+            if not shared:
+                f.truncate(0)
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def registry_lock(config=None, quiet=False):
+    """Exclusive lock around reading, merging and rewriting config.yaml."""
+    return file_lock(os.path.join(shared_lock_dir(config), REGISTRY_LOCK), description='registry', quiet=quiet)
+
+
+def certbot_lock(config=None, quiet=False):
+    """
+    Lock serializing certificate requests of different instances.
+
+    Without instances it is a no-op, so `cert_workers` still runs Certbot in parallel.
+    """
+    if not (config or {}).get('instance'):
+        return contextlib.nullcontext()
+    return file_lock(os.path.join(shared_lock_dir(config), CERTBOT_LOCK), description='Certbot', quiet=quiet)
+
+
+def nginx_lock(config=None, shared=False, quiet=False):
+    """
+    Lock on the Nginx configuration tree.
+
+    Take it shared while writing vhost files and exclusively around
+    `nginx -t` and the reload that follows it.
+    """
+    return file_lock(os.path.join(lock_dir(config), NGINX_LOCK), shared=shared, description='Nginx configuration',
+                     quiet=quiet)
+
+
+@contextlib.contextmanager
+def subdomain_locks(config, subdomains, quiet=False):
+    """
+    Hold the per-subdomain locks of several subdomains.
+
+    Locks are taken in stripe order so that two runs touching overlapping
+    sets of subdomains cannot deadlock. In the apex layout the lock is
+    chosen by apex, since a batch may rewrite and roll back a whole apex file.
+    """
+    from domain_manager.utils.vhost_layout import apex_layout, apex_of
+
+    directory = os.path.join(lock_dir(config), 'subdomains')
+    # In the apex layout subdomains of one apex share a file, and so a lock
+    by_apex = apex_layout(config)
+    stripes = {}
+    for subdomain in subdomains:
+        key = apex_of(config, str(subdomain)) if by_apex else str(subdomain)
+        stripes.setdefault(zlib.crc32(key.encode()) % SUBDOMAIN_STRIPES, subdomain)
+    with contextlib.ExitStack() as stack:
+        for stripe in sorted(stripes):
+            stack.enter_context(file_lock(os.path.join(directory, f"{stripe:03d}.lock"),
+                                          description=f"subdomain {stripes[stripe]}", quiet=quiet))
+        yield
@@ -0,0 +1,152 @@
+# domain_manager/utils/nginx_config.py
+
+from domain_manager.utils.access_stats import ACCESS_LOG_FORMAT_NAME, access_log_path, access_log_settings
+from domain_manager.utils.acme import acme_snippet_path, ssl_snippet_path, webroot_mode
+from domain_manager.utils.listeners import listen_config
+from domain_manager.utils.rate_limits import limit_directives
+from domain_manager.utils.upstreams import upstream_config
+
+
+def generate_nginx_config(subdomain, target_ip, target_port, custom_options, access_log=None, ssl=True,
+                          acme_snippet=None, limits=None, upstream=None, listen=None, ssl_snippet=None):
+    """
+    Generate Nginx configuration content for a subdomain.
+
+    Args:
+        subdomain (str): The subdomain (e.g., app.example.com).
+        target_ip (str): Internal IP address of the target server.
+        target_port (str): Port on which the target service is running.
+        custom_options (list): List of custom Nginx directives.
+        access_log (dict, optional): Per-vhost access log settings from
+            access_log_settings(); omitted when None or disabled.
+        ssl (bool): Generate the HTTPS server with a redirect from HTTP. When
+            False (no certificate issued yet) a plain HTTP server is generated
+            so that `nginx -t` passes and the ACME challenge can be answered.
+        acme_snippet (str, optional): Path of the ACME challenge snippet to
+            include in the HTTP server (webroot mode).
+        limits (list, optional): limit_req/limit_conn directives for the
+            proxied location, from rate_limits.limit_directives().
+        upstream (tuple, optional): (name, block) from upstreams.upstream_config().
+            The block is emitted before the servers, which proxy to it instead
+            of target_ip:target_port.
+        listen (dict, optional): Listen lines and headers from
+            listeners.listen_config(); plain `listen 80`/`listen 443 ssl`
+            when None.
+        ssl_snippet (str, optional): Path of the TLS settings snippet to
+            include in the HTTPS server (webroot mode). When None, the files
+            Certbot's nginx plugin installs are included; False leaves the
+            TLS settings to the http context.
+
+    Returns:
+        str: Nginx configuration content.
+    """
+    location_directives = list(limits or []) + list(custom_options)
+    custom_directives = "".join([f'\n        {option}' for option in location_directives])
+    listen = listen or {}
+    http_listen = "\n    ".join(listen.get('http') or ["listen 80;", "listen [::]:80;"])
+    https_listen = "\n    ".join(listen.get('https') or ["listen 443 ssl;", "listen [::]:443 ssl;"])
+    access_log_directive = ""
+    if access_log and access_log.get('enabled'):
+        access_log_directive = (
+            f"\n    access_log {access_log_path(access_log, subdomain)} {ACCESS_LOG_FORMAT_NAME}"
+            f" buffer={access_log['buffer']} flush={access_log['flush']};\n"
+        )
+    acme_include = f"\n    include {acme_snippet};\n" if acme_snippet else ""
+    proxy_target = f"{target_ip}:{target_port}"
+    upstream_block = ""
+    if upstream:
+        proxy_target, upstream_block = upstream
+    if not ssl:
+        return f"""{upstream_block}
+server {{
+    {http_listen}
+    server_name {subdomain};
+    {acme_include}{access_log_directive}
+    location / {{
+        proxy_pass http://{proxy_target};
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        {custom_directives}
+    }}
+}}
+"""
+
+    if acme_snippet:
+        # A server-level return would also redirect the ACME challenge
+        redirect = f"""{acme_include}
+    # Redirect all other HTTP requests to HTTPS
+    location / {{
+        return 301 https://$host$request_uri;
+    }}"""
+    else:
+        redirect = """
+    # Redirect all HTTP requests to HTTPS
+    return 301 https://$host$request_uri;"""
+    if ssl_snippet:
+        ssl_settings = f"include {ssl_snippet};"
+    elif ssl_snippet is False:
+        ssl_settings = ""
+    else:
+        ssl_settings = ("include /etc/letsencrypt/options-ssl-nginx.conf; # managed by Certbot\n"
+                        "    ssl_dhparam /etc/letsencrypt/ssl-dhparams.pem; # managed by Certbot")
+    if listen.get('headers'):
+        custom_directives = "".join([f'\n        {option}' for option in listen['headers'] + location_directives])
+    config = f"""{upstream_block}
+server {{
+    {http_listen}
+    server_name {subdomain};
+    {redirect}
+}}
+
+server {{
+    {https_listen}
+    server_name {subdomain};
+    
+    ssl_certificate /etc/letsencrypt/live/{subdomain}/fullchain.pem;
+    ssl_certificate_key /etc/letsencrypt/live/{subdomain}/privkey.pem;
+    {ssl_settings}
+    {access_log_directive}
+    location / {{
+        proxy_pass http://{proxy_target};
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        {custom_directives}
+    }}
+}}
+"""
+    return config
+
+
+def render_vhost(config, subdomain, details, ssl=True, node=False):
+    """
+    Render the configuration for a registry entry.
+
+    Args:
+        config (dict): Configuration dictionary.
+        subdomain (str): The subdomain.
+        details (dict): Registry entry ('target_ip', 'target_port', 'custom_options', ...).
+        ssl (bool): See generate_nginx_config.
+        node (bool): Render for a fleet node (see fleet.py). Nodes never
+            answer ACME challenges and have none of this host's snippets;
+            their TLS settings are pushed as an http-level file.
+
+    Returns:
+        str: Nginx configuration content.
+    """
+    return generate_nginx_config(
+        subdomain,
+        details.get('target_ip'),
+        details.get('target_port'),
+        details.get('custom_options') or [],
+        access_log_settings(config, details),
+        ssl=ssl,
+        acme_snippet=acme_snippet_path(config) if webroot_mode(config) and not node else None,
+        limits=limit_directives(config, details),
+        upstream=upstream_config(subdomain, details),
+        listen=listen_config(config, subdomain),
+        ssl_snippet=False if node else ssl_snippet_path(config) if webroot_mode(config) else None,
+    )
@@ -0,0 +1,166 @@
+# domain_manager/utils/picker.py
+
+"""
+Interactive subdomain picker for the menus.
+
+Instead of printing every subdomain as a numbered list, the picker asks
+for part of a name and shows the matches a page at a time. Matches come
+from a SubdomainIndex: a sorted list for prefix lookups and a trigram
+index for substring and typo-tolerant lookups, so filtering 20k names
+takes milliseconds. The index is built once per session and updated in
+place when subdomains are added or removed.
+"""
+
+import bisect
+
+from colorama import Fore
+
+PAGE_SIZE = 20
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SubdomainIndex:
+    """Prefix and trigram index over subdomain names (case-insensitive)."""
+
+    def __init__(self, names=()):
+        self.names = set(names)
+        self.sorted_keys = sorted((name.lower(), name) for name in self.names)
+        self.trigrams = {}
+        for name in self.names:
+            for trigram in _trigrams(name.lower()):
+                self.trigrams.setdefault(trigram, set()).add(name)
+
+    def add(self, name):
+        if name in self.names:
+            return
+        self.names.add(name)
+        bisect.insort(self.sorted_keys, (name.lower(), name))
+        for trigram in _trigrams(name.lower()):
+            self.trigrams.setdefault(trigram, set()).add(name)
+
+    def discard(self, name):
+        if name not in self.names:
+            return
+        self.names.discard(name)
+        del self.sorted_keys[bisect.bisect_left(self.sorted_keys, (name.lower(), name))]
+        for trigram in _trigrams(name.lower()):
+            postings = self.trigrams.get(trigram)
+            if postings is not None:
+                postings.discard(name)
+                if not postings:
+                    del self.trigrams[trigram]
+
+    def prefix(self, text):
+        """Names starting with `text` (lowercase), in sorted order."""
+        start = bisect.bisect_left(self.sorted_keys, (text,))
+        end = bisect.bisect_left(self.sorted_keys, (text + '\uffff',))
+        return [name for _, name in self.sorted_keys[start:end]]
+
+    def search(self, query):
+        """
+        Return names matching `query`, best first.
+
+        Ranking: exact match, then names starting with the query, then
+        names containing it (earliest occurrence first). If nothing
+        contains the query, names sharing most of its trigrams are returned
+        instead, which tolerates typos.
+        """
+        query = query.strip().lower()
+        if not query:
+            return [name for _, name in self.sorted_keys]
+
+        ranked = self.prefix(query)
+        seen = set(ranked)
+        query_trigrams = _trigrams(query)
+        if query_trigrams:
+            postings = sorted((self.trigrams.get(trigram, set()) for trigram in query_trigrams), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+        else:
+            candidates = self.names
+        contained = sorted((name for name in candidates if name not in seen and query in name.lower()),
+                           key=lambda name: (name.lower().index(query), name))
+        ranked.extend(contained)
+        if ranked or len(query_trigrams) < 2:
+            return ranked
+
+        # Nothing contains the query: fall back to trigram overlap
+        scores = {}
+        for trigram in query_trigrams:
+            for name in self.trigrams.get(trigram, ()):
+                scores[name] = scores.get(name, 0) + 1
+        threshold = max(2, len(query_trigrams) // 2)
+        return sorted((name for name, score in scores.items() if score >= threshold),
+                      key=lambda name: (-scores[name], name))
+
+
+_index = None
+
+
+def subdomain_index(subdomains):
+    """Return the session's index, brought up to date with `subdomains`."""
+    global _index
+    current = set(subdomains)
+    if _index is None:
+        _index = SubdomainIndex(current)
+    else:
+        for name in _index.names - current:
+            _index.discard(name)
+        for name in current - _index.names:
+            _index.add(name)
+    return _index
+
+
+def pick_subdomain(subdomains, action, describe=None, page_size=PAGE_SIZE):
+    """
+    Let the user find and select one subdomain.
+
+    The user types part of a name to filter, Enter for the next page of
+    matches, the number shown next to a match or its full name to select
+    it, and 'q' to cancel.
+
+    Args:
+        subdomains (list): Subdomains to choose from.
+        action (str): What the selection is for, e.g. 'edit'.
+        describe (callable, optional): Returns a suffix shown after each name
+            (e.g. its health).
+        page_size (int): Matches shown per page.
+
+    Returns:
+        str: The selected subdomain, or None if cancelled.
+    """
+    index = subdomain_index(subdomains)
+    query = ''
+    matches = index.search(query)
+    page = 0
+    while True:
+        if not matches:
+            print(Fore.YELLOW + f"No subdomain matches '{query}'.")
+        else:
+            start = page * page_size
+            shown = matches[start:start + page_size]
+            heading = f"matching '{query}'" if query else "in total"
+            print(f"\n{len(matches)} subdomains {heading}; showing {start + 1}-{start + len(shown)}:")
+            for number, name in enumerate(shown, start + 1):
+                print(f"{number}) {name}{describe(name) if describe else ''}")
+
+        selection = input(f"Type part of a name to filter, a number or full name to {action}, "
+                          "Enter for more, 'q' to cancel: ").strip()
+        if selection.lower() == 'q':
+            return None
+        if not selection:
+            page = page + 1 if (page + 1) * page_size < len(matches) else 0
+            continue
+        if selection in index.names:
+            return selection
+        if selection.isdigit():
+            number = int(selection)
+            if 1 <= number <= len(matches):
+                return matches[number - 1]
+            print(Fore.RED + "Invalid selection. Please try again.")
+            continue
+        query = selection
+        matches = index.search(query)
+        page = 0
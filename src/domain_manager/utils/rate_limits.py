@@ -0,0 +1,186 @@
+# domain_manager/utils/rate_limits.py
+
+"""
+Request-rate and connection limits per subdomain.
+
+A registry entry may set:
+
+    rate_limit: true                  # the defaults from the `limits` section
+    rate_limit: {rate: 20r/s, burst: 40, nodelay: false, key: $binary_remote_addr}
+    conn_limit: true                  # or a number of concurrent connections
+
+`limit_req` and `limit_conn` need shared-memory zones, which can only be
+declared in the http context. The zones are therefore written to a
+managed include, `conf.d/domain_manager_limits.conf`, and the vhosts only
+reference them. Vhosts with the same key and rate share one zone, so the
+include holds one zone per distinct (key, rate) and one connection zone
+per key, whatever the number of vhosts.
+
+Zones are sized from `expected_keys`, the number of distinct clients
+(keys) a zone should track. At 128 bytes per request state and 64 per
+connection state on 64-bit platforms (more for non-binary keys), a 1m
+zone holds about 8000 and 16000 keys respectively. A full zone makes
+Nginx evict old states and, failing that, reject requests.
+"""
+
+import math
+import os
+import re
+import zlib
+
+from colorama import Fore
+
+LIMITS_FILE = 'domain_manager_limits.conf'
+DEFAULT_KEY = '$binary_remote_addr'
+
+DEFAULT_LIMITS = {
+    'key': DEFAULT_KEY,
+    'expected_keys': 100000,
+    'rate': '10r/s',
+    'burst': 20,
+    'nodelay': True,
+    'connections': 20,
+    'status': 429,
+}
+
+# Bytes per tracked key on 64-bit platforms, with headroom for long keys
+STATE_BYTES = {'req': 128, 'conn': 64}
+TEXT_KEY_STATE_BYTES = 256
+
+
+def limit_settings(config):
+    """Return limit defaults from config.yaml merged over the built-in ones."""
+    settings = dict(DEFAULT_LIMITS)
+    settings.update((config or {}).get('limits') or {})
+    return settings
+
+
+def _rate_limit(settings, details):
+    """Resolve an entry's rate_limit against the defaults; None when it has none."""
+    value = (details or {}).get('rate_limit')
+    if not value:
+        return None
+    resolved = {name: settings[name] for name in ('key', 'rate', 'burst', 'nodelay')}
+    if isinstance(value, dict):
+        resolved.update(value)
+    return resolved
+
+
+def _conn_limit(settings, details):
+    """Resolve an entry's conn_limit to a number of connections; None when it has none."""
+    value = (details or {}).get('conn_limit')
+    if not value:
+        return None
+    return settings['connections'] if value is True else int(value)
+
+
+def _suffix(key):
+    return '' if key == DEFAULT_KEY else f"_{zlib.crc32(key.encode()):08x}"
+
+
+def req_zone_name(key, rate):
+    return f"dm_req_{re.sub(r'[^0-9a-z]', '_', str(rate))}{_suffix(key)}"
+
+
+def conn_zone_name(key):
+    return f"dm_conn{_suffix(key)}"
+
+
+def zone_size(expected_keys, key, kind):
+    """Return a zone size ('10m') that holds `expected_keys` states of `kind` ('req' or 'conn')."""
+    per_key = STATE_BYTES[kind] if key.startswith('$binary_') else TEXT_KEY_STATE_BYTES
+    return f"{max(1, math.ceil(expected_keys * per_key / (1024 * 1024)))}m"
+
+
+def limit_directives(config, details):
+    """
+    Return the directives that apply a subdomain's limits, for its proxied location.
+
+    Returns:
+        list: Directive lines; empty when the entry sets no limits.
+    """
+    settings = limit_settings(config)
+    directives = []
+    rate_limit = _rate_limit(settings, details)
+    if rate_limit:
+        directive = f"limit_req zone={req_zone_name(rate_limit['key'], rate_limit['rate'])}"
+        if rate_limit['burst']:
+            directive += f" burst={rate_limit['burst']}"
+        if rate_limit['nodelay']:
+            directive += " nodelay"
+        directives += [directive + ";", f"limit_req_status {settings['status']};"]
+    connections = _conn_limit(settings, details)
+    if connections:
+        directives += [f"limit_conn {conn_zone_name(settings['key'])} {connections};",
+                       f"limit_conn_status {settings['status']};"]
+    return directives
+
+
+def limit_zones(config, registry):
+    """
+    Collect the zones the registry's vhosts use.
+
+    Returns:
+        dict: zone name -> (zone directive, sorted subdomains using it).
+    """
+    settings = limit_settings(config)
+    zones = {}
+    for subdomain, details in registry.items():
+        if not isinstance(details, dict):
+            continue
+        rate_limit = _rate_limit(settings, details)
+        if rate_limit:
+            key, rate = rate_limit['key'], rate_limit['rate']
+            directive = (f"limit_req_zone {key} zone={req_zone_name(key, rate)}:"
+                         f"{zone_size(settings['expected_keys'], key, 'req')} rate={rate};")
+            zones.setdefault(req_zone_name(key, rate), (directive, []))[1].append(subdomain)
+        if _conn_limit(settings, details):
+            key = settings['key']
+            directive = (f"limit_conn_zone {key} zone={conn_zone_name(key)}:"
+                         f"{zone_size(settings['expected_keys'], key, 'conn')};")
+            zones.setdefault(conn_zone_name(key), (directive, []))[1].append(subdomain)
+    return {name: (directive, sorted(users)) for name, (directive, users) in zones.items()}
+
+
+def render_limit_zones(config, registry):
+    """Return the content of the managed zone include."""
+    lines = ["# Managed by NGINXDomainManager - do not edit"]
+    for name, (directive, users) in sorted(limit_zones(config, registry).items()):
+        shown = ', '.join(users[:5]) + (f" and {len(users) - 5} more" if len(users) > 5 else '')
+        lines += [f"# {name}: used by {shown}", directive]
+    return '\n'.join(lines) + '\n'
+
+
+def limit_zones_path(config):
+    return os.path.join(config.get('nginx_conf_dir', '/etc/nginx'), 'conf.d', LIMITS_FILE)
+
+
+def write_limit_zones(config, logger, registry=None):
+    """
+    Write the managed include declaring the zones of `registry` (default: the configured registry).
+
+    The file is rewritten only when its content changes.
+
+    Returns:
+        bool: False if the file could not be written.
+    """
+    path = limit_zones_path(config)
+    content = render_limit_zones(config, (config.get('subdomains') or {}) if registry is None else registry)
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return True
+    except OSError:
+        pass
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote rate and connection limit zones to {path}.")
+        return True
+    except OSError as e:
+        logger.error(f"Failed to write limit zones to {path}: {e}")
+        print(Fore.RED + f"Failed to write limit zones to {path}: {e}")
+        return False
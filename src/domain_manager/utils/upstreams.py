@@ -0,0 +1,206 @@
+# domain_manager/utils/upstreams.py
+
+"""
+Load-balanced subdomains.
+
+A registry entry normally proxies to one backend, `target_ip:target_port`.
+An entry may instead list several backends and a balancing method:
+
+    backends:
+      - 10.0.0.5:8080 weight=3
+      - 10.0.0.6:8080 max_fails=3 fail_timeout=10s
+      - 10.0.0.7:8080 backup
+      - 10.0.0.8:8080 drain
+    balance: least_conn          # round_robin (default), least_conn, ip_hash or hash
+    hash_key: $request_uri       # for `balance: hash`
+
+Each backend is either such a string, in the syntax of an Nginx `server`
+line, or a mapping with the keys ip, port, weight, max_fails,
+fail_timeout, backup and drain. The vhost then gets an
+`upstream dm_<subdomain>` block, placed before its servers, and proxies to
+it. Entries without backends render exactly as before.
+
+A drained backend is kept in the block but marked `down`: after the
+reload, new requests go to the other members while the old workers finish
+the requests already in flight, so members are added, drained and removed
+without dropping connections. `target_ip`/`target_port` always mirror the
+primary backend (the first active one), so listings, exports and health
+checks of single-backend tools keep working.
+"""
+
+BALANCE_METHODS = ('round_robin', 'least_conn', 'ip_hash', 'hash')
+BACKEND_SETTINGS = ('ip', 'port', 'weight', 'max_fails', 'fail_timeout', 'backup', 'drain')
+DEFAULT_HASH_KEY = '$request_uri'
+
+
+def parse_backend(spec):
+    """
+    Parse a backend given as 'IP:PORT [weight=N] [max_fails=N] [fail_timeout=T] [backup] [drain]'.
+
+    Mappings are returned as a copy. IPv6 addresses are written in brackets.
+
+    Raises:
+        ValueError: If the string is not in that form.
+    """
+    if isinstance(spec, dict):
+        return dict(spec)
+    parts = str(spec).split()
+    if not parts:
+        raise ValueError("Empty backend")
+    if parts[0].startswith('['):
+        ip, _, port = parts[0][1:].partition(']:')
+    else:
+        ip, _, port = parts[0].rpartition(':')
+    if not ip or not port:
+        raise ValueError(f"Backend must be IP:PORT: {parts[0]}")
+    backend = {'ip': ip, 'port': port}
+    for part in parts[1:]:
+        name, has_value, value = part.partition('=')
+        if name in ('backup', 'drain') and not has_value:
+            backend[name] = True
+        elif name in ('weight', 'max_fails') and value.isdigit():
+            backend[name] = int(value)
+        elif name == 'fail_timeout' and value:
+            backend[name] = value
+        else:
+            raise ValueError(f"Unknown backend parameter: {part}")
+    return backend
+
+
+def backend_address(backend):
+    ip = str(backend.get('ip'))
+    return f"[{ip}]:{backend.get('port')}" if ':' in ip else f"{ip}:{backend.get('port')}"
+
+
+def format_backend(backend):
+    """Render a backend mapping in the string form parse_backend reads."""
+    parts = [backend_address(backend)]
+    for name in ('weight', 'max_fails', 'fail_timeout'):
+        if backend.get(name) is not None:
+            parts.append(f"{name}={backend[name]}")
+    parts += [name for name in ('backup', 'drain') if backend.get(name)]
+    return ' '.join(parts)
+
+
+def backends_of(details):
+    """Return an entry's backends as mappings; empty for a single-backend entry."""
+    return [parse_backend(backend) for backend in (details or {}).get('backends') or []]
+
+
+def primary_backend(backends):
+    """Return the first backend taking regular traffic (or the first one when all are drained or backups)."""
+    for backend in backends:
+        if not backend.get('backup') and not backend.get('drain'):
+            return backend
+    return backends[0] if backends else None
+
+
+def entry_backends(details):
+    """Return every backend of an entry, including the single target_ip/target_port one."""
+    details = details or {}
+    return backends_of(details) or [{'ip': details.get('target_ip'), 'port': details.get('target_port')}]
+
+
+def with_primary(details):
+    """
+    Return an entry with its backends in string form and target_ip/target_port set to the primary one.
+
+    Entries without backends are returned unchanged.
+    """
+    backends = backends_of(details)
+    if not backends:
+        return details
+    primary = primary_backend(backends)
+    return {**details, 'backends': [format_backend(backend) for backend in backends],
+            'target_ip': str(primary['ip']), 'target_port': str(primary['port'])}
+
+
+def add_backend(details, spec):
+    """
+    Return an entry with a backend added, or replaced if one with the same address exists.
+
+    A single-backend entry is converted first, keeping its current backend.
+    """
+    backend = parse_backend(spec)
+    backends = backends_of(details)
+    if not backends and details.get('target_ip'):
+        backends = [{'ip': str(details['target_ip']), 'port': str(details.get('target_port'))}]
+    address = backend_address(backend)
+    for index, existing in enumerate(backends):
+        if backend_address(existing) == address:
+            backends[index] = backend
+            break
+    else:
+        backends.append(backend)
+    return with_primary({**details, 'backends': backends})
+
+
+def _find(backends, address):
+    address = backend_address(parse_backend(address))
+    for backend in backends:
+        if backend_address(backend) == address:
+            return backend
+    raise ValueError(f"No backend {address}")
+
+
+def set_drain(details, address, drain=True):
+    """
+    Return an entry with a backend drained (marked down) or put back into rotation.
+
+    Raises:
+        ValueError: If the entry has no backend with that address.
+    """
+    backends = backends_of(details)
+    backend = _find(backends, address)
+    if drain:
+        backend['drain'] = True
+    else:
+        backend.pop('drain', None)
+    return with_primary({**details, 'backends': backends})
+
+
+def remove_backend(details, address):
+    """
+    Return an entry without the backend at `address`.
+
+    Raises:
+        ValueError: If the entry has no such backend, or it is the last one.
+    """
+    backends = backends_of(details)
+    backends.remove(_find(backends, address))
+    if not backends:
+        raise ValueError("Cannot remove the last backend")
+    return with_primary({**details, 'backends': backends})
+
+
+def upstream_name(subdomain):
+    return f"dm_{subdomain}"
+
+
+def upstream_config(subdomain, details):
+    """
+    Render the upstream block of a load-balanced entry.
+
+    Returns:
+        tuple: (upstream name, block text), or None for a single-backend entry.
+    """
+    backends = backends_of(details)
+    if not backends:
+        return None
+    name = upstream_name(subdomain)
+    lines = [f"upstream {name} {{"]
+    balance = details.get('balance') or 'round_robin'
+    if balance == 'hash':
+        lines.append(f"    hash {details.get('hash_key') or DEFAULT_HASH_KEY} consistent;")
+    elif balance != 'round_robin':
+        lines.append(f"    {balance};")
+    for backend in backends:
+        parameters = [f"{setting}={backend[setting]}" for setting in ('weight', 'max_fails', 'fail_timeout')
+                      if backend.get(setting) is not None]
+        if backend.get('backup'):
+            parameters.append('backup')
+        if backend.get('drain'):
+            parameters.append('down')
+        lines.append(f"    server {' '.join([backend_address(backend)] + parameters)};")
+    lines.append("}")
+    return name, '\n'.join(lines) + '\n'
@@ -1,35 +1,385 @@
-# Validate Subdomain
+# domain_manager/utils/validation.py
+
+import functools
+import ipaddress
 import logging
+import re
 
 from colorama import Fore
 
+from domain_manager.utils.upstreams import (
+    BACKEND_SETTINGS, BALANCE_METHODS, backend_address, entry_backends, parse_backend, primary_backend
+)
+
+SUBDOMAIN_RE = re.compile(r'^([a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}$')
+DIRECTIVE_NAME_RE = re.compile(r'^[a-z_][a-z0-9_]*(\s|;|$)')
+RATE_RE = re.compile(r'^[1-9][0-9]*r/[sm]$')
+LIMIT_KEY_RE = re.compile(r'^\$[a-z_][a-z0-9_]*$')
+RATE_LIMIT_SETTINGS = ('rate', 'burst', 'nodelay', 'key')
+FAIL_TIMEOUT_RE = re.compile(r'^[0-9]+(ms|s|m|h)?$')
+HASH_KEY_RE = re.compile(r'^[^\s;{}\'"]+$')
+
+DEFAULT_VALIDATION = {
+    # Backends in these ranges are rejected: unspecified, link-local (including
+    # cloud metadata endpoints), multicast, reserved and broadcast addresses.
+    'forbidden_networks': [
+        '0.0.0.0/8', '169.254.0.0/16', '224.0.0.0/4', '240.0.0.0/4',
+        '::/128', 'fe80::/10', 'ff00::/8',
+    ],
+    # Ports Nginx itself listens on; a local backend on one of them would
+    # proxy the vhost back to Nginx.
+    'nginx_ports': [80, 443],
+}
+
+_network_cache = {}
+
+
+def validation_settings(config=None):
+    """Return validation settings from config.yaml merged over the defaults."""
+    settings = dict(DEFAULT_VALIDATION)
+    settings.update((config or {}).get('validation') or {})
+    return settings
+
+
+def _networks(cidrs):
+    """Parse CIDRs once into (network, version, first address, netmask) tuples for fast membership tests."""
+    key = tuple(cidrs)
+    if key not in _network_cache:
+        networks = [ipaddress.ip_network(cidr, strict=False) for cidr in cidrs]
+        _network_cache[key] = [
+            (network, network.version, int(network.network_address), int(network.netmask)) for network in networks
+        ]
+    return _network_cache[key]
+
+
+@functools.lru_cache(maxsize=65536)
+def _parse_ip(ip):
+    """Return (version, integer value) of an IP address, or None; backends repeat a lot across a registry."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    return address.version, int(address)
+
+
+@functools.lru_cache(maxsize=4096)
+def _is_local(ip):
+    address = ipaddress.ip_address(ip)
+    return address.is_loopback or address.is_unspecified
+
+
+# Single-value checks. Each returns an error message, or None if the value is valid.
+
+def subdomain_error(subdomain):
+    if not isinstance(subdomain, str) or not SUBDOMAIN_RE.match(subdomain):
+        return f"Invalid subdomain format: {subdomain}"
+    return None
+
+
+def ip_error(ip, forbidden_networks=()):
+    if ip in (None, ''):
+        return "Missing IP address"
+    parsed = _parse_ip(str(ip))
+    if parsed is None:
+        return f"Invalid IP address format: {ip}"
+    version, value = parsed
+    for network, network_version, first, netmask in forbidden_networks:
+        if version == network_version and value & netmask == first:
+            return f"IP address {ip} is in the forbidden range {network}"
+    return None
+
+
+def port_error(port):
+    if port in (None, ''):
+        return "Missing port number"
+    port = str(port)
+    if not port.isdigit() or not (1 <= int(port) <= 65535):
+        return f"Invalid port number: {port}"
+    return None
+
+
+def option_errors(custom_options):
+    """
+    Check the syntax of custom Nginx directives.
+
+    Each option must start with a directive name and be terminated by ';'
+    or be a block closed by '}'. Quotes and braces must be balanced.
+    """
+    if custom_options is None:
+        return []
+    if not isinstance(custom_options, list) or not all(isinstance(option, str) for option in custom_options):
+        return ["custom_options must be a list of strings"]
+    errors = []
+    for option in custom_options:
+        text = option.strip()
+        if not DIRECTIVE_NAME_RE.match(text):
+            errors.append(f"Custom option does not start with a directive name: {option}")
+            continue
+        if not text.endswith((';', '}')):
+            errors.append(f"Custom option must end with ';' or '}}': {option}")
+        if not any(char in text for char in '{}"\''):
+            continue
+        depth = 0
+        quote = None
+        for char in text:
+            if quote:
+                if char == quote:
+                    quote = None
+            elif char in '"\'':
+                quote = char
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth < 0:
+                    break
+        if quote:
+            errors.append(f"Unbalanced quotes in custom option: {option}")
+        elif depth:
+            errors.append(f"Unbalanced braces in custom option: {option}")
+    return errors
+
+
+def limit_errors(details):
+    """Check an entry's optional 'rate_limit' and 'conn_limit' settings (see utils/rate_limits.py)."""
+    errors = []
+    rate_limit = details.get('rate_limit')
+    if isinstance(rate_limit, dict):
+        unknown = sorted(set(rate_limit) - set(RATE_LIMIT_SETTINGS))
+        if unknown:
+            errors.append(f"Unknown rate_limit settings: {', '.join(map(str, unknown))}")
+        if 'rate' in rate_limit and not RATE_RE.match(str(rate_limit['rate'])):
+            errors.append(f"Invalid rate: {rate_limit['rate']} (expected e.g. 10r/s or 300r/m)")
+        burst = rate_limit.get('burst', 0)
+        if isinstance(burst, bool) or not isinstance(burst, int) or burst < 0:
+            errors.append(f"Invalid burst: {burst}")
+        if 'key' in rate_limit and not LIMIT_KEY_RE.match(str(rate_limit['key'])):
+            errors.append(f"Invalid rate_limit key: {rate_limit['key']} "
+                          "(expected a variable such as $binary_remote_addr)")
+    elif rate_limit is not None and not isinstance(rate_limit, bool):
+        errors.append("rate_limit must be true, false or a mapping")
+    conn_limit = details.get('conn_limit')
+    if not isinstance(conn_limit, (bool, type(None))) and (not isinstance(conn_limit, int) or conn_limit < 1):
+        errors.append(f"Invalid conn_limit: {conn_limit} (expected true, false or a number of connections)")
+    return errors
+
+
+def backend_errors(details, forbidden_networks=()):
+    """Check an entry's optional 'backends', 'balance' and 'hash_key' settings (see utils/upstreams.py)."""
+    errors = []
+    balance = details.get('balance')
+    if balance is not None and balance not in BALANCE_METHODS:
+        errors.append(f"Invalid balance method: {balance} (expected one of {', '.join(BALANCE_METHODS)})")
+    hash_key = details.get('hash_key')
+    if hash_key is not None and not HASH_KEY_RE.match(str(hash_key)):
+        errors.append(f"Invalid hash_key: {hash_key}")
+    backends = details.get('backends')
+    if not backends:
+        return errors
+    if not isinstance(backends, list):
+        return errors + ["backends must be a list"]
+    seen = set()
+    active = 0
+    for spec in backends:
+        try:
+            backend = parse_backend(spec)
+        except ValueError as e:
+            errors.append(str(e))
+            continue
+        unknown = sorted(set(backend) - set(BACKEND_SETTINGS))
+        if unknown:
+            errors.append(f"Unknown backend settings: {', '.join(map(str, unknown))}")
+        for error in (ip_error(backend.get('ip'), forbidden_networks), port_error(backend.get('port'))):
+            if error:
+                errors.append(error)
+        for name, minimum in (('weight', 1), ('max_fails', 0)):
+            value = backend.get(name, minimum)
+            if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+                errors.append(f"Invalid {name} for backend {backend_address(backend)}: {value}")
+        if 'fail_timeout' in backend and not FAIL_TIMEOUT_RE.match(str(backend['fail_timeout'])):
+            errors.append(f"Invalid fail_timeout for backend {backend_address(backend)}: {backend['fail_timeout']}")
+        if backend.get('backup') and balance in ('ip_hash', 'hash'):
+            errors.append(f"Backup backends cannot be used with balance {balance}")
+        address = backend_address(backend)
+        if address in seen:
+            errors.append(f"Duplicate backend {address}")
+        seen.add(address)
+        if not backend.get('backup') and not backend.get('drain'):
+            active += 1
+    if not errors and not active:
+        errors.append("At least one backend must be neither a backup nor drained")
+    return errors
+
+
+# Interactive prompts: print and log the first problem
 
 def validate_subdomain(subdomain):
-    import re
-    pattern = r'^([a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}$'
-    if not re.match(pattern, subdomain):
+    error = subdomain_error(subdomain)
+    if error:
         print(Fore.RED + "Invalid subdomain format.")
-        logging.error(f"Invalid subdomain format: {subdomain}")
+        logging.error(error)
         return False
     return True
 
 
-# Validate IP Address
 def validate_ip(ip):
-    import ipaddress
-    try:
-        ipaddress.ip_address(ip)
-        return True
-    except ValueError:
-        print(Fore.RED + "Invalid IP address format.")
-        logging.error(f"Invalid IP address format: {ip}")
+    error = ip_error(ip, _networks(DEFAULT_VALIDATION['forbidden_networks']))
+    if error:
+        print(Fore.RED + error.replace(f" {ip}", "", 1) + ".")
+        logging.error(error)
         return False
+    return True
 
 
-# Validate Port
 def validate_port(port):
-    if not port.isdigit() or not (1 <= int(port) <= 65535):
+    error = port_error(port)
+    if error:
         print(Fore.RED + "Invalid port number.")
-        logging.error(f"Invalid port number: {port}")
+        logging.error(error)
         return False
     return True
+
+
+# Validate a registry entry without printing, for batch operations
+def entry_errors(subdomain, details, forbidden_networks=None):
+    """
+    Check a subdomain and its registry entry.
+
+    Unlike the validate_* helpers this neither prints nor logs, so callers can
+    collect every problem in a batch before reporting.
+
+    Args:
+        subdomain (str): The subdomain.
+        details (dict): Registry entry with 'target_ip', 'target_port' (or
+            'backends') and optional 'custom_options'.
+        forbidden_networks (list, optional): Ranges backends may not point
+            into, as returned by _networks (default: DEFAULT_VALIDATION's).
+
+    Returns:
+        list: Error messages; empty if the entry is valid.
+    """
+    if forbidden_networks is None:
+        forbidden_networks = _networks(DEFAULT_VALIDATION['forbidden_networks'])
+    errors = []
+    error = subdomain_error(subdomain)
+    if error:
+        errors.append(error)
+    if not isinstance(details, dict):
+        return errors + ["Entry must be a mapping"]
+    if details.get('backends'):
+        # target_ip/target_port are derived from the backends
+        errors.extend(backend_errors(details, forbidden_networks))
+    else:
+        for error in (ip_error(details.get('target_ip'), forbidden_networks), port_error(details.get('target_port'))):
+            if error:
+                errors.append(error)
+        errors.extend(backend_errors(details))
+    errors.extend(option_errors(details.get('custom_options')))
+    errors.extend(limit_errors(details))
+    return errors
+
+
+class BatchValidator:
+    """
+    Validate many entries in one pass and collect a structured report.
+
+    Entries can be fed one at a time (check) for streaming imports, or all
+    at once (validate_entries). Besides the per-entry checks this catches:
+
+    - duplicate subdomains within the batch;
+    - port collisions: a loopback or unspecified backend on a port Nginx
+      itself listens on, which would proxy the vhost back to Nginx.
+
+    Backends shared by several subdomains are legitimate but reported as
+    warnings (for load-balanced entries, the primary backend).
+    """
+
+    def __init__(self, config=None, registry=None):
+        settings = validation_settings(config)
+        self.forbidden_networks = _networks(settings['forbidden_networks'])
+        self.nginx_ports = {str(port) for port in settings['nginx_ports']}
+        self.seen = {}
+        self.backends = {}
+        if registry:
+            for subdomain, details in registry.items():
+                if isinstance(details, dict):
+                    self.backends.setdefault(self._backend(details), []).append(subdomain)
+        self.checked = 0
+        self.invalid = 0
+        self.errors = {}
+        self.warnings = {}
+
+    @staticmethod
+    def _backend(details):
+        if details.get('backends'):
+            primary = primary_backend(entry_backends(details))
+            return f"{primary.get('ip')}:{primary.get('port')}"
+        return f"{details.get('target_ip')}:{details.get('target_port')}"
+
+    def check(self, subdomain, details=None, label=None):
+        """
+        Validate one entry and record its problems under `label` (default: the subdomain).
+
+        With `details` None (e.g. a deletion) only duplicates are checked.
+
+        Returns:
+            list: This entry's error messages.
+        """
+        self.checked += 1
+        label = str(subdomain) if label is None else label
+        errors = [] if details is None else entry_errors(subdomain, details, self.forbidden_networks)
+        if subdomain in self.seen:
+            errors.append(f"Duplicate subdomain (first seen as {self.seen[subdomain]})")
+        else:
+            self.seen[subdomain] = label
+
+        if not errors and isinstance(details, dict):
+            for backend in entry_backends(details):
+                ip, port = str(backend.get('ip')), str(backend.get('port'))
+                if port in self.nginx_ports and _is_local(ip):
+                    errors.append(f"Backend {ip}:{port} collides with a port Nginx listens on")
+            if not errors:
+                backend = self._backend(details)
+                others = [other for other in self.backends.get(backend, []) if other != subdomain]
+                if others:
+                    shown = ', '.join(others[:3]) + (f" and {len(others) - 3} more" if len(others) > 3 else "")
+                    self.warnings.setdefault(label, []).append(f"Backend {backend} is shared with {shown}")
+                self.backends.setdefault(backend, []).append(subdomain)
+
+        if errors:
+            self.invalid += 1
+            self.errors.setdefault(label, []).extend(errors)
+        return errors
+
+    def report(self):
+        """
+        Returns:
+            dict: 'checked', 'valid' and 'invalid' counts, plus 'errors' and
+            'warnings' (label -> list of messages).
+        """
+        return {
+            'checked': self.checked,
+            'valid': self.checked - self.invalid,
+            'invalid': self.invalid,
+            'errors': self.errors,
+            'warnings': self.warnings,
+        }
+
+
+def validate_entries(entries, config=None, registry=None):
+    """
+    Validate a batch of (subdomain, details) pairs in one pass.
+
+    Args:
+        entries (iterable): (subdomain, details) pairs.
+        config (dict, optional): Configuration, for the `validation` settings.
+        registry (dict, optional): Existing registry, to detect shared
+            backends with entries outside the batch.
+
+    Returns:
+        dict: Report as described in BatchValidator.report.
+    """
+    validator = BatchValidator(config, registry)
+    for subdomain, details in entries:
+        validator.check(subdomain, details)
+    return validator.report()
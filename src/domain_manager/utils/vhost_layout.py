@@ -0,0 +1,279 @@
+# domain_manager/utils/vhost_layout.py
+
+"""
+Where vhosts live on disk.
+
+`layout.mode: subdomain` (the default) writes one file per subdomain,
+`<sites_available>/<subdomain>.conf`, enabled by a symlink of the same
+name in sites-enabled.
+
+`layout.mode: apex` puts all the vhosts of an apex domain into one file,
+`<apex>.apex.conf`, so app.example.com and api.example.com both live in
+example.com.apex.conf. This divides the files Nginx opens at startup and
+during `nginx -t`, and the size of every directory listing, by the
+average number of subdomains per apex. Each vhost sits between stable
+markers:
+
+    # BEGIN NGINXDomainManager app.example.com
+    ...
+    # END NGINXDomainManager app.example.com
+
+Blocks are kept in name order. Updating one vhost rewrites only its
+apex's file, and a file whose content would not change is left alone.
+The subdomains held by each enabled apex file are cached in
+`<state_dir>/vhost_map.json`, keyed by the file's size and mtime, so a
+listing only reads apex files that changed since the last one.
+
+The apex is the last two labels of a name. When the last two labels are
+listed in `apex_suffixes` (co.uk, com.au, ...), it is the last three.
+"""
+
+import json
+import os
+import re
+
+from domain_manager.utils.locks import DEFAULT_STATE_DIR, file_lock, lock_dir
+
+APEX_FILE_SUFFIX = '.apex.conf'
+VHOST_MAP_FILE = 'vhost_map.json'
+BEGIN_MARKER = '# BEGIN NGINXDomainManager '
+END_MARKER = '# END NGINXDomainManager '
+BEGIN_PATTERN = re.compile(r'^# BEGIN NGINXDomainManager (\S+)$', re.MULTILINE)
+HEADER = "# Managed by NGINXDomainManager - do not edit. One block per subdomain.\n"
+
+DEFAULT_LAYOUT = {
+    'mode': 'subdomain',
+    'apex_suffixes': ['co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'com.au', 'net.au', 'org.au', 'co.nz', 'co.jp',
+                      'com.br', 'co.za', 'com.cn'],
+}
+
+
+def layout_settings(config):
+    """Return layout settings from config.yaml merged over the defaults."""
+    settings = dict(DEFAULT_LAYOUT)
+    settings.update((config or {}).get('layout') or {})
+    return settings
+
+
+def apex_layout(config):
+    return layout_settings(config)['mode'] == 'apex'
+
+
+def apex_of(config, subdomain):
+    """Return the apex domain a subdomain's vhost is grouped under."""
+    labels = subdomain.lower().rstrip('.').split('.')
+    count = 3 if '.'.join(labels[-2:]) in layout_settings(config)['apex_suffixes'] else 2
+    return '.'.join(labels[-count:])
+
+
+def vhost_file_name(config, subdomain):
+    """Return the name of the file holding a subdomain's vhost."""
+    if apex_layout(config):
+        return f"{apex_of(config, subdomain)}{APEX_FILE_SUFFIX}"
+    return f"{subdomain}.conf"
+
+
+def split_blocks(content):
+    """Parse an apex file into subdomain -> vhost content; text outside the markers is ignored."""
+    blocks = {}
+    current = None
+    lines = []
+    for line in content.splitlines(keepends=True):
+        if current is None:
+            if line.startswith(BEGIN_MARKER):
+                current = line[len(BEGIN_MARKER):].strip()
+                lines = []
+        elif line.startswith(END_MARKER) and line[len(END_MARKER):].strip() == current:
+            blocks[current] = ''.join(lines)
+            current = None
+        else:
+            lines.append(line)
+    return blocks
+
+
+def join_blocks(blocks):
+    """Render subdomain -> vhost content as an apex file."""
+    return HEADER + ''.join(_block(subdomain, blocks[subdomain]) for subdomain in sorted(blocks))
+
+
+def layout_files(config, rendered):
+    """
+    Arrange rendered vhosts into files.
+
+    Args:
+        config (dict): Configuration dictionary.
+        rendered (dict): subdomain -> vhost content.
+
+    Returns:
+        dict: file name -> content.
+    """
+    if not apex_layout(config):
+        return {f"{subdomain}.conf": content for subdomain, content in rendered.items()}
+    grouped = {}
+    for subdomain, content in rendered.items():
+        grouped.setdefault(vhost_file_name(config, subdomain), {})[subdomain] = content
+    return {name: join_blocks(blocks) for name, blocks in grouped.items()}
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return ''
+
+
+def _write(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _block(subdomain, content):
+    if not content.endswith('\n'):
+        content += '\n'
+    return f"{BEGIN_MARKER}{subdomain}\n{content}{END_MARKER}{subdomain}\n"
+
+
+def _find_block(content, subdomain):
+    """Return the (start, end) offsets of a subdomain's block, markers included, or None."""
+    begin = f"{BEGIN_MARKER}{subdomain}\n"
+    start = content.find(begin)
+    while start > 0 and content[start - 1] != '\n':
+        start = content.find(begin, start + 1)
+    if start < 0:
+        return None
+    end_marker = f"{END_MARKER}{subdomain}\n"
+    end = content.find(end_marker, start)
+    return None if end < 0 else (start, end + len(end_marker))
+
+
+def _apex_lock(config, path):
+    """Lock around the read-modify-write of one apex file."""
+    return file_lock(os.path.join(lock_dir(config), 'apex', f"{os.path.basename(path)}.lock"),
+                     description=os.path.basename(path), quiet=True)
+
+
+def read_block(path, subdomain):
+    """Return a subdomain's vhost content from an apex file, or None."""
+    content = _read(path)
+    found = _find_block(content, subdomain)
+    if found is None:
+        return None
+    start, end = found
+    return content[start + len(BEGIN_MARKER) + len(subdomain) + 1:end - len(END_MARKER) - len(subdomain) - 1]
+
+
+def write_block(config, path, subdomain, content):
+    """
+    Put a subdomain's vhost into its apex file, atomically.
+
+    The block is spliced in place (or inserted in name order), so the cost
+    is one read and one write of the file however many vhosts it holds.
+
+    Returns:
+        bool: True if the file content changed.
+    """
+    block = _block(subdomain, content)
+    with _apex_lock(config, path):
+        current = _read(path) or HEADER
+        found = _find_block(current, subdomain)
+        if found is not None:
+            if current[found[0]:found[1]] == block:
+                return False
+            start, end = found
+        else:
+            start = end = len(current)
+            for match in BEGIN_PATTERN.finditer(current):
+                if match.group(1) > subdomain:
+                    start = end = match.start()
+                    break
+        _write(path, current[:start] + block + current[end:])
+    return True
+
+
+def write_blocks(config, path, blocks):
+    """
+    Put several subdomains' vhosts into one apex file with a single write.
+
+    Returns:
+        dict: subdomain -> True if its block changed.
+    """
+    with _apex_lock(config, path):
+        current = split_blocks(_read(path))
+        changed = {}
+        for subdomain, content in blocks.items():
+            if not content.endswith('\n'):
+                content += '\n'
+            changed[subdomain] = current.get(subdomain) != content
+            current[subdomain] = content
+        if any(changed.values()):
+            _write(path, join_blocks(current))
+    return changed
+
+
+def remove_block(config, path, subdomain):
+    """
+    Remove a subdomain's vhost from its apex file; the file is deleted once empty.
+
+    Returns:
+        bool: True if the subdomain had a block.
+    """
+    with _apex_lock(config, path):
+        current = _read(path)
+        found = _find_block(current, subdomain)
+        if found is None:
+            return False
+        remaining = current[:found[0]] + current[found[1]:]
+        if BEGIN_PATTERN.search(remaining):
+            _write(path, remaining)
+        else:
+            os.remove(path)
+    return True
+
+
+def apex_subdomains(config, directory, names):
+    """
+    Return the subdomains held by some apex files, using the vhost map cache.
+
+    Args:
+        config (dict): Configuration dictionary.
+        directory (str): Directory of the files (normally sites-enabled).
+        names (list): Apex file names in `directory`.
+
+    Returns:
+        list: Subdomains, file by file.
+    """
+    map_path = os.path.join(config.get('state_dir', DEFAULT_STATE_DIR), VHOST_MAP_FILE)
+    try:
+        with open(map_path, 'r') as f:
+            cached = json.load(f).get('files', {})
+    except (OSError, ValueError):
+        cached = {}
+
+    files = {}
+    subdomains = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entry = cached.get(name)
+        if not entry or entry.get('size') != st.st_size or entry.get('mtime_ns') != st.st_mtime_ns:
+            entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                     'subdomains': BEGIN_PATTERN.findall(_read(path))}
+        files[name] = entry
+        subdomains.extend(entry['subdomains'])
+
+    if files != cached:
+        try:
+            os.makedirs(os.path.dirname(map_path), exist_ok=True)
+            tmp_path = f"{map_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'files': files}, f)
+            os.replace(tmp_path, map_path)
+        except OSError:
+            pass
+    return subdomains
@@ -0,0 +1,41 @@
+# domain_manager/version.py
+
+PACKAGE_NAME = "NGINXDomainManager"
+UNKNOWN_VERSION = "0.0.0"
+
+_cached_version = None
+
+
+def get_version():
+    """
+    Resolve the installed version without spawning any subprocess.
+
+    Order of precedence:
+      1. `_version.py`, generated by setuptools_scm at build/install time.
+      2. The installed distribution's metadata.
+      3. '0.0.0' when running from an unbuilt checkout.
+
+    Returns:
+        str: Version string.
+    """
+    global _cached_version
+    if _cached_version is not None:
+        return _cached_version
+
+    try:
+        from domain_manager._version import version as generated_version
+        _cached_version = generated_version
+        return _cached_version
+    except ImportError:
+        pass
+
+    try:
+        from importlib.metadata import PackageNotFoundError, version as distribution_version
+    except ImportError:  # Python 3.7
+        _cached_version = UNKNOWN_VERSION
+        return _cached_version
+    try:
+        _cached_version = distribution_version(PACKAGE_NAME)
+    except PackageNotFoundError:
+        _cached_version = UNKNOWN_VERSION
+    return _cached_version
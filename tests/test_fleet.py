@@ -0,0 +1,171 @@
+# tests/test_fleet.py
+
+import os
+
+import pytest
+
+from domain_manager import fleet
+from domain_manager.utils import domain
+
+
+@pytest.fixture
+def fleet_config(tmp_path, monkeypatch):
+    """Three local nodes under tmp_path whose test and reload commands append to <node>.log."""
+    monkeypatch.setattr(domain, 'LETSENCRYPT_LIVE_DIR', str(tmp_path / 'letsencrypt' / 'live'))
+    nodes = {}
+    for name in ('n1', 'n2', 'n3'):
+        log = tmp_path / f"{name}.log"
+        nodes[name] = {
+            'sites_available': str(tmp_path / name / 'sites-available'),
+            'sites_enabled': str(tmp_path / name / 'sites-enabled'),
+            'test_command': f"sh -c 'echo test >> {log}'",
+            'reload_command': f"sh -c 'echo reload >> {log}'",
+        }
+    return {
+        'state_dir': str(tmp_path / 'state'),
+        'fleet': {'nodes': nodes, 'wave_size': 1, 'concurrency': 3},
+        'subdomains': {
+            'a.example.com': {'target_ip': '10.0.0.1', 'target_port': '80', 'custom_options': []},
+            'b.example.com': {'target_ip': '10.0.0.2', 'target_port': '80', 'custom_options': []},
+        },
+    }
+
+
+def node_files(config, name):
+    directory = config['fleet']['nodes'][name]['sites_available']
+    files = {}
+    for filename in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, filename)) as f:
+            files[filename] = f.read()
+    return files
+
+
+def node_log(config, name):
+    return os.path.join(os.path.dirname(config['state_dir']), f"{name}.log")
+
+
+def reloads(config, name):
+    try:
+        with open(node_log(config, name)) as f:
+            return f.read().split().count('reload')
+    except OSError:
+        return 0
+
+
+def test_rollout_pushes_to_every_node_and_reloads_once(fleet_config):
+    summary = fleet.fan_out(fleet_config)
+
+    assert summary['status'] == 'applied'
+    assert summary['waves'] == 3
+    for name in ('n1', 'n2', 'n3'):
+        assert set(node_files(fleet_config, name)) == {'a.example.com.conf', 'b.example.com.conf'}
+        enabled = fleet_config['fleet']['nodes'][name]['sites_enabled']
+        assert os.path.islink(os.path.join(enabled, 'a.example.com.conf'))
+        assert reloads(fleet_config, name) == 1
+
+    assert fleet.fan_out(fleet_config)['status'] == 'unchanged'
+    assert all(reloads(fleet_config, name) == 1 for name in ('n1', 'n2', 'n3'))
+
+
+def test_failed_test_restores_every_node_without_reloading(fleet_config):
+    fleet.fan_out(fleet_config)
+    before = {name: node_files(fleet_config, name) for name in ('n1', 'n2', 'n3')}
+    fleet_config['subdomains']['a.example.com']['target_port'] = '8080'
+    fleet_config['subdomains']['c.example.com'] = {'target_ip': '10.0.0.3', 'target_port': '80'}
+    fleet_config['fleet']['nodes']['n2']['test_command'] = "sh -c 'exit 1'"
+
+    summary = fleet.fan_out(fleet_config)
+
+    assert summary['status'] == 'test_failed'
+    assert summary['nodes']['n2']['test'] == 'failed'
+    for name in ('n1', 'n2', 'n3'):
+        assert node_files(fleet_config, name) == before[name]
+        assert not os.path.lexists(os.path.join(fleet_config['fleet']['nodes'][name]['sites_enabled'],
+                                                'c.example.com.conf'))
+        assert summary['nodes'][name]['rollback'] == 'ok'
+        assert reloads(fleet_config, name) == 1
+
+
+def test_failed_reload_in_a_later_wave_rolls_back_and_reloads_earlier_waves(fleet_config):
+    fleet.fan_out(fleet_config)
+    before = {name: node_files(fleet_config, name) for name in ('n1', 'n2', 'n3')}
+    fleet_config['subdomains']['a.example.com']['target_port'] = '8080'
+    log = node_log(fleet_config, 'n3')
+    fleet_config['fleet']['nodes']['n3']['reload_command'] = f"sh -c 'echo reload >> {log}; exit 1'"
+
+    summary = fleet.fan_out(fleet_config)
+
+    assert summary['status'] == 'reload_failed'
+    assert summary['waves'] == 3
+    assert summary['nodes']['n3']['reload'] == 'failed'
+    for name in ('n1', 'n2', 'n3'):
+        assert node_files(fleet_config, name) == before[name]
+    # n1 and n2 took the new configuration, so they are reloaded again with the old one
+    assert reloads(fleet_config, 'n1') == 3
+    assert reloads(fleet_config, 'n2') == 3
+    assert reloads(fleet_config, 'n3') == 2
+
+
+def make_lineage(root, subdomain, version=1):
+    """Create a Let's Encrypt lineage: archive/<sub>/*N.pem and live/<sub>/* links to them."""
+    archive = os.path.join(root, 'archive', subdomain)
+    live = os.path.join(root, 'live', subdomain)
+    os.makedirs(archive, exist_ok=True)
+    os.makedirs(live, exist_ok=True)
+    for name in ('fullchain', 'privkey'):
+        with open(os.path.join(archive, f"{name}{version}.pem"), 'w') as f:
+            f.write(f"{subdomain} {name} {version}\n")
+        link = os.path.join(live, f"{name}.pem")
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(f"../../archive/{subdomain}/{name}{version}.pem", link)
+
+
+@pytest.fixture
+def certificate_config(fleet_config, tmp_path):
+    for name, node in fleet_config['fleet']['nodes'].items():
+        node['letsencrypt_dir'] = str(tmp_path / name / 'letsencrypt')
+    root = str(tmp_path / 'letsencrypt')
+    make_lineage(root, 'a.example.com')
+    make_lineage(root, 'b.example.com')
+    return fleet_config
+
+
+def test_certificate_sync_copies_only_changed_files(certificate_config):
+    summary = fleet.fan_out(certificate_config)
+    assert summary['status'] == 'applied'
+    node_root = certificate_config['fleet']['nodes']['n1']['letsencrypt_dir']
+    with open(os.path.join(node_root, 'live', 'a.example.com', 'fullchain.pem')) as f:
+        assert f.read() == "a.example.com fullchain 1\n"
+    inodes = {relpath: os.lstat(os.path.join(node_root, relpath)).st_ino
+              for relpath in fleet.certificate_files(node_root, ['a.example.com', 'b.example.com'])}
+
+    summary = fleet.fan_out(certificate_config)
+    assert summary['status'] == 'unchanged'
+    assert all(result['certificates'] == 0 for result in summary['nodes'].values())
+
+    # A renewal adds archive files and moves the live links; nothing else is copied again
+    make_lineage(fleet.letsencrypt_root(), 'a.example.com', version=2)
+    summary = fleet.fan_out(certificate_config)
+    assert summary['status'] == 'applied'
+    assert summary['nodes']['n1']['certificates'] == 4
+    with open(os.path.join(node_root, 'live', 'a.example.com', 'fullchain.pem')) as f:
+        assert f.read() == "a.example.com fullchain 2\n"
+    for relpath, inode in inodes.items():
+        if relpath.startswith('archive/') or relpath.startswith('live/b.example.com/'):
+            assert os.lstat(os.path.join(node_root, relpath)).st_ino == inode
+
+
+def test_certificate_sync_deletes_removed_lineages(certificate_config):
+    fleet.fan_out(certificate_config)
+    node_roots = [node['letsencrypt_dir'] for node in certificate_config['fleet']['nodes'].values()]
+    assert all(os.path.isdir(os.path.join(root, 'archive', 'b.example.com')) for root in node_roots)
+
+    del certificate_config['subdomains']['b.example.com']
+    summary = fleet.fan_out(certificate_config)
+
+    assert summary['status'] == 'applied'
+    for root in node_roots:
+        assert not os.path.lexists(os.path.join(root, 'live', 'b.example.com'))
+        assert not os.path.lexists(os.path.join(root, 'archive', 'b.example.com'))
+        assert os.path.islink(os.path.join(root, 'live', 'a.example.com', 'fullchain.pem'))
@@ -0,0 +1,73 @@
+# tests/test_health.py
+
+import asyncio
+import logging
+import socket
+import threading
+
+import pytest
+
+from domain_manager.utils.health import check_health, load_health_state, probe_backends
+
+
+@pytest.fixture
+def backend():
+    """Start an asyncio server on 127.0.0.1 in its own thread; yields start(status) -> port."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    servers = []
+
+    def start(status=200):
+        async def handle(reader, writer):
+            await reader.readline()
+            writer.write(f"HTTP/1.0 {status} Status\r\n\r\n".encode())
+            await writer.drain()
+            writer.close()
+
+        server = asyncio.run_coroutine_threadsafe(asyncio.start_server(handle, '127.0.0.1', 0), loop).result()
+        servers.append(server)
+        return str(server.sockets[0].getsockname()[1])
+
+    yield start
+    for server in servers:
+        server.close()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return str(sock.getsockname()[1])
+
+
+def test_check_health_probes_every_backend_and_saves_the_results(backend, tmp_path):
+    up, down = backend(), closed_port()
+    config = {
+        'state_dir': str(tmp_path),
+        'subdomains': {
+            'up.example.com': {'target_ip': '127.0.0.1', 'target_port': up},
+            'down.example.com': {'target_ip': '127.0.0.1', 'target_port': down},
+        },
+    }
+
+    backends, results = check_health(config, logging.getLogger('test'), timeout=2)
+
+    assert backends == {('127.0.0.1', up): ['up.example.com'], ('127.0.0.1', down): ['down.example.com']}
+    assert results[('127.0.0.1', up)]['healthy']
+    assert not results[('127.0.0.1', down)]['healthy']
+    assert results[('127.0.0.1', down)]['error']
+    state = load_health_state(config)
+    assert state[f"127.0.0.1:{up}"]['healthy'] and not state[f"127.0.0.1:{down}"]['healthy']
+
+
+def test_http_probe_treats_server_errors_as_down(backend):
+    ok, failing = backend(204), backend(503)
+
+    results = probe_backends([('127.0.0.1', ok), ('127.0.0.1', failing)], timeout=2, http=True)
+
+    assert results[('127.0.0.1', ok)]['healthy'] and results[('127.0.0.1', ok)]['status'] == 204
+    assert not results[('127.0.0.1', failing)]['healthy']
+    assert results[('127.0.0.1', failing)]['error'] == "HTTP 503"
@@ -0,0 +1,32 @@
+# tests/test_instances.py
+
+from domain_manager.instances import instance_config, nginx_reload_command, nginx_test_command
+
+CONFIG = {
+    'state_dir': '/var/lib/nginx_domain_manager',
+    'subdomains': {},
+    'instances': {
+        'main': {},
+        'edge-b': {'root': '/srv/nginx/edge-b'},
+        'edge-c': {'root': '/srv/nginx/edge-c', 'reload_command': 'systemctl reload nginx@edge-c'},
+    },
+}
+
+
+def test_root_only_instance_targets_its_own_conf():
+    view = instance_config(CONFIG, 'edge-b')
+    assert view['sites_enabled'] == '/srv/nginx/edge-b/etc/nginx/sites-enabled'
+    assert nginx_test_command(view) == ['nginx', '-t', '-c', '/srv/nginx/edge-b/etc/nginx/nginx.conf']
+    assert nginx_reload_command(view) == ['nginx', '-c', '/srv/nginx/edge-b/etc/nginx/nginx.conf', '-s', 'reload']
+
+
+def test_root_with_reload_command_still_tests_its_own_conf():
+    view = instance_config(CONFIG, 'edge-c')
+    assert nginx_test_command(view) == ['nginx', '-t', '-c', '/srv/nginx/edge-c/etc/nginx/nginx.conf']
+    assert nginx_reload_command(view) == ['systemctl', 'reload', 'nginx@edge-c']
+
+
+def test_system_instance_keeps_the_system_commands():
+    view = instance_config(CONFIG, 'main')
+    assert nginx_test_command(view) == ['nginx', '-t']
+    assert nginx_reload_command(view) == ['systemctl', 'reload', 'nginx']
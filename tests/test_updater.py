@@ -0,0 +1,79 @@
+# tests/test_updater.py
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from domain_manager.updater import fetch_latest_release, load_release_cache
+
+RELEASE = {'tag_name': 'v2.0.0', 'body': 'Faster.'}
+ETAG = '"v2.0.0"'
+
+
+@pytest.fixture
+def release_server():
+    """Serve RELEASE with an ETag on 127.0.0.1; yields (url, received If-None-Match headers)."""
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.headers.get('If-None-Match'))
+            if self.headers.get('If-None-Match') == ETAG:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = json.dumps(RELEASE).encode()
+            self.send_response(200)
+            self.send_header('ETag', ETAG)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/latest", requests_seen
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def make_config(tmp_path, url, ttl):
+    return {'state_dir': str(tmp_path), 'update_check': {'url': url, 'ttl': ttl, 'timeout': 5}}
+
+
+def test_fresh_cache_is_used_without_a_request(release_server, tmp_path):
+    url, requests_seen = release_server
+    config = make_config(tmp_path, url, ttl=3600)
+
+    assert fetch_latest_release(config) == RELEASE
+    assert fetch_latest_release(config) == RELEASE
+
+    assert requests_seen == [None]
+    assert load_release_cache(config)['etag'] == ETAG
+
+
+def test_stale_cache_is_revalidated_with_its_etag(release_server, tmp_path):
+    url, requests_seen = release_server
+    config = make_config(tmp_path, url, ttl=0)
+
+    assert fetch_latest_release(config) == RELEASE
+    fetched_at = load_release_cache(config)['fetched_at']
+    assert fetch_latest_release(config) == RELEASE
+
+    assert requests_seen == [None, ETAG]
+    assert load_release_cache(config)['fetched_at'] >= fetched_at
+
+
+def test_offline_mode_never_requests(release_server, tmp_path):
+    url, requests_seen = release_server
+    config = {**make_config(tmp_path, url, ttl=0), 'offline': True}
+
+    assert fetch_latest_release(config) is None
+    assert requests_seen == []